@@ -1,6 +1,7 @@
 #!/usr/bin/python
 
 import sys
+import numpy as np
 from mrbait import misc_utils as utils
 from Bio import AlignIO
 
@@ -9,9 +10,15 @@ from Bio import AlignIO
 class consensAlign():
 	'Consensus alignment object'
 	#Default constructor
-	def __init__(self, alignment, threshold, mask):
+	#engine="numpy" uses the vectorized consensus caller, "python" the column loop
+	def __init__(self, alignment, threshold, mask, engine="numpy"):
 		self.alnVars = []
-		self.conSequence = make_consensus(alignment, threshold, mask)
+		if engine == "numpy":
+			self.conSequence = make_consensus_numpy(alignment, threshold, mask)
+		elif engine == "python":
+			self.conSequence = make_consensus(alignment, threshold, mask)
+		else:
+			raise ValueError("Unknown consensus engine \"%s\""%engine)
 		self.alnVars = get_vars(self.conSequence)
 
 class variablePosition():
@@ -101,6 +108,78 @@ def make_consensus(alignment, threshold, mask):
 				consensus+=reverse_iupac_case(temp)
 	return(consensus)
 
+#Bitmask encoding of nucleotide characters: A=1, C=2, G=4, T=8, N=16, gap=32
+#Index with the byte value of a character (either case). Unknown characters are 0
+IUPAC_BITS = np.zeros(256, dtype=np.uint8)
+for _char, _bits in {"A":1, "C":2, "G":4, "T":8, "N":16, "-":32,
+					"R":5, "Y":10, "S":6, "W":9, "K":12, "M":3,
+					"B":14, "D":13, "H":11, "V":7}.items():
+	IUPAC_BITS[ord(_char)] = _bits
+	IUPAC_BITS[ord(_char.lower())] = _bits
+
+#Lookup of IUPAC code (as byte value) for each 4-bit combination of A/C/G/T
+IUPAC_CODES = np.frombuffer(b"NACMGRSVTWYHKDBN", dtype=np.uint8)
+
+#Flags lower-case (masked) characters by byte value
+IS_LOWER = np.zeros(256, dtype=bool)
+IS_LOWER[ord("a"):ord("z")+1] = True
+
+#Function to encode an alignment as a uint8 matrix (rows=sequences, cols=columns)
+#Accepts an AlignIO alignment, a list of str/bytes rows, or an existing matrix
+def encode_alignment(alignment):
+	if isinstance(alignment, np.ndarray):
+		return alignment
+	rows = [r if isinstance(r, (str, bytes)) else str(r.seq) for r in alignment]
+	if not rows:
+		return np.zeros((0,0), dtype=np.uint8)
+	raw = b"".join(r.encode("ascii") if isinstance(r, str) else r for r in rows)
+	return np.frombuffer(raw, dtype=np.uint8).reshape(len(rows), -1)
+
+#Vectorized version of make_consensus
+#Encodes the whole alignment once and calls every column using array operations
+#Output matches make_consensus for all values of threshold and mask
+def make_consensus_numpy(alignment, threshold, mask):
+	aln = encode_alignment(alignment)
+	aln_depth = aln.shape[0]
+	#If only one sequence in alignment, return same as make_consensus
+	if aln_depth == 1:
+		return chr(aln[0,0])
+
+	bits = IUPAC_BITS[aln]
+	if not bits.all():
+		bad = aln[bits == 0][0]
+		raise KeyError(chr(bad).upper())
+
+	#Per-column counts of each nucleotide (ambiguities count toward each base)
+	counts = [np.count_nonzero(bits & b, axis=0) for b in (1, 2, 4, 8)]
+	isN = (bits == 16)
+	isGap = (bits == 32)
+	n_count = np.count_nonzero(isN, axis=0)
+	gap_count = np.count_nonzero(isGap, axis=0)
+	prop_mask = np.count_nonzero(IS_LOWER[aln], axis=0) / aln_depth
+	ismask = prop_mask > mask
+
+	#N and gaps are evaluated in order of first appearance in the column
+	n_first = (n_count > 0) & ((gap_count == 0) | (isN.argmax(axis=0) < isGap.argmax(axis=0)))
+	pass_n = (n_count > 0) & ((n_count / aln_depth) >= threshold)
+	pass_gap = (gap_count > 0) & ((gap_count / aln_depth) >= threshold)
+	call_n = pass_n & (n_first | ~pass_gap)
+	call_gap = pass_gap & ~call_n
+
+	#Columns of only N/gaps that fail threshold take the most common (not masked)
+	all_bad = ~call_n & ~call_gap & ((n_count + gap_count) >= aln_depth)
+	bad_n = all_bad & ((n_count > gap_count) | ((n_count == gap_count) & n_first))
+	bad_gap = all_bad & ~bad_n
+
+	#Otherwise, call IUPAC code for observed nucleotides
+	code = (counts[0] > 0) * 1 + (counts[1] > 0) * 2 + (counts[2] > 0) * 4 + (counts[3] > 0) * 8
+	consensus = IUPAC_CODES[code]
+	consensus[call_n] = ord("N")
+	consensus[ismask] |= 0x20 #lower case
+	consensus[call_gap | bad_gap] = ord("-")
+	consensus[bad_n] = ord("N")
+	return(consensus.tobytes().decode("ascii"))
+
 #Function to get a list of variablePositions
 def get_vars(con):
 	#print("Parsing: ", con)
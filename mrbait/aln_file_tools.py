@@ -1,9 +1,16 @@
 #!/usr/bin/python
 
 import os
+import io
 import sys
+import mmap
+import gzip
+import zlib
+import struct
+import tempfile
 import Bio
 import vcf
+import numpy as np
 from mrbait import misc_utils as utils
 from Bio import AlignIO
 
@@ -26,38 +33,210 @@ def writeFasta(seqs, fas):
 #Read genome as FASTA. FASTA header will be used
 #This is a generator function
 #Doesn't matter if sequences are interleaved or not.
-def read_fasta(fas):
+#Whitespace at the ends of lines, and spaces anywhere, are removed from sequences
+#By default the file is memory mapped, and each sequence is built with a single
+#copy of its lines; use_mmap=False reads line by line instead, as do compressed
+#(gzip/bgzip) files
+def read_fasta(fas, use_mmap=True):
 
 	if not utils.fileCheck(fas):
 		raise FileNotFoundError("Fatal exception, file %s not found."%fas)
 
-	fh = open(fas)
-	try:
-		with fh as file_object:
-			contig = ""
-			seq = ""
-			for line in file_object:
-				line = line.strip()
-				if not line:
-					continue
-				line = line.replace(" ","")
-				#print(line)
-				if line[0] == ">": #Found a header line
-					#If we already loaded a contig, yield that contig and
-					#start loading a new one
-					if contig:
-						yield([contig,seq]) #yield
-						contig = "" #reset contig and seq
-						seq = ""
-					contig = (line.replace(">",""))
+	if use_mmap and os.path.getsize(fas) > 0 and not utils.compression(fas):
+		with open(fas, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+			for header, start, end in fasta_offsets(mm):
+				seq = mm[start:end]
+				if any([c in seq for c in LINE_END_WHITESPACE]):
+					#Other whitespace is only removed from the ends of lines ("\r" also
+					#ends a line, as in text mode)
+					seq = b"".join([line.strip() for line in seq.replace(b"\r", b"\n").split(b"\n")])
 				else:
-					seq += line
-		#Iyield last sequence, if it has both a header and sequence
-		if contig and seq:
-			yield([contig,seq])
-	finally:
-		fh.close()
-
+					seq = seq.replace(b"\n", b"")
+				if b" " in seq:
+					seq = seq.replace(b" ", b"")
+				#Match the line reader: last contig only yielded if it has sequence
+				if seq or end < len(mm):
+					yield([fasta_header(header), seq.decode()])
+		return
+
+	with utils.open_input(fas, text=True) as file_object:
+		contig = ""
+		seq = list()
+		for line in file_object:
+			line = line.strip()
+			if not line:
+				continue
+			line = line.replace(" ","")
+			if line[0] == ">": #Found a header line
+				#If we already loaded a contig, yield that contig and
+				#start loading a new one
+				if contig:
+					yield([contig,"".join(seq)]) #yield
+					seq = list()
+				contig = (line.replace(">",""))
+			else:
+				seq.append(line)
+	#Iyield last sequence, if it has both a header and sequence
+	if contig and seq:
+		yield([contig,"".join(seq)])
+
+#Whitespace other than spaces and newlines, which read_fasta removes only from the
+#ends of sequence lines (as str.strip() does)
+LINE_END_WHITESPACE = b"\t\r\x0b\x0c"
+
+#Whitespace allowed before the ">" of a header line (read_fasta strips lines first)
+HEADER_INDENT = b" \t\x0b\x0c"
+
+#Function to find the records of a memory-mapped (or bytes) FASTA in a single pass,
+#without copying sequences. Header lines are found with find(), as lines beginning ">"
+#(after any whitespace); as in text mode, a lone "\r" also ends a line
+#Yields (header, start, end) for each record, where header is the raw header line
+#(bytes, without ">") and [start:end) the byte range of its sequence lines
+def fasta_offsets(mm):
+	size = len(mm)
+	line, pos = next_fasta_header(mm, 0)
+	while pos < size:
+		eol = mm.find(b"\n", pos)
+		if eol < 0:
+			eol = size
+		cr = mm.find(b"\r", pos, eol)
+		if 0 <= cr < eol-1:
+			eol = cr
+		line, end = next_fasta_header(mm, eol)
+		yield(mm[pos+1:eol], min(eol+1, size), line)
+		pos = end
+
+#Function to find the first FASTA header line at or after byte start
+#">" is rare in sequence, so find it first and check that only whitespace lies
+#between it and the start of its line
+#Returns (start of the line, position of ">"), or (size, size) if there is none
+def next_fasta_header(mm, start):
+	gt = mm.find(b">", start)
+	while gt >= 0:
+		line = gt
+		while line > 0 and mm[line-1] in HEADER_INDENT:
+			line -= 1
+		if line == 0 or mm[line-1] in b"\r\n":
+			return((line, gt))
+		gt = mm.find(b">", gt+1)
+	return((len(mm), len(mm)))
+
+#Function to make a contig name from a raw FASTA header line, as read_fasta does
+#(surrounding whitespace, spaces, and ">" characters removed)
+def fasta_header(header):
+	return(header.decode().strip().replace(" ","").replace(">",""))
+
+#Function to index a FASTA file in a single pass, as samtools faidx does
+#Returns a list of (name, length, offset, linebases, linewidth), one per contig:
+#name is the first word of the header, offset the byte offset of its first base,
+#and linebases/linewidth the bases and bytes per line. As for samtools, the lines of
+#each contig must all be the same length, except the last
+def index_fasta(fas):
+	if not utils.fileCheck(fas):
+		raise FileNotFoundError("Fatal exception, file %s not found."%fas)
+	records = list()
+	record = None
+	pos = 0
+	with utils.open_input(fas) as file_object:
+		for line in file_object:
+			if line.lstrip(HEADER_INDENT).startswith(b">"):
+				if record is not None:
+					records.append(tuple(record[:5]))
+				words = line.lstrip(HEADER_INDENT)[1:].split()
+				name = words[0].decode() if words else ""
+				#name, length, offset, linebases, linewidth, ended (short line seen)
+				record = [name, 0, pos+len(line), 0, 0, False]
+			elif record is not None:
+				bases = len(line.rstrip(b"\r\n"))
+				if bases > 0 and (record[5] or (record[3] and bases > record[3])):
+					raise ValueError("Contig \"%s\" in %s has lines of different lengths; cannot be indexed"%(record[0], fas))
+				if record[3] == 0:
+					record[3] = bases
+					record[4] = len(line)
+				elif bases < record[3]:
+					record[5] = True
+				record[1] += bases
+			pos += len(line)
+	if record is not None:
+		records.append(tuple(record[:5]))
+	return(records)
+
+#Object for reading the contigs of a FASTA file through a memory map, so that
+#sequences stay on disk and are only read a slice at a time
+#BGZF files are read by block instead; other gzip files can't be read this way
+#If a name is used by more than one contig, the first is kept (see duplicates)
+class genomeFasta():
+	def __init__(self, fas):
+		self.index = dict()
+		self.names = list()
+		self.duplicates = list()
+		for record in record_index(fas, "fasta"):
+			if record[0] in self.index:
+				self.duplicates.append(record[0])
+				continue
+			self.index[record[0]] = record
+			self.names.append(record[0])
+		comp = utils.compression(fas)
+		if comp == "gzip":
+			raise ValueError("%s is gzip-compressed; contigs can only be read from an uncompressed or bgzip-compressed FASTA"%fas)
+		self.fh = open(fas, "rb")
+		if comp == "bgzf":
+			self.mm = bgzfFile(fas)
+		elif os.path.getsize(fas) > 0:
+			self.mm = mmap.mmap(self.fh.fileno(), 0, access=mmap.ACCESS_READ)
+		else:
+			self.mm = b""
+
+	def __enter__(self):
+		return(self)
+
+	def __exit__(self, *args):
+		self.close()
+
+	def close(self):
+		if isinstance(self.mm, (mmap.mmap, bgzfFile)):
+			self.mm.close()
+		self.fh.close()
+
+	#Function to get length of a contig
+	def length(self, name):
+		return(self.index[name][1])
+
+	#Function to get a contig as a faiSequence
+	def sequence(self, name):
+		return(faiSequence(self.mm, *self.index[name][1:]))
+
+#Object for one contig in a genomeFasta: has a length, and slicing it [i:j]
+#returns those bases as a new uint8 array, with line breaks removed
+class faiSequence():
+	def __init__(self, mm, length, offset, linebases, linewidth):
+		self.mm = mm
+		self.length = length
+		self.offset = offset
+		self.linebases = max(linebases, 1)
+		self.linewidth = max(linewidth, 1)
+
+	def __len__(self):
+		return(self.length)
+
+	#Function to get byte offset of base i
+	def filePos(self, i):
+		return(self.offset + (i // self.linebases)*self.linewidth + (i % self.linebases))
+
+	def __getitem__(self, key):
+		i, j, step = key.indices(self.length)
+		if j <= i:
+			return(np.zeros(0, dtype=np.uint8))
+		first = self.filePos(i)
+		last = self.filePos(j-1)+1
+		if isinstance(self.mm, bgzfFile):
+			raw = np.frombuffer(self.mm[first:last], dtype=np.uint8)
+		else:
+			raw = np.frombuffer(self.mm, dtype=np.uint8, count=last-first, offset=first)
+		if self.linewidth > self.linebases:
+			keep = ((np.arange(first, last, dtype=np.int64) - self.offset) % self.linewidth) < self.linebases
+			return(raw[keep])
+		return(raw.copy())
 
 #This is a GENERATOR function to read through a .loci file
 #.loci is the RAD alignment output from the promgram pyRAD
@@ -71,7 +250,7 @@ def read_loci(infile):
 	loci = Bio.Align.MultipleSeqAlignment([])
 	# read file from command line
 	try:
-		f = open(infile)
+		f = utils.open_input(infile, text=True)
 	except IOError as err:
 		print("I/O error({0}): {1}".format(err.errno, err.strerror))
 	except:
@@ -91,17 +270,85 @@ def read_loci(infile):
 				loci = Bio.Align.MultipleSeqAlignment([])
 	f.close()
 
-#Function to remove existing CHUNK files
-def removeChunks(dir_name):
-	test = os.listdir(dir_name)
+#This is a GENERATOR function to read through a MAF file without Bio.AlignIO
+#Only the 's' lines of each 'a' block are kept (no SeqRecord objects are built)
+#YIELDS: tuple of (depth, uint8 matrix), rows=sequences and columns=alignment columns
+#offset/length restrict parsing to a byte range (see index_records)
+def read_maf(infile, offset=0, length=None):
 
-	for item in test:
-	    if item.endswith(".chunk"):
-	        os.remove(os.path.join(dir_name, item))
+	if not utils.fileCheck(infile):
+		raise FileNotFoundError("Fatal exception, file %s not found."%infile)
+
+	with open_range(infile, offset, length) as file_object:
+		rows = []
+		in_block = False
+		for line in file_object:
+			first = line[:1]
+			if first == b"s":
+				if in_block:
+					fields = line.split()
+					if len(fields) != 7:
+						raise ValueError("Error parsing MAF block in <%s>: 's' line must have 7 fields"%infile)
+					rows.append(fields[6])
+			elif first == b"a":
+				if rows:
+					yield maf_block(rows)
+				rows = []
+				in_block = True
+			elif not line.strip():
+				if rows:
+					yield maf_block(rows)
+				rows = []
+				in_block = False
+		if rows:
+			yield maf_block(rows)
+
+#Function to pack a list of equal-length bytes rows into a uint8 matrix
+def rows_to_matrix(rows):
+	alen = len(rows[0])
+	for r in rows:
+		if len(r) != alen:
+			raise ValueError("Error parsing alignment: sequences must all be the same length")
+	return(np.frombuffer(b"".join(rows), dtype=np.uint8).reshape(len(rows), alen))
+
+#Function to pack the sequence rows of one MAF block into a (depth, matrix) tuple
+#'.' in any row means "same as first sequence", as in the MAF specification
+def maf_block(rows):
+	aln = rows_to_matrix(rows)
+	dots = (aln == ord("."))
+	if dots.any():
+		if dots[0].any():
+			raise ValueError("Error parsing MAF block: found dot/period in first sequence")
+		aln = np.where(dots, aln[0], aln)
+	return((len(rows), aln))
+
+#This is a GENERATOR function to read a pyRAD .loci file without Bio.Align
+#Each line is split once and rows are kept as bytes until the locus is complete
+#Loci with fewer than mincov sequences or shorter than minlen are skipped
+#before any matrix is built
+#YIELDS: tuple of (depth, uint8 matrix), rows=sequences and columns=alignment columns
+#offset/length restrict parsing to a byte range (see index_records)
+def read_loci_matrix(infile, mincov=0, minlen=0, offset=0, length=None):
+
+	if not utils.fileCheck(infile):
+		raise FileNotFoundError("Fatal exception, file %s not found."%infile)
+
+	with open_range(infile, offset, length) as file_object:
+		rows = []
+		for line in file_object:
+			if line[:1] == b">":
+				rows.append(line.split()[1])
+			elif line.strip():
+				#"//" line closes the locus
+				if rows and len(rows) >= mincov and len(rows[0]) >= minlen:
+					yield((len(rows), rows_to_matrix(rows)))
+				rows = []
+		if rows and len(rows) >= mincov and len(rows[0]) >= minlen:
+			yield((len(rows), rows_to_matrix(rows)))
 
 #function to count number of loci alignments in file
 def countLoci(loci):
-	fh  = open(loci, 'r')
+	fh  = utils.open_input(loci, text=True)
 	count=0
 	for l in fh:
 		line = l.strip()
@@ -113,7 +360,7 @@ def countLoci(loci):
 
 #function to count number of loci in FASTA file (by headers)
 def countMAF(loci):
-	fh  = open(str(loci), 'r')
+	fh  = utils.open_input(str(loci), text=True)
 	count=0
 	for l in fh:
 		line = l.strip()
@@ -125,7 +372,7 @@ def countMAF(loci):
 
 #function to count number of loci in FASTA file (by headers)
 def countXMFA(loci):
-	fh  = open(str(loci), 'r')
+	fh  = utils.open_input(str(loci), text=True)
 	count=0
 	for l in fh:
 		line = l.strip()
@@ -136,208 +383,350 @@ def countXMFA(loci):
 	return(count)
 
 
-#Function split .loci file into n chunks
-def loci_chunker(infile, chunks, wd):
-
-	chunks = int(chunks)
-	loci_count = countLoci(infile)
-	if loci_count < chunks:
-		chunks = loci_count
-	chunk_size = loci_count // chunks
-	removeChunks(wd)
-
-	files = list()
-	#write .loci file into chunk files
-	with open(infile) as file_object:
-		max_chunks = chunks
-		chunks = 1
-		loci_number = 1
-
-		chunk_file = wd + "/." + str(chunks) + ".chunk"
-		out_object = open(chunk_file, "w")
-		files.append(chunk_file)
-
-		for l in file_object:
-			line = l.strip()
-			if not line:
-				continue
-			if chunks < max_chunks:
-				if loci_number <= chunk_size:
-					if line[0] == ">":
-						out = line + "\n"
-						out_object.write(out)
-					else:
-						loci_number = loci_number + 1
-						out = line + "\n"
-						out_object.write(out)
-				else:
-					loci_number = 1
-					chunks = chunks + 1
-					out_object.close()
-					chunk_file = wd + "/." + str(chunks) + ".chunk"
-					out_object = open(chunk_file, "w")
-					files.append(chunk_file)
-					out = line + "\n"
-					out_object.write(out)
-			else:
-				#If last chunk, keep writing to final chunk file
-				out = line + "\n"
-				out_object.write(out)
-		out_object.close()
-		file_object.close()
-			# else:
-			# 	chunks = max_chunks
-			# 	out_object.write(line.strip())
-	return(files)
-
-#Function to split maf file into n chunks
-def maf_chunker(infile, chunks, wd):
-
-	chunks = int(chunks)
-	loci_count = countMAF(infile)
-	if loci_count < chunks:
-		chunks = loci_count
-	chunk_size = loci_count // chunks
-	removeChunks(wd) #clear any existing chunkfiles
-
-	files = list()
-	#write .loci file into chunk files
-	with open(infile) as file_object:
-		max_chunks = chunks
-		chunks = 1
-		loci_number = 0
-
-		chunk_file = wd + "/." + str(chunks) + ".chunk"
-		out_object = open(chunk_file, "w")
-		files.append(chunk_file)
-
-		header = ""
-		hset = 0
-		for l in file_object:
-			line = l.strip()
-			if not line:
-				continue
-			#First, get header information
-			if hset == 0:
-				if line[0] == "a":
-					loci_number = 1
-					hset=1
-					header += "\n"
-					out_object.write(header)
-					out = "\n" + line + "\n"
-					out_object.write(out)
-				elif line[0] =="#":
-					header +=str(line+"\n")
-			else:
-				#Write chunk_size alignments to each chunk
-				if chunks < max_chunks:
-					#If starting new alignment
-					if line[0] == "a":
-						loci_number += 1 #increment locus number
-					 	#If current chunk not full, add locus to chunk
-						if loci_number <= chunk_size:
-							out = "\n" + line + "\n"
-							out_object.write(out)
-						#Otherwise, start new chunk
-						else:
-							loci_number = 1
-							chunks = chunks + 1
-							out_object.close()
-							chunk_file = wd + "/." + str(chunks) + ".chunk"
-							out_object = open(chunk_file, "w")
-							out_object.write(header)
-							files.append(chunk_file)
-							out = line + "\n"
-							out_object.write(out)
-					#If not new alignment, write to current chunk
-					else:
-						out = line + "\n"
-						out_object.write(out)
-
-				#If last chunk, keep writing to final chunk file
-				else:
-					if line[0] == "a":
-						out = "\n" + line + "\n"
-					else:
-						out = line + "\n"
-					out_object.write(out)
-		out_object.close()
-		file_object.close()
-			# else:
-			# 	chunks = max_chunks
-			# 	out_object.write(line.strip())
-	return(files)
-
-#Function to split xmfa file into n chunks
-def xmfa_chunker(infile, chunks, wd):
-
-	chunks = int(chunks)
-	loci_count = countXMFA(infile)
-	if loci_count < chunks:
-		chunks = loci_count
-	chunk_size = loci_count // chunks
-	removeChunks(wd)
-
-	files = list()
-	#write .loci file into chunk files
-	with open(infile) as file_object:
-		max_chunks = chunks
-		chunks = 1
-		loci_number = 1
-
-		chunk_file = wd + "/." + str(chunks) + ".chunk"
-		out_object = open(chunk_file, "w")
-		files.append(chunk_file)
-
-		header = ""
-		hset = 0
-		for l in file_object:
-			line = l.strip()
-			if not line:
-				continue
-			#First, get header information
-			if hset == 0:
-				if line[0] == ">":
-					loci_number = 1
-					hset=1
-					out_object.write(header)
-					out = line + "\n"
-					out_object.write(out)
-				elif line[0] =="#":
-					header +=str(line+"\n")
+#Class for reading a byte range of a file as if it were the whole file
+#Lets parallel workers parse their own share of an input without chunk files
+#fh is an open binary file object, positioned at the start of the range
+class fileRange(io.RawIOBase):
+	def __init__(self, fh, length):
+		self.fh = fh
+		self.remaining = length
+
+	def readable(self):
+		return True
+
+	def readinto(self, b):
+		n = min(len(b), self.remaining)
+		if n <= 0:
+			return 0
+		got = self.fh.readinto(memoryview(b)[:n])
+		self.remaining -= got
+		return got
+
+	def close(self):
+		self.fh.close()
+		super().close()
+
+#Function to find the blocks of a BGZF file from each block's header (BSIZE)
+#and footer (ISIZE), without decompressing anything
+#Returns (coffsets, uoffsets): arrays of the compressed and uncompressed offsets
+#at which each block begins, each ending with an entry for the end of the file
+def bgzf_blocks(infile):
+	coffsets = [0]
+	uoffsets = [0]
+	size = os.path.getsize(infile)
+	with open(infile, "rb") as fh:
+		while coffsets[-1] < size:
+			fh.seek(coffsets[-1])
+			head = fh.read(12)
+			if len(head) < 12 or head[:2] != b"\x1f\x8b" or not head[3] & 4:
+				raise ValueError("%s is not a BGZF file (bad block at byte %s)"%(infile, coffsets[-1]))
+			extra = fh.read(struct.unpack("<H", head[10:12])[0])
+			bsize = None
+			i = 0
+			while i+4 <= len(extra):
+				slen = struct.unpack("<H", extra[i+2:i+4])[0]
+				if extra[i:i+2] == b"BC" and slen == 2:
+					bsize = struct.unpack("<H", extra[i+4:i+6])[0]
+				i += 4+slen
+			if bsize is None:
+				raise ValueError("%s is not a BGZF file (no block size at byte %s)"%(infile, coffsets[-1]))
+			fh.seek(coffsets[-1]+bsize+1-4)
+			isize = struct.unpack("<I", fh.read(4))[0]
+			coffsets.append(coffsets[-1]+bsize+1)
+			uoffsets.append(uoffsets[-1]+isize)
+	return((np.array(coffsets, dtype=np.int64), np.array(uoffsets, dtype=np.int64)))
+
+#Class for reading a BGZF (bgzip) file by uncompressed offset: seek() goes straight
+#to the block holding that offset (see bgzf_blocks), so parallel workers each
+#decompress only the blocks of their own byte range
+#Slicing [i:j] returns those bytes of the uncompressed file, as for an mmap
+class bgzfFile(io.RawIOBase):
+	def __init__(self, infile):
+		self.fh = open(infile, "rb")
+		self.coffsets, self.uoffsets = bgzf_blocks(infile)
+		self.size = int(self.uoffsets[-1])
+		self.pos = 0
+		self.block = -1 #number of the block held in self.data
+		self.data = b""
+
+	def readable(self):
+		return True
+
+	def seekable(self):
+		return True
+
+	def tell(self):
+		return self.pos
+
+	def seek(self, offset, whence=io.SEEK_SET):
+		if whence == io.SEEK_CUR:
+			offset += self.pos
+		elif whence == io.SEEK_END:
+			offset += self.size
+		self.pos = max(int(offset), 0)
+		return self.pos
+
+	def __len__(self):
+		return(self.size)
+
+	#Function to decompress block k, keeping the last one for sequential reads
+	def loadBlock(self, k):
+		if k != self.block:
+			self.fh.seek(self.coffsets[k])
+			raw = self.fh.read(int(self.coffsets[k+1]-self.coffsets[k]))
+			xlen = struct.unpack("<H", raw[10:12])[0]
+			self.data = zlib.decompress(raw[12+xlen:-8], -15)
+			self.block = k
+		return(self.data)
+
+	def readinto(self, b):
+		if self.pos >= self.size:
+			return 0
+		#Last block starting at or before pos (skips empty blocks)
+		k = int(np.searchsorted(self.uoffsets, self.pos, side="right"))-1
+		data = self.loadBlock(k)
+		start = self.pos - int(self.uoffsets[k])
+		n = min(len(b), len(data)-start)
+		b[:n] = data[start:start+n]
+		self.pos += n
+		return n
+
+	def __getitem__(self, key):
+		i, j, step = key.indices(self.size)
+		if j <= i:
+			return(b"")
+		self.seek(i)
+		buf = bytearray(j-i)
+		view = memoryview(buf)
+		got = 0
+		while got < len(buf):
+			got += self.readinto(view[got:])
+		return(bytes(buf))
+
+	def close(self):
+		self.fh.close()
+		super().close()
+
+#Read buffer for BGZF files (the largest block is 64 kb uncompressed)
+BGZF_BUFFER = 65536
+
+#Function to open an input file in binary mode for reading and seeking
+#BGZF files are read by block (see bgzfFile); other gzip files as one stream,
+#so seeking forward in those means decompressing everything before that point
+def open_seekable(infile):
+	comp = utils.compression(infile)
+	if comp == "bgzf":
+		return io.BufferedReader(bgzfFile(infile), BGZF_BUFFER)
+	elif comp == "gzip":
+		return gzip.open(infile, "rb")
+	return open(infile, "rb")
+
+#Function to tell if byte ranges of an input can be read independently, without
+#decompressing the file from the start: true for uncompressed and BGZF files
+def splittable(infile):
+	return(utils.compression(infile) != "gzip")
+
+#Function to open a byte range of a file (whole file if length is None)
+#Offsets are into the uncompressed file, for gzip/bgzip inputs
+#Returns a binary file object, or a text file object if text=True
+def open_range(infile, offset=0, length=None, text=False):
+	fh = open_seekable(infile)
+	if offset:
+		fh.seek(offset)
+	if length is not None:
+		fh = io.BufferedReader(fileRange(fh, length))
+	if text:
+		return io.TextIOWrapper(fh)
+	return fh
+
+#Function to read the lines of several byte ranges of a file, in order
+#ranges is a list of (offset, length) tuples; yields str lines
+def range_lines(infile, ranges):
+	for offset, length in ranges:
+		with open_range(infile, offset, length, text=True) as file_object:
+			for line in file_object:
+				yield line
+
+#Function to find record boundaries of an alignment file in a single pass
+#fmt is one of "loci", "maf", or "xmfa"
+#Returns a list of (offset, length, depth, name) tuples, one per alignment record;
+#name is the locus number of a .loci record ("//...|name|"), or the first sequence
+#name of a MAF ("s" line) or XMFA (">" line) record, if any
+def index_records(infile, fmt):
+	if fmt not in ("loci", "maf", "xmfa"):
+		raise ValueError("Unknown alignment format \"%s\""%fmt)
+	records = list()
+	pos = 0 #byte offset of the current line
+	start = None #byte offset where the current record began
+	depth = 0
+	name = ""
+	with utils.open_input(infile) as file_object:
+		for line in file_object:
+			first = line.lstrip()[:1]
+			if fmt == "maf":
+				#Records begin at each 'a' line and run to the next one
+				if first == b"a":
+					if start is not None:
+						records.append((start, pos-start, depth, name))
+					start = pos
+					depth = 0
+					name = ""
+				elif first == b"s" and start is not None:
+					if depth == 0:
+						name = record_name(line.split()[1:2])
+					depth += 1
+			elif fmt == "loci":
+				#Records end with the "//" line
+				if first == b">":
+					if start is None:
+						start = pos
+						depth = 0
+					depth += 1
+				elif start is not None and first == b"/":
+					fields = line.rstrip().rstrip(b"|").split(b"|")
+					name = record_name(fields[-1:] if len(fields) > 1 else [])
+					records.append((start, pos+len(line)-start, depth, name))
+					start = None
 			else:
-				if chunks < max_chunks:
-					if loci_number <= chunk_size:
-						#If its the header for a sequence, start seq
-						if line[0] == ">":
-							out = line + "\n"
-							out_object.write(out)
-						#If end of alignment, deposit it
-						elif line[0] == "=":
-							loci_number = loci_number + 1
-							out = line + "\n"
-							out_object.write(out)
-						#otherwise its a sequence!
-						else:
-							out = line + "\n"
-							out_object.write(out)
-					else:
-						loci_number = 1
-						chunks = chunks + 1
-						out_object.close()
-						chunk_file = wd + "/." + str(chunks) + ".chunk"
-						out_object = open(chunk_file, "w")
-						out_object.write(header)
-						files.append(chunk_file)
-						out = line + "\n"
-						out_object.write(out)
+				#Records end with the "=" line
+				if first == b">":
+					if start is None:
+						start = pos
+						depth = 0
+						name = record_name(line.lstrip()[1:].split()[:1])
+					depth += 1
+				elif start is not None and first == b"=":
+					records.append((start, pos+len(line)-start, depth, name))
+					start = None
+			pos += len(line)
+	#Final record, if not closed
+	if start is not None:
+		records.append((start, pos-start, depth, name if fmt != "loci" else ""))
+	return(records)
+
+#Function to find the blocks of consecutive records with the same CHROM in a VCF
+#file in a single pass (offsets are into the uncompressed file); the header is
+#everything before the first block
+#Returns a list of (chrom, offset, length, records) tuples, one per block
+def index_vcf(infile):
+	if not utils.fileCheck(infile):
+		raise FileNotFoundError("Fatal exception, file %s not found."%infile)
+	records = list()
+	pos = 0
+	with utils.open_input(infile) as file_object:
+		for line in file_object:
+			if line[:1] != b"#" and line.strip():
+				chrom = line.split(None, 1)[0].decode()
+				if records and records[-1][0] == chrom:
+					records[-1][2] = pos+len(line)-records[-1][1]
+					records[-1][3] += 1
 				else:
-					#If last chunk, keep writing to final chunk file
-					out = line + "\n"
-					out_object.write(out)
-		out_object.close()
-		file_object.close()
-			# else:
-			# 	chunks = max_chunks
-			# 	out_object.write(line.strip())
-	return(files)
+					records.append([chrom, pos, len(line), 1])
+			pos += len(line)
+	return([tuple(record) for record in records])
+
+#Function to make a record name from a list of at most one bytes field
+def record_name(fields):
+	return(fields[0].strip().decode() if fields else "")
+
+#Format version of the sidecar indexes written by record_index
+INDEX_VERSION = 2
+
+#Column types of sidecar index records, by input format (see index_fasta and index_records)
+INDEX_COLUMNS = {
+	"fasta" : (str, int, int, int, int),
+	"loci" : (int, int, int, str),
+	"maf" : (int, int, int, str),
+	"xmfa" : (int, int, int, str),
+	"vcf" : (str, int, int, int)
+}
+
+#Function to get the size and modification time (ns) of a file
+#Used to tell if an index, or a database loaded from the file, is still current
+def file_key(infile):
+	stat = os.stat(infile)
+	return((stat.st_size, stat.st_mtime_ns))
+
+#Function to get the record index of an input file (index_fasta for "fasta",
+#index_vcf for "vcf", otherwise index_records), cached in a sidecar file <infile>.mbi
+#The sidecar is used only if it was written for the same format, file size and
+#mtime; otherwise the input is indexed and the sidecar (re)written, if possible
+def record_index(infile, fmt):
+	if fmt not in INDEX_COLUMNS:
+		raise ValueError("Unknown input format \"%s\""%fmt)
+	if not utils.fileCheck(infile):
+		raise FileNotFoundError("Fatal exception, file %s not found."%infile)
+	sidecar = infile + ".mbi"
+	header = "\t".join(["#mrbait_index", str(INDEX_VERSION), fmt] + [str(x) for x in file_key(infile)])
+	records = read_index(sidecar, header, INDEX_COLUMNS[fmt])
+	if records is not None:
+		return(records)
+	if fmt == "fasta":
+		records = index_fasta(infile)
+	elif fmt == "vcf":
+		records = index_vcf(infile)
+	else:
+		records = index_records(infile, fmt)
+	write_index(sidecar, header, records)
+	return(records)
+
+#Function to write a sidecar index, with the number of records at the end of the header
+#Written to a temp file which then replaces the sidecar, so that an interrupted
+#write never leaves a partial index; if it can't be written, the run goes on without it
+def write_index(sidecar, header, records):
+	tmp = None
+	try:
+		fd, tmp = tempfile.mkstemp(prefix=os.path.basename(sidecar)+".", suffix=".tmp",
+			dir=os.path.dirname(os.path.abspath(sidecar)))
+		with os.fdopen(fd, "w") as file_object:
+			file_object.write(header+"\t"+str(len(records))+"\n")
+			for record in records:
+				file_object.write("\t".join([str(x) for x in record])+"\n")
+		os.replace(tmp, sidecar)
+	except OSError:
+		if tmp is not None and os.path.exists(tmp):
+			os.remove(tmp)
+
+#Function to read a sidecar index written by write_index
+#Returns None if it doesn't exist, its header line doesn't match, or it doesn't
+#hold the number of records given in the header
+def read_index(sidecar, header, columns):
+	if not utils.fileCheck(sidecar):
+		return(None)
+	records = list()
+	try:
+		with open(sidecar) as file_object:
+			first = file_object.readline().rstrip("\n").rsplit("\t", 1)
+			if len(first) != 2 or first[0] != header:
+				return(None)
+			for line in file_object:
+				fields = line.rstrip("\n").split("\t")
+				if not line.endswith("\n") or len(fields) != len(columns):
+					return(None)
+				records.append(tuple([col(x) for col, x in zip(columns, fields)]))
+			if len(records) != int(first[1]):
+				return(None)
+	except (OSError, ValueError):
+		return(None)
+	return(records)
+
+#Function to group consecutive records into up to n contiguous byte ranges
+#Ranges hold about the same number of bytes (not records), so that a few long
+#alignments don't all end up with one worker
+#records are tuples starting (offset, length), as from index_records
+#Returns list of (offset, length) tuples
+def chunk_ranges(records, chunks):
+	chunks = min(int(chunks), len(records))
+	if chunks <= 0:
+		return(list())
+	total = sum([record[1] for record in records])
+	ranges = list()
+	first = 0
+	size = 0
+	for i, record in enumerate(records):
+		offset, length = record[:2]
+		size += length
+		if size*chunks >= total*(len(ranges)+1) or i == len(records)-1:
+			ranges.append((records[first][0], offset+length-records[first][0]))
+			first = i+1
+	return(ranges)
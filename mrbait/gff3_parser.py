@@ -3,6 +3,7 @@
 import os
 import sys
 import urllib.parse
+from mrbait import misc_utils as utils
 
 #Function to split GFF attributes
 def splitAttributes(a):
@@ -52,11 +53,48 @@ def GFFRecordAsDict(things):
 	rec["attributes"] = None if things[8] == "." else splitAttributes(urllib.parse.unquote(things[8]))
 	return rec
 
-#function to read a GFF file
-#Generator function, yields individual elements
-def read_gff(g):
+#Class for holding only the GFF fields used by loadGFF, with __slots__
+#seqid, type, start and end are decoded as in GFFRecord; attributes are kept as
+#text, and only searched for Alias by getAlias()
+class GFFFeature():
+	__slots__ = ["seqid", "type", "start", "end", "attributes"]
+	def __init__(self, things):
+		self.seqid = "NULL" if things[0] == "." else unquote(things[0])
+		self.type = "NULL" if things[2] == "." else unquote(things[2])
+		self.start = "NULL" if things[3] == "." else int(things[3])
+		self.end = "NULL" if things[4] == "." else int(things[4])
+		self.attributes = things[8]
+
+	def getAlias(self):
+		"""Returns value of alias if exists, and False if it doesn't exist"""
+		return(getAlias(self.attributes))
+
+#Function to URL-decode a GFF field, only if it has escaped characters
+def unquote(field):
+	if "%" in field:
+		return(urllib.parse.unquote(field))
+	return(field)
+
+#Function to get the Alias attribute from GFF attributes text, as GFFRecord does
+#(last Alias, case-insensitive, lowercased); returns False if there is none
+def getAlias(attributes):
+	if attributes == "." or attributes == "":
+		return(False)
+	attributes = unquote(attributes).lower()
+	if "alias" not in attributes:
+		return(False)
+	alias = False
+	for thing in attributes.split(";"):
+		stuff = thing.split("=")
+		if len(stuff) == 2 and stuff[0] == "alias":
+			alias = stuff[1]
+	return(alias)
+
+#Function to read the 9 columns of each line of a GFF file
+#Generator function, yields each line split into columns
+def read_gff_lines(g):
 	bad = 0 #tracker for if we have bad lines
-	gf = open(g)
+	gf = utils.open_input(g, text=True)
 	try:
 		with gf as file_object:
 			for line in file_object:
@@ -73,8 +111,18 @@ def read_gff(g):
 					elif bad == 1:
 						sys.exit("Fatal error: GFF file does not appear to be standard-compatible. See https://github.com/The-Sequence-Ontology/Specifications/blob/master/gff3.md")
 				#line = utils.removeURL(line) #Sanitize any URLs out
-				rec = GFFRecord(things)
-
-				yield(rec)
+				yield(things)
 	finally:
 		gf.close()
+
+#function to read a GFF file
+#Generator function, yields individual elements
+def read_gff(g):
+	for things in read_gff_lines(g):
+		yield(GFFRecord(things))
+
+#function to read a GFF file, decoding only the fields used by loadGFF
+#Generator function, yields GFFFeature objects
+def read_gff_features(g):
+	for things in read_gff_lines(g):
+		yield(GFFFeature(things))
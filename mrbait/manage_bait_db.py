@@ -3,16 +3,52 @@
 import sys
 import sqlite3
 from sqlite3 import OperationalError
+import numpy as np
 import pandas as pd
 from mrbait import misc_utils as utils
 from mrbait import sequence_tools as s
 
+#PRAGMA settings for each --db_profile
+#safe: SQLite defaults (rollback journal, fsync on every commit)
+#fast: WAL journal, no fsync, large page cache and mmap, temp tables in memory
+#memory: as fast, but the pipeline runs on an in-memory copy (see backup_db)
+DB_PROFILES = {
+	"safe" : [("journal_mode", "DELETE"), ("synchronous", "FULL"),
+		("cache_size", -2000), ("mmap_size", 0), ("temp_store", "DEFAULT")],
+	"fast" : [("journal_mode", "WAL"), ("synchronous", "OFF"),
+		("cache_size", -262144), ("mmap_size", 1073741824), ("temp_store", "MEMORY")],
+	"memory" : [("synchronous", "OFF"), ("cache_size", -262144), ("temp_store", "MEMORY")]
+}
+
 #Function to create database connection
 #Add code later to enable re-running from existing database
-def create_connection(db):
-	conn = sqlite3.connect(db)
+def create_connection(db, profile="safe"):
+	if profile == "memory":
+		conn = sqlite3.connect(":memory:")
+		#Pull in existing database (e.g. when using --resume)
+		disk = sqlite3.connect(db)
+		disk.backup(conn)
+		disk.close()
+	else:
+		conn = sqlite3.connect(db)
+	set_profile(conn, profile)
 	return conn
 
+#Function to apply PRAGMA settings for a DB_PROFILES entry
+def set_profile(conn, profile):
+	if profile not in DB_PROFILES:
+		raise ValueError("Unknown database profile: %s"%profile)
+	cur = conn.cursor()
+	for pragma, value in DB_PROFILES[profile]:
+		cur.execute("PRAGMA %s=%s;"%(pragma, value))
+
+#Function to write an in-memory database out to disk using the backup API
+def backup_db(conn, db):
+	disk = sqlite3.connect(db)
+	conn.commit()
+	conn.backup(disk)
+	disk.close()
+
 
 #Initialize empty databases
 def init_new_db(connection):
@@ -21,6 +57,7 @@ def init_new_db(connection):
 	clearGFF(connection)
 	clearTargets(connection)
 	clearBaits(connection)
+	clearInputs(connection)
 
 #Function to clear baits table
 def clearBaits(conn):
@@ -92,6 +129,61 @@ def clearGFF(conn):
 			stop INTEGER NOT NULL, alias TEXT, pass INTEGER NOT NULL,
 			FOREIGN KEY (locid) REFERENCES loci(id))
 	''')
+	#GFF types kept when loading was restricted to the types of -F gff= filters
+	#(empty if records of every type were loaded, or none would pass validation)
+	cursor.execute('''DROP TABLE IF EXISTS gff_types''')
+	cursor.execute('''CREATE TABLE gff_types(type TEXT NOT NULL)''')
+	conn.commit()
+
+#Function to clear the record of input files (written in Step 1, checked by --resume)
+def clearInputs(conn):
+	cursor = conn.cursor()
+	cursor.execute('''DROP TABLE IF EXISTS inputs''')
+	#size and mtime (ns) as from aln_file_tools.file_key
+	cursor.execute('''
+		CREATE TABLE inputs(path TEXT NOT NULL, type TEXT NOT NULL,
+			size INTEGER NOT NULL, mtime INTEGER NOT NULL)
+	''')
+	conn.commit()
+
+#Secondary indexes for the pass filters and joins used throughout this module
+#Created after each table is bulk loaded (see create_indexes/drop_indexes)
+#loci_chrom is for add_gff_record, which looks up one locus per GFF record (loadGFF
+#maps chroms to loci in Python instead, see getLocusChroms)
+#gff_pass_type covers the passing GFF records (of a type) read by regionFilterGFF
+INDEXES = {
+	"loci" : [("loci_pass", "pass"), ("loci_chrom", "chrom")],
+	"regions" : [("regions_pass", "pass"), ("regions_locid", "locid")],
+	"baits" : [("baits_pass", "pass"), ("baits_regid", "regid")],
+	"gff" : [("gff_pass_type", "pass, type, locid, start, stop")]
+}
+
+#Function to create indexes for the given tables (default: all)
+def create_indexes(conn, tables=None):
+	cur = conn.cursor()
+	if tables is None:
+		tables = list(INDEXES.keys())
+	for table in tables:
+		for name, columns in INDEXES[table]:
+			cur.execute("CREATE INDEX IF NOT EXISTS %s ON %s(%s);"%(name, table, columns))
+	conn.commit()
+
+#Function to drop indexes for the given tables (default: all), e.g. before bulk loading
+def drop_indexes(conn, tables=None):
+	cur = conn.cursor()
+	if tables is None:
+		tables = list(INDEXES.keys())
+	for table in tables:
+		for name, columns in INDEXES[table]:
+			cur.execute("DROP INDEX IF EXISTS %s;"%name)
+	conn.commit()
+
+#Function to update table statistics used by the query planner
+#analysis_limit keeps this fast on large tables (ignored by SQLite < 3.32)
+def analyze_db(conn):
+	cur = conn.cursor()
+	cur.execute("PRAGMA analysis_limit=1000;")
+	cur.execute("ANALYZE;")
 	conn.commit()
 
 
@@ -118,10 +210,25 @@ def filterLoci(conn, minlen, mincov, max_ambig, max_mask):
 def getPassedLoci(conn):
 	return(pd.read_sql_query("""SELECT id, consensus, chrom FROM loci WHERE pass=1""", conn))
 
+#Function returns pandas dataframe of passedLoci, without consensus sequences
+def getPassedLociInfo(conn):
+	return(pd.read_sql_query("""SELECT id, chrom, length FROM loci WHERE pass=1""", conn))
+
+#Function returns dict of locus chrom to (id, length), for all loci
+#If several loci share a chrom, the first (lowest id) is used
+def getLocusChroms(conn):
+	cur = conn.cursor()
+	cur.execute("""SELECT id, chrom, length FROM loci ORDER BY id DESC""")
+	return(dict([(chrom, (locid, length)) for locid, chrom, length in cur.fetchall()]))
+
 #Function returns a Pandas DataFrame of passing target regions
 def getPassedTRs(conn):
 	return(pd.read_sql_query("""SELECT regid, sequence FROM regions WHERE pass=1""", conn))
 
+#Function returns a Pandas DataFrame of passing target regions, without sequences
+def getPassedTRInfo(conn):
+	return(pd.read_sql_query("""SELECT regid, locid, start, stop FROM regions WHERE pass=1""", conn))
+
 #Function to parse fetchone() results (internal)
 def parseFetchNum(fet):
 	if fet is None:
@@ -170,6 +277,26 @@ def getNumConflicts(conn):
 	except OperationalError:
 		return(False)
 
+#Function returns list of (path, type, size, mtime) of input files loaded in Step 1
+#Returns None for databases made before inputs were recorded
+def getInputs(conn):
+	cur = conn.cursor()
+	try:
+		cur.execute("""SELECT path, type, size, mtime FROM inputs""")
+		return(cur.fetchall())
+	except OperationalError:
+		return(None)
+
+#Function returns list of GFF types kept when loading the GFF (see clearGFF)
+#Empty if records of every type were loaded
+def getGFFTypes(conn):
+	cur = conn.cursor()
+	try:
+		cur.execute("""SELECT type FROM gff_types""")
+		return([row[0] for row in cur.fetchall()])
+	except OperationalError:
+		return([])
+
 #Function returns pandas dataframe of passedLoci
 def getNumTRs(conn):
 	cur = conn.cursor()
@@ -233,17 +360,84 @@ def getPassedBaits(conn):
 # def getVariants(conn):
 # 	return(pd.read_sql_query("""SELECT * FROM variants """, conn))
 
+#Default number of rows to hold before flushing to the database
+BATCH_SIZE = 10000
+
+#Class to accumulate rows and hand them to write() in batches
+#write is e.g. an add_*_records function with conn bound, or queue.put
+class rowBatcher():
+	def __init__(self, write, size=BATCH_SIZE):
+		self.write = write
+		self.size = max(1, int(size))
+		self.rows = list()
+
+	def add(self, row):
+		self.rows.append(row)
+		if len(self.rows) >= self.size:
+			self.flush()
+
+	#Write any pending rows; returns whatever write() returns
+	def flush(self):
+		if not self.rows:
+			return(None)
+		rows = self.rows
+		self.rows = list()
+		return(self.write(rows))
+
+#Function to INSERT many rows into table with one executemany and one commit
+#Returns range of rowids assigned to the new rows (rowids are contiguous because
+#they are assigned as max(rowid)+1 within a single transaction)
+def insert_records(conn, table, sql, rows):
+	cur = conn.cursor()
+	cur.execute("SELECT MAX(rowid) FROM %s"%table)
+	last = cur.fetchone()[0]
+	if last is None:
+		last = 0
+	cur.executemany(sql, rows)
+	conn.commit()
+	return(range(last+1, last+1+max(cur.rowcount, 0)))
+
+#Function to load integer ids (and optionally a value for each) into an indexed
+#TEMP table <name>(id INTEGER PRIMARY KEY, value), replacing any earlier one
+#Repeated ids keep their first value
+def load_temp_ids(conn, name, ids, values=None):
+	cur = conn.cursor()
+	cur.execute("DROP TABLE IF EXISTS temp.%s"%name)
+	cur.execute("CREATE TEMP TABLE %s(id INTEGER PRIMARY KEY, value)"%name)
+	if values is None:
+		cur.executemany("INSERT OR IGNORE INTO temp.%s(id) VALUES (?)"%name, ((int(i),) for i in ids))
+	else:
+		cur.executemany("INSERT OR IGNORE INTO temp.%s(id, value) VALUES (?,?)"%name, ((int(i), v) for i, v in zip(ids, values)))
+
+#Function to SET <column> of <table> from (id, value) pairs, matching ids on <key>
+#Uses UPDATE ... FROM where SQLite supports it (3.33+)
+def bulk_update(conn, table, key, column, ids, values):
+	cur = conn.cursor()
+	load_temp_ids(conn, "bulk", ids, values)
+	if sqlite3.sqlite_version_info >= (3, 33, 0):
+		sql = "UPDATE %s SET %s = bulk.value FROM temp.bulk AS bulk WHERE bulk.id = %s.%s"%(table, column, table, key)
+	else:
+		sql = '''UPDATE %s SET %s = (SELECT value FROM temp.bulk WHERE id = %s.%s)
+			WHERE %s IN (SELECT id FROM temp.bulk)'''%(table, column, table, key, key)
+	cur.execute(sql)
+	cur.execute("DROP TABLE temp.bulk")
+	conn.commit()
+
+#Function to SET <column> of <table> to <value> where <key> is in ids
+#(or with exclude=True, where it is NOT in ids)
+def bulk_set(conn, table, key, column, value, ids, exclude=False):
+	cur = conn.cursor()
+	load_temp_ids(conn, "bulk", ids)
+	sql = "UPDATE %s SET %s = ? WHERE %s %sIN (SELECT id FROM temp.bulk)"%(table, column, key, "NOT " if exclude else "")
+	cur.execute(sql, (value,))
+	cur.execute("DROP TABLE temp.bulk")
+	conn.commit()
+
 #Code to add record to 'loci' table
 def add_locus_record(conn, depth, consensus, passed, name):
 	if name == None:
 		name = "NA"
-	seq_norm = s.simplifySeq(consensus)
-	counts = s.seqCounterSimple(seq_norm)
-	ambig = counts["N"]/len(consensus)
-	gap = counts["-"]/len(consensus)
-	mask = s.mask_content(consensus)
-	gc = s.gc_content(consensus)
-	stuff = [depth, int(len(consensus)), str(consensus), int(passed), str(name), float(ambig), float(gap), float(mask), float(gc)]
+	stuff = locus_row(depth, consensus, passed, name)
 	try:
 		sql = ''' INSERT INTO loci(depth, length, consensus, pass, chrom, ambig, gap, mask, gc)
 					VALUES(?,?,?,?,?,?,?,?,?) '''
@@ -254,6 +448,34 @@ def add_locus_record(conn, depth, consensus, passed, name):
 		print("Constraint failed: Skipping locus \"%s\" because it already exists, this is usually caused by duplicate headers when parsing a FASTA file."%name)
 	return cur.lastrowid
 
+#Function to build the values of a 'loci' row without touching the database
+#Used so that worker processes can compute rows and leave writing to one process
+def locus_row(depth, consensus, passed, name):
+	seq_norm = s.simplifySeq(consensus)
+	counts = s.seqCounterSimple(seq_norm)
+	ambig = counts["N"]/len(consensus)
+	gap = counts["-"]/len(consensus)
+	mask = s.mask_content(consensus)
+	gc = s.gc_content(consensus)
+	return((depth, int(len(consensus)), str(consensus), int(passed), str(name), float(ambig), float(gap), float(mask), float(gc)))
+
+#Function to build a 'loci' row for a contig kept on disk (--genome): the consensus
+#is left empty, and composition comes from sequence_tools.compositionCounts
+def genome_locus_row(name, length, counts):
+	return((1, int(length), "", 1, str(name), counts["N"]/length, counts["-"]/length, counts["mask"]/length, counts["gc"]/length))
+
+#Function to insert many rows from locus_row into 'loci'; returns range of locus ids
+def add_locus_records(conn, rows):
+	sql = ''' INSERT INTO loci(depth, length, consensus, pass, chrom, ambig, gap, mask, gc)
+				VALUES(?,?,?,?,?,?,?,?,?) '''
+	return(insert_records(conn, "loci", sql, rows))
+
+
+#Code to add (path, type, size, mtime) rows to 'inputs' table
+def add_input_records(conn, rows):
+	sql = ''' INSERT INTO inputs(path, type, size, mtime)
+				VALUES(?,?,?,?) '''
+	return(insert_records(conn, "inputs", sql, rows))
 
 #Code to add record to 'bait' table
 def add_bait_record(conn, reg, seq, start, stop, mask, gc):
@@ -267,6 +489,18 @@ def add_bait_record(conn, reg, seq, start, stop, mask, gc):
 	conn.commit()
 	return cur.lastrowid
 
+#Function to build the values of a 'baits' row without touching the database
+def bait_row(reg, seq, start, stop, mask, gc):
+	mask_p = float(mask/len(seq))
+	gc_p = float(gc/len(seq))
+	return((int(reg), seq, int(start), int(stop), float(mask_p), float(gc_p)))
+
+#Function to insert many rows from bait_row into 'baits'; returns range of baitids
+def add_bait_records(conn, rows):
+	sql = ''' INSERT INTO baits(regid, sequence, start, stop, mask, gc, pass)
+				VALUES(?,?,?,?,?,?,1) '''
+	return(insert_records(conn, "baits", sql, rows))
+
 #Code to add record to GFF table
 def add_gff_record(conn,seqid, gff_type, start, stop, alias):
 	cur = conn.cursor()
@@ -285,6 +519,21 @@ def add_gff_record(conn,seqid, gff_type, start, stop, alias):
 		cur.execute(sql, stuff)
 		conn.commit()
 
+#Function to build the values of a GFF row
+def gff_row(locid, gff_type, start, stop, alias):
+	return((int(locid), str(gff_type), int(start), int(stop), str(alias)))
+
+#Function to insert many rows from gff_row into 'gff'; returns range of gffids
+def add_gff_records(conn, rows):
+	sql = ''' INSERT INTO gff(locid, type, start, stop, alias, pass)
+				VALUES(?,?,?,?,?,1);'''
+	return(insert_records(conn, "gff", sql, rows))
+
+#Function to record the GFF types kept when loading the GFF
+def add_gff_types(conn, types):
+	sql = ''' INSERT INTO gff_types(type) VALUES(?) '''
+	return(insert_records(conn, "gff_types", sql, [(t,) for t in types]))
+
 """DEPRECATED"""
 # #Code to add to 'variants' table
 # def add_variant_record(conn, loc, pos, val):
@@ -309,17 +558,27 @@ def add_region_record(conn, locid, start, stop, seq, counts, fcounts, mask, gc):
 	#Establish cursor
 	cur = conn.cursor()
 
-	mask_p = float(mask/len(seq))
-	gc_p = float(gc/len(seq))
 	#build sql and pack values to insert
 	sql = '''INSERT INTO regions(locid, length, sequence, vars, bad, gap, mask, gc,
 		vars_flank, bad_flank, gap_flank, start, stop, pass) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,1)'''
-	stuff = [locid, len(seq), seq, counts["*"], counts["N"], counts["-"], mask_p, gc_p, fcounts["*"], fcounts["N"], fcounts["-"],start, stop]
+	stuff = region_row(locid, start, stop, seq, counts, fcounts, mask, gc)
 
 	#insert
 	cur.execute(sql, stuff)
 	conn.commit()
 
+#Function to build the values of a 'regions' row without touching the database
+def region_row(locid, start, stop, seq, counts, fcounts, mask, gc):
+	mask_p = float(mask/len(seq))
+	gc_p = float(gc/len(seq))
+	return((locid, len(seq), seq, counts["*"], counts["N"], counts["-"], mask_p, gc_p, fcounts["*"], fcounts["N"], fcounts["-"],start, stop))
+
+#Function to insert many rows from region_row into 'regions'; returns range of regids
+def add_region_records(conn, rows):
+	sql = '''INSERT INTO regions(locid, length, sequence, vars, bad, gap, mask, gc,
+		vars_flank, bad_flank, gap_flank, start, stop, pass) VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,1)'''
+	return(insert_records(conn, "regions", sql, rows))
+
 
 #Function to FAIL any GFF elements that do not overlap with our sequence for the given locus/region
 def validateGFFRecords(conn):
@@ -501,6 +760,12 @@ def updateConsensus(conn, key, seq):
 	cur.execute(sql, stuff)
 	conn.commit()
 
+#Function to update the consensus of many loci: rows of (consensus, id)
+def update_consensus_records(conn, rows):
+	cur = conn.cursor()
+	cur.executemany("UPDATE loci SET consensus = ? WHERE id = ?", rows)
+	conn.commit()
+
 #Internal function for checking if TRs overlap within distance buffer
 def checkOverlap(row1, row2, dist):
 	#This could be made much more concise
@@ -579,10 +844,8 @@ def initializeConflicts(conn):
 	cur.execute(sql2)
 	conn.commit()
 
-#Function to take a pointer to a pandas dataframe, send to SQL, and update conflicts table
+#Function to take a pointer to a pandas dataframe and update conflict_block in conflicts table
 def updateConflictsFromPandas(conn, df):
-	cur = conn.cursor()
-
 	#Fetch number of entries in conflict tables
 	rows = getConflictNumRows(conn)
 
@@ -590,27 +853,10 @@ def updateConflictsFromPandas(conn, df):
 	if rows is 0 or rows is None:
 		raise ValueError("There are no rows in <conflicts>!")
 
-	df.to_sql('t', conn, if_exists='replace')
+	bulk_update(conn, "conflicts", "regid", "conflict_block", df["regid"].tolist(), df["conflict_block"].tolist())
 
-	#Hacky way to do it, but SQlite doesn't support FROM clause in UPDATEs...
-	sql_update = '''
-		UPDATE
-			conflicts
-		SET
-			conflict_block = (SELECT t.conflict_block FROM t WHERE t.regid = conflicts.regid)
-		WHERE
-			EXISTS(SELECT * FROM t WHERE t.regid = conflicts.regid)
-	'''
-	cur.execute(sql_update)
-
-	#Clear up the temp table t
-	cur.execute("DROP TABLE IF EXISTS t")
-	conn.commit()
-
-#Function to take a pointer to a pandas dataframe, send to SQL, and update conflicts table
+#Function to take a pointer to a pandas dataframe and update choose in conflicts table
 def updateChosenFromPandas(conn, df):
-	cur = conn.cursor()
-
 	#Fetch number of entries in conflict tables
 	rows = getConflictNumRows(conn)
 
@@ -618,22 +864,7 @@ def updateChosenFromPandas(conn, df):
 	if rows is 0 or rows is None:
 		raise ValueError("There are no rows in <conflicts>!")
 
-	df.to_sql('t', conn, if_exists='replace')
-
-	#Hacky way to do it, but SQlite doesn't support FROM clause in UPDATEs...
-	sql_update = '''
-		UPDATE
-			conflicts
-		SET
-			choose = (SELECT t.choose FROM t WHERE t.regid = conflicts.regid)
-		WHERE
-			EXISTS(SELECT * FROM t WHERE t.regid = conflicts.regid)
-	'''
-	cur.execute(sql_update)
-
-	#Clear up the temp table t
-	cur.execute("DROP TABLE IF EXISTS t")
-	conn.commit()
+	bulk_update(conn, "conflicts", "regid", "choose", df["regid"].tolist(), df["choose"].tolist())
 
 #Function to build conflicts table when --R is false
 def fetchConflictTRs_NoMult(conn):
@@ -695,69 +926,45 @@ def fetchConflictTRs(conn, min_len, dist):
 	'''
 
 	df = pd.read_sql_query(sql_test, conn)
-	#Set block num start at 1+ last locid (to prevent overlap in block nums)
-	block = int(max(df["locid"]) + 1) #make sure to enforce integer type, or it fucks up in sql later
-	#Split df into locid groups (retains INDEX of each entry, but in separate dfs)
-	groups = df.groupby("locid")
-	for group, _df in groups:
-		group_df = _df.sort_values(by="start", ascending=True, kind='mergesort')
-		#If only one TR for alignment, set choose to 1:
-		if group_df.shape[0] == 1:
-			for name, row in group_df.iterrows():
-				#modify original dataframe
-				df.loc[name, "conflict_block"] = row["locid"]
-				df.loc[name, "choose"] = 1
-		else:
-			#print("\n########Group is: ",group,"\n")
-			#print(group_df)
-			#For each TR in locus
-			#Create iterable
-			row_iterator = group_df.iterrows()
-			_i, last_row = row_iterator.__next__() #grab first item
-			#print("First row:",_i,last_row)
-			#Make sure it is from a long enough locus
-			if last_row["length"] <= min_len:
-				df.loc[_i, "conflict_block"] = last_row["locid"]
-			#For each next row (starting at row 2)
-			for i, next_row in row_iterator:
-				#print("Comparing row ",_i," and ", i)
-				if next_row["length"] <= min_len:
-					df.loc[i, "conflict_block"] = next_row["locid"]
-				#If they overlap, assign them both to same conflict block
-				if checkOverlap(last_row, next_row, dist) == 1:
-					#print("overlap!")
-					#Fetch conflict_block currents from parent df
-					cb = df.loc[i, "conflict_block"]
-					_cb = df.loc[_i, "conflict_block"]
-					#If neither is assigned, assign both to new block
-					if (cb == "NULL") and (_cb == "NULL"):
-						#print("Assigning block: ",block)
-						df.loc[_i, "conflict_block"] = block
-						df.loc[i, "conflict_block"] = block
-						block+=1
-					#Else if row1 is assigned, give row2 the block of row1
-					#If last_row is assigned, move next_row to same block
-					elif cb == "NULL":
-						df.loc[i, "conflict_block"] = df.loc[_i, "conflict_block"]
-					#Or if row2 has block, assign it to row1
-					elif _cb == "NULL":
-						df.loc[_i, "conflict_block"] = df.loc[i, "conflict_block"]
-				#If they don't overlap, assign last_row to its own conflict block
-				#current next_row will then get checked with its next neighbor
-				#in the next iteration.
-				else:
-					df.loc[_i, "conflict_block"] = block
-					block += 1
-
+	if df.shape[0] == 0:
+		return
+	blocks, counts = conflictBlocks(df["locid"].to_numpy(), df["start"].to_numpy(),
+		df["stop"].to_numpy(), df["length"].to_numpy(), min_len, dist)
 	#Set choose=1 for any which have no conflicts
-	df.loc[~df.duplicated("conflict_block",keep=False),"choose"] = 1
-	#print(df)
-	#Next step, send df back to SQLite and update conflicts table
-	updateConflictsFromPandas(conn, df)
-	updateChosenFromPandas(conn, df)
+	choose = [1 if c == 1 else "NULL" for c in counts]
+	#Next step, update conflicts table
+	sql = "UPDATE conflicts SET conflict_block=?, choose=? WHERE regid=?"
+	cur.executemany(sql, zip(blocks.tolist(), choose, df["regid"].tolist()))
+	conn.commit()
 	#DEBUG print
 	#print(pd.read_sql_query("SELECT * FROM conflicts", conn))
 
+#Function to assign targets to conflict blocks, sweeping each locus by start
+#Targets within dist of each other, directly or through other targets, share a
+#block (numbered from 1+ last locid); on loci with length <= min_len or with one
+#target, all targets share one block, numbered by locid
+#Returns arrays of conflict_block and the size of that block, in input order
+def conflictBlocks(locid, start, stop, length, min_len, dist):
+	order = np.lexsort((start, locid))
+	loc = locid[order]
+	first = np.ones(len(loc), dtype=bool) #first target of each locus
+	first[1:] = loc[1:] != loc[:-1]
+	last = np.ones(len(loc), dtype=bool) #last target of each locus
+	last[:-1] = first[1:]
+	#Furthest any earlier target of the same locus reaches (stop + dist)
+	reach = pd.Series(stop[order] + dist).groupby(loc).cummax().to_numpy()
+	new = first.copy()
+	new[1:] |= start[order][1:] > reach[:-1]
+	#Short loci, and loci with one target, are one block
+	whole = (length[order] <= min_len) | (first & last)
+	new &= ~whole
+	blocks = np.where(whole, loc, int(locid.max()) + np.cumsum(new))
+	#Back to input order
+	out = np.empty_like(blocks)
+	out[order] = blocks
+	uniq, inverse, counts = np.unique(out, return_inverse=True, return_counts=True)
+	return(out, counts[inverse])
+
 #Function for random selection of TRs within conflict blocks
 def regionSelectRandom(conn):
 	cur = conn.cursor()
@@ -874,94 +1081,35 @@ def regionSelect_SNP(conn):
 # 	print(pd.read_sql_query(sql, conn))
 
 
-#Function to loop though pandas DF of conflict counts and choose best by "minimum"
+#Function to choose best by "minimum" from pandas DF of conflict counts
 def parseCountsMin(df):
-	#Loop through groups and select lowest
-	groups = df.groupby("conflict_block")
-	for group, group_df in groups:
-		#print("\n########Conflict Block is: ",group,"\n")
-		#print(group_df)
-		#If only one TR for alignment, set choose to 1:
-		if group_df.shape[0] == 1:
-			for name, row in group_df.iterrows():
-				#modify original dataframe
-				df.loc[name, "choose"] = 1
-		else:
-			#For each TR in locus
-			chosen_ones = []
-			best = 0
-			track = 0
-			#Loop through and figure out which is best
-			for name, row in group_df.iterrows():
-				if track == 0:
-					best = row["counts"]
-					chosen_ones = [name]
-					track = 1
-				else:
-					if row["counts"] > best:
-						continue
-					elif row["counts"] < best:
-						#If this is the best we've seen, replace chosen_ones with new choice
-						best = row["counts"]
-						chosen_ones = [name]
-					elif row["counts"] == best:
-						#If its a tie, add to list of chosen_ones
-						chosen_ones.append(name)
-
-			#Use chosen list to assign values
-			#If one chosen, set chosen to 1/True and the rest to 0/False
-			if len(chosen_ones) == 1:
-				df.loc[df["conflict_block"] == group, "choose"] = 0
-				df.loc[chosen_ones[0], "choose"] = 1
-			#Elif, multiple were chosen
-			elif len(chosen_ones) > 1:
-				df.loc[df["conflict_block"] == group, "choose"] = 0
-				for i in chosen_ones:
-					df.loc[i, "choose"] = "NULL"
-			# else:
-			# 	message = "Error: No TR chosen for block " + group + ", something went wrong"
-			# 	raise RuntimeError(message)
-	return(df)
+	return(chooseBestCounts(df, "min"))
 
-#Function to go through pandas df of conflict counts and choose best by "maximum"
+#Function to choose best by "maximum" from pandas DF of conflict counts
+#Blocks where no TR has counts > 0 are left unchanged
 def parseCountsMax(df):
-	groups = df.groupby("conflict_block")
-	for group, group_df in groups:
-		#print("\n########Conflict Block is: ",group,"\n")
-		#print(group_df)
-		#If only one TR for alignment, set choose to 1:
-		if group_df.shape[0] == 1:
-			for name, row in group_df.iterrows():
-				#modify original dataframe
-				df.loc[name, "choose"] = 1
-		else:
-			#For each TR in locus
-			chosen_ones = []
-			best = 0
-			#Loop through and figure out which is best
-			for name, row in group_df.iterrows():
-				if row["counts"] < best:
-					continue
-				elif row["counts"] > best:
-					#If this is the best we've seen, replace chosen_ones with new choice
-					best = row["counts"]
-					chosen_ones = [name]
-				elif row["counts"] == best and best != 0:
-					#If its a tie, add to list of chosen_ones
-					chosen_ones.append(name)
-			#Use chosen list to assign values
-			#If one chosen, set chosen to 1/True and the rest to 0/False
-			if len(chosen_ones) == 1:
-				df.loc[df["conflict_block"] == group, "choose"] = 0
-				df.loc[chosen_ones[0], "choose"] = 1
-			#Elif, multiple were chosen
-			elif len(chosen_ones) > 1:
-				df.loc[df["conflict_block"] == group, "choose"] = 0
-				for i in chosen_ones:
-					df.loc[i, "choose"] = "NULL"
-			# else:
-			# 	message = "Error: No TR chosen for block %s, something went wrong"%(group)
-			# 	raise RuntimeError(message)
+	return(chooseBestCounts(df, "max", floor=0))
+
+#Function to choose the best TR of each conflict block by counts, per block at once
+#<best> is "min" or "max": a sole best TR gets choose=1 and the rest of its block 0;
+#tied best TRs are left "NULL" (rest 0), for regionSelectRandom to resolve
+#Blocks of one TR get choose=1; if <floor> is given, blocks whose best is not
+#above it are left unchanged
+def chooseBestCounts(df, best, floor=None):
+	block = df["conflict_block"]
+	groups = df["counts"].groupby(block)
+	top = groups.transform(best)
+	size = groups.transform("size")
+	winner = df["counts"] == top
+	ties = winner.groupby(block).transform("sum")
+	choose = pd.Series(0, index=df.index, dtype=object)
+	choose[winner & (ties > 1)] = "NULL"
+	choose[winner & (ties == 1)] = 1
+	if floor is not None:
+		keep = ~(top > floor)
+		choose[keep] = df.loc[keep, "choose"]
+	choose[size == 1] = 1
+	df["choose"] = choose
 	return(df)
 
 #Function to prints flanking SNPs for conflicting regions...
@@ -1192,79 +1340,24 @@ def regionFilterGC(conn, minprop, maxprop):
 
 #Function to remove targets NOT included in list
 def removeRegionsByWhitelist(conn, whitelist):
-
-	cur = conn.cursor()
 	#If nothing in list, no need to do any work:
 	if len(whitelist) <= 0:
 		return(0)
-	df = pd.DataFrame({"regid" : whitelist})
-	df.to_sql('tt', conn, if_exists='replace')
-
-	#Hacky way to do it, but SQlite doesn't support FROM clause in UPDATEs...
-	sql_update = '''
-		UPDATE
-			regions
-		SET
-			pass = 0
-		WHERE
-			NOT EXISTS(SELECT * FROM tt WHERE tt.regid = regions.regid)
-	'''
-	cur.execute(sql_update)
-	#Clear up the temp table t
-	cur.execute("DROP TABLE IF EXISTS tt")
-	conn.commit()
+	bulk_set(conn, "regions", "regid", "pass", 0, whitelist, exclude=True)
 
 #Function to remove Target Regions given a list of blacklisted regids
 def removeRegionsByList(conn, blacklist):
-
-	cur = conn.cursor()
 	#If nothing in list, no need to do any work:
 	if len(blacklist) <= 0:
 		return(0)
-	df = pd.DataFrame({"regid" : blacklist})
-	df.to_sql('tt', conn, if_exists='replace')
-
-	#Hacky way to do it, but SQlite doesn't support FROM clause in UPDATEs...
-	sql_update = '''
-		UPDATE
-			regions
-		SET
-			pass = 0
-		WHERE
-			EXISTS(SELECT * FROM tt WHERE tt.regid = regions.regid)
-	'''
-	cur.execute(sql_update)
-	#Clear up the temp table t
-	cur.execute("DROP TABLE IF EXISTS tt")
-	conn.commit()
+	bulk_set(conn, "regions", "regid", "pass", 0, blacklist)
 
 #Function to remove baits given a list of blacklisted regids
 def removeBaitsByList(conn, blacklist):
-
-	cur = conn.cursor()
-
 	#If nothing in list, no need to do any work:
 	if len(blacklist) <= 0:
 		return(0)
-	df = pd.DataFrame({"baitid" : blacklist})
-	#print(df)
-
-	df.to_sql('b', conn, if_exists='replace')
-
-	#Hacky way to do it, but SQlite doesn't support FROM clause in UPDATEs...
-	sql_update = '''
-		UPDATE
-			baits
-		SET
-			pass = 0
-		WHERE
-			EXISTS(SELECT * FROM b WHERE b.baitid = baits.baitid)
-	'''
-	cur.execute(sql_update)
-
-	#Clear up the temp table t
-	cur.execute("DROP TABLE IF EXISTS b")
-	conn.commit()
+	bulk_set(conn, "baits", "baitid", "pass", 0, blacklist)
 
 #Function to remove baits NOT included in list
 def removeBaitsByWhitelist(conn, whitelist):
@@ -1357,38 +1450,31 @@ def baitFilterRandom(conn, num):
 def regionFilterGFF(conn, gff_type, dist):
 	cur = conn.cursor()
 
-	if getNumGFF(conn) > 0:
-		if getNumPassedGFF(conn) > 0:
+	#If only some types were loaded (see clearGFF), the GFF had passing records
+	#of some type, even if the table is empty
+	loaded = getGFFTypes(conn)
+	if getNumGFF(conn) > 0 or loaded:
+		if getNumPassedGFF(conn) > 0 or loaded:
 			df = pd.DataFrame() #empty pandas DF
 			#If get GFF by type:
 			if gff_type == "all":
 				sql = """
-					SELECT regid, regions.start, regions.stop, regions.pass,
-						gffid, gff.start AS gff_start, gff.stop AS gff_stop
-					FROM
-						regions INNER JOIN gff ON regions.locid = gff.locid
-					WHERE
-						regions.pass = 1 AND gff.pass = 1
+					SELECT locid, start, stop FROM gff WHERE pass = 1
 				"""
 				df = pd.read_sql_query(sql, conn)
 			else:
-				#Query database to get targets with passing GFFs
+				#Query database to get passing GFFs of type
 				sql = """
-					SELECT regid, regions.start, regions.stop, regions.pass,
-						gffid, gff.start AS gff_start, gff.stop AS gff_stop
-					FROM
-						regions INNER JOIN gff ON regions.locid = gff.locid
-					WHERE
-						regions.pass = 1 AND gff.pass = 1 AND gff.type = ?
+					SELECT locid, start, stop FROM gff WHERE pass = 1 AND type = ?
 				"""
 				df = pd.read_sql_query(sql, conn, params=(gff_type,))
 
-			whitelist = parseJoinGFFTable(df, dist)
+			whitelist = parseGFFProximity(getPassedTRInfo(conn), df, dist)
 			removeRegionsByWhitelist(conn, whitelist)
 
 			"""
-			1. Fetch INNER JOINED db matching criterion
-			2. Parse overlaps in Python (see function above)
+			1. Fetch passing targets, and GFF records matching criterion
+			2. Find targets near a GFF record, using a sorted index of GFF records per locus
 			3. Return list of ones to keep.
 			4. For UPDATE- Set pass to 0 if: pass NOT 1 in returned list, OR if already failed
 				This should also fail the case where NO GFF RECORDS TO JOIN or gff record was failed
@@ -1410,28 +1496,18 @@ def regionFilterGFF_Alias(conn, gff_type, dist):
 			#If get GFF by type:
 			if gff_type == "all":
 				sql = """
-					SELECT regid, regions.start, regions.stop, regions.pass,
-						gffid, gff.start AS gff_start, gff.stop AS gff_stop
-					FROM
-						regions INNER JOIN gff ON regions.locid = gff.locid
-					WHERE
-						regions.pass = 1 AND gff.pass = 1 AND gff.alias != "NULL"
+					SELECT locid, start, stop FROM gff WHERE pass = 1 AND alias != "NULL"
 				"""
 				df = pd.read_sql_query(sql, conn)
 			else:
-				#Query database to get targets with passing GFFs
+				#Query database to get passing GFFs with alias
 				sql = """
-					SELECT regid, regions.start, regions.stop, regions.pass,
-						gffid, gff.start AS gff_start, gff.stop AS gff_stop
-					FROM
-						regions INNER JOIN gff ON regions.locid = gff.locid
-					WHERE
-						regions.pass = 1 AND gff.pass = 1 AND gff.alias = ?
+					SELECT locid, start, stop FROM gff WHERE pass = 1 AND alias = ?
 				"""
 				df = pd.read_sql_query(sql, conn, params=(gff_type,))
 
 			#Get list of passed targets, pass list to FAIL all non-whitelisted targets
-			whitelist = parseJoinGFFTable(df, dist)
+			whitelist = parseGFFProximity(getPassedTRInfo(conn), df, dist)
 			removeRegionsByWhitelist(conn, whitelist)
 
 		else:
@@ -1441,20 +1517,45 @@ def regionFilterGFF_Alias(conn, gff_type, dist):
 		print("WARNING: No GFF records present in database. Skipping target region filtering on proximity to GFF records.")
 	conn.commit()
 
-#Function to parse an INNER JOIN regions/gff table for overlapping fragments, and return whitelist
-def parseJoinGFFTable(df, dist):
-	for index, row in df.iterrows():
-		min1 = row["start"] - dist or 0
-		min2 = row["gff_start"]
-		max1 = row["stop"] + dist
-		max2 = row["gff_stop"]
-		#If no overlap (overlap distance <= 0), set 'pass' to 0/FAIL
-		if utils.calcOverlap(min1, max1, min2, max2) <= 0:
-			df.loc[index, "pass"] = 0
-
-	#Get list of passed targets, pass list to FAIL all non-whitelisted targets
-	whitelist = df[df["pass"]==1].regid.unique()
-	return(whitelist)
+#Sorted interval index over GFF records (locid, start, stop), per locus
+#For each locus, records are sorted by start, with the running maximum of stop,
+#so whether any record overlaps an interval is one binary search
+class gffIndex():
+	def __init__(self, gff):
+		self.loci = dict()
+		#Records with stop <= start can't overlap anything (see near())
+		gff = gff[gff["stop"] > gff["start"]].sort_values(["locid", "start"])
+		for locid, group in gff.groupby("locid", sort=False):
+			starts = group["start"].to_numpy()
+			stops = np.maximum.accumulate(group["stop"].to_numpy())
+			self.loci[locid] = (starts, stops)
+
+	#Returns boolean array: True where [mins[i], maxs[i]] overlaps any record on locid,
+	#by more than zero bases (i.e. utils.calcOverlap(mins[i], maxs[i], start, stop) > 0)
+	def near(self, locid, mins, maxs):
+		if locid not in self.loci:
+			return(np.zeros(len(mins), dtype=bool))
+		starts, stops = self.loci[locid]
+		#Records before k start before maxs[i]; one of them must stop after mins[i]
+		k = np.searchsorted(starts, maxs, side="left")
+		hit = np.zeros(len(mins), dtype=bool)
+		found = k > 0
+		hit[found] = stops[k[found]-1] > mins[found]
+		return(hit & (maxs > mins))
+
+#Function to get regids of targets (regid, locid, start, stop) within dist of a GFF record
+#Returns array of regids, as a whitelist
+def parseGFFProximity(regions, gff, dist):
+	index = gffIndex(gff)
+	whitelist = list()
+	for locid, group in regions.groupby("locid", sort=False):
+		mins = group["start"].to_numpy() - dist
+		maxs = group["stop"].to_numpy() + dist
+		hits = index.near(locid, mins, maxs)
+		whitelist.append(group["regid"].to_numpy()[hits])
+	if not whitelist:
+		return(np.array([], dtype=int))
+	return(np.concatenate(whitelist))
 
 """DEPRECATED"""
 # #Function to parse variants table to update regions VARS for flanking information
@@ -1584,8 +1685,7 @@ def getRegionWeightsByList(conn, fetch):
 	cur = conn.cursor()
 	if len(fetch) <= 0:
 		return(None)
-	df = pd.DataFrame({"regid" : fetch})
-	df.to_sql('ttt', conn, if_exists='replace')
+	load_temp_ids(conn, "ttt", fetch)
 
 	sql = """
 	SELECT
@@ -1595,11 +1695,11 @@ def getRegionWeightsByList(conn, fetch):
 	FROM
 		regions
 	WHERE
-		regions.regid IN (SELECT regid FROM ttt)
+		regions.regid IN (SELECT id FROM temp.ttt)
 	"""
 	new_df = pd.read_sql_query(sql ,conn)
 
-	cur.execute("DROP TABLE IF EXISTS ttt")
+	cur.execute("DROP TABLE temp.ttt")
 	conn.commit()
 	return(new_df)
 
@@ -1608,8 +1708,7 @@ def getRegionWeightsByList_BAD(conn, fetch):
 	cur = conn.cursor()
 	if len(fetch) <= 0:
 		return(None)
-	df = pd.DataFrame({"regid" : fetch})
-	df.to_sql('ttt', conn, if_exists='replace')
+	load_temp_ids(conn, "ttt", fetch)
 
 	sql = """
 	SELECT
@@ -1618,11 +1717,11 @@ def getRegionWeightsByList_BAD(conn, fetch):
 	FROM
 		regions
 	WHERE
-		regions.regid IN (SELECT regid FROM ttt)
+		regions.regid IN (SELECT id FROM temp.ttt)
 	"""
 	new_df = pd.read_sql_query(sql ,conn)
 
-	cur.execute("DROP TABLE IF EXISTS ttt")
+	cur.execute("DROP TABLE temp.ttt")
 	conn.commit()
 
 	#adjust weights to be: max(weight)-weight:
@@ -1636,8 +1735,7 @@ def getRegionWeightsByList_VAR(conn, fetch):
 	cur = conn.cursor()
 	if len(fetch) <= 0:
 		return(None)
-	df = pd.DataFrame({"regid" : fetch})
-	df.to_sql('ttt', conn, if_exists='replace')
+	load_temp_ids(conn, "ttt", fetch)
 
 	sql = """
 	SELECT
@@ -1646,11 +1744,11 @@ def getRegionWeightsByList_VAR(conn, fetch):
 	FROM
 		regions
 	WHERE
-		regions.regid IN (SELECT regid FROM ttt)
+		regions.regid IN (SELECT id FROM temp.ttt)
 	"""
 	new_df = pd.read_sql_query(sql ,conn)
 
-	cur.execute("DROP TABLE IF EXISTS ttt")
+	cur.execute("DROP TABLE temp.ttt")
 	conn.commit()
 	return(new_df)
 
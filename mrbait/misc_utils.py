@@ -3,6 +3,7 @@
 import sys
 import os
 import os.path
+import gzip
 import pandas as pd
 import re
 import operator
@@ -21,6 +22,26 @@ def getMaxKey(d):
 def fileCheck(f):
 	return (os.path.isfile(f))
 
+#Function to tell if a file is compressed, from its first bytes
+#Returns "bgzf" (blocked gzip, as written by bgzip), "gzip", or None
+def compression(f):
+	with open(f, "rb") as fh:
+		head = fh.read(16)
+	if head[:2] != b"\x1f\x8b":
+		return(None)
+	#BGZF blocks are gzip members with an extra field (FLG.FEXTRA) holding a 'BC' subfield
+	if len(head) == 16 and head[3] & 4 and head[12:14] == b"BC":
+		return("bgzf")
+	return("gzip")
+
+#Function to open an input file for reading, decompressing gzip/bgzip files
+#(detected by content, not extension) as a single stream
+#Returns a binary file object, or a text file object if text=True
+def open_input(f, text=False):
+	if compression(f):
+		return(gzip.open(f, "rt" if text else "rb"))
+	return(open(f, "r" if text else "rb"))
+
 #Function calculates union length of overlapping fixed length lines
 def calculateUnionLengthFixed(n, l, o):
     #N is number of lines
@@ -7,6 +7,7 @@ from timeit import default_timer as timer
 from mrbait import mrbait_menu
 from mrbait.mrbait_menu import parseArgs
 from mrbait import manage_bait_db as m
+from mrbait import aln_file_tools
 from mrbait import mrbait_corefuncs as core
 from mrbait import mrbait_corefuncs_parallel as pcore
 
@@ -43,148 +44,177 @@ def main():
 	#Intiate database connection
 	print ("\tLoading SQLite Database...")
 	print ("\t\tEstablishing database connection:", params.db)
-	conn = m.create_connection(params.db)
+	print ("\t\tDatabase profile (--db_profile):", params.db_profile)
+	conn = m.create_connection(params.db, params.db_profile)
 
 	#Initialize empty databases
 	#if conn.empty() or something like that
 	if params.resume:
 		step = params.resume + 1
+		#Databases from older runs may not have indexes yet
+		m.create_indexes(conn)
+		m.analyze_db(conn)
+		#Check (by size and mtime) that inputs haven't changed since Step 1
+		if step > 1:
+			core.checkInputs(conn, params)
 	else:
 		step = 0
-	while step < 6:
-		if step == 0:
-			#Establishing new database
-			start = timer()
-			print ("\t\tInitializing empty tables.\n")
-			m.init_new_db(conn)
-			step = 1
-			printTime(start,2)
-		elif step == 1:
-			start = timer()
-			#Loading inputs
-			print ("\n\tStep 1: Loading Alignments")
-			#Clear database
-			if m.getNumPassedLoci(conn) > 0:
-				print("\t\tClearing existing records from database")
+	#With --db_profile memory, the database is also saved if a step stops early
+	#(e.g. sys.exit); uncommitted work is dropped first, as it would be on disk
+	try:
+		while step < 6:
+			if step == 0:
+				#Establishing new database
+				start = timer()
+				print ("\t\tInitializing empty tables.\n")
 				m.init_new_db(conn)
-			loadAlignments(conn, params)
-			#PASS=1 is PASS=FALSE
-			#Pre-filters: Length, alignment depth
-			print("\t\tFiltering loci...",end="")
-			m.filterLoci(conn, params.minlen, params.cov, params.max_ambig, params.max_mask)
-			#print(m.getLoci(conn))
-			print(" Done!\n")
-			passedLoci = m.getNumPassedLoci(conn)
-			if passedLoci <= 0:
-				sys.exit("\nProgram killed: No loci passed filtering.\n")
-			else:
-				print("\t\t### Results: %s loci passed filtering! ###"%passedLoci)
-			if params.print_loc:
-				print("\t\tPrinting locus catalog to file...")
-				core.printLoci(conn, params)
-			step = 2
-			printTime(start,2)
-		elif step == 2:
-			start = timer()
-			#Target discovery
-			print("\n\tStep 2: Target Discovery")
-			#Check that database has loci
-			passedLoci = m.getNumPassedLoci(conn)#returns pandas dataframe
-			if passedLoci <= 0:
-				sys.exit("\nProgram killed: No loci in database.\n")
-			else:
-				#Check if targets exist
-				#If yes, clear them
-				numTRs = m.getNumTRs(conn)
-				if numTRs > 0:
-					print("\t\tWarning: Database already contains targets. Clearing existing records.")
+				step = 1
+				printTime(start,2)
+			elif step == 1:
+				start = timer()
+				#Loading inputs
+				print ("\n\tStep 1: Loading Alignments")
+				#Clear database
+				if m.getNumPassedLoci(conn) > 0:
+					print("\t\tClearing existing records from database")
+					m.init_new_db(conn)
+				loadAlignments(conn, params)
+				core.recordInputs(conn, params)
+				#PASS=1 is PASS=FALSE
+				#Pre-filters: Length, alignment depth
+				print("\t\tFiltering loci...",end="")
+				m.filterLoci(conn, params.minlen, params.cov, params.max_ambig, params.max_mask)
+				#print(m.getLoci(conn))
+				#Index loaded tables and update query planner statistics
+				m.create_indexes(conn, ["loci", "gff"])
+				m.analyze_db(conn)
+				print(" Done!\n")
+				passedLoci = m.getNumPassedLoci(conn)
+				if passedLoci <= 0:
+					sys.exit("\nProgram killed: No loci passed filtering.\n")
+				else:
+					print("\t\t### Results: %s loci passed filtering! ###"%passedLoci)
+				if params.print_loc:
+					print("\t\tPrinting locus catalog to file...")
+					core.printLoci(conn, params)
+				step = 2
+				printTime(start,2)
+			elif step == 2:
+				start = timer()
+				#Target discovery
+				print("\n\tStep 2: Target Discovery")
+				#Check that database has loci
+				passedLoci = m.getNumPassedLoci(conn)#returns pandas dataframe
+				if passedLoci <= 0:
+					sys.exit("\nProgram killed: No loci in database.\n")
+				else:
+					#Check if targets exist
+					#If yes, clear them
+					numTRs = m.getNumTRs(conn)
+					if numTRs > 0:
+						print("\t\tWarning: Database already contains targets. Clearing existing records.")
+						m.clearBaits(conn)
+						m.clearTargets(conn)
+
+					#Target discovery call; regions is bulk loaded without indexes
+					m.drop_indexes(conn, ["regions"])
+					targetDiscovery(conn, params)
+					m.create_indexes(conn, ["regions"])
+					m.analyze_db(conn)
+					passed = m.getNumPassedTRs(conn)
+					if passed <= 0:
+						sys.exit("\nProgram killed: No viable targets found.\n")
+					else:
+						print("\n\t\t### Results: %s potential targets identified! ###"%passed)
+					step = 3
+					printTime(start,2)
+				step = 3
+				#print(m.getRegions(conn))
+			elif step == 3:
+				start = timer()
+				print("\n\tStep 3: Target Filtering and Selection")
+				#Target filtering and conflict resolution
+				passedLoci = m.getNumPassedLoci(conn)#returns pandas dataframe
+				passedTargets = m.getNumPassedTRs(conn)
+				if passedLoci <= 0:
+					sys.exit("\nProgram killed: No loci in database.\n")
+				elif passedTargets <= 0:
+					sys.exit("\nProgram killed: No targets in database.\n")
+				else:
+					#Clear baits
 					m.clearBaits(conn)
-					m.clearTargets(conn)
-
-				#Target discovery call
-				targetDiscovery(conn, params)
+					#select: resolve conflicts, apply filters
+					selectFilterTargets(conn, params)
 				passed = m.getNumPassedTRs(conn)
+				if params.print_tr:
+					print("\t\tPrinting targets to file...")
+					core.printTargets(conn, params)
 				if passed <= 0:
-					sys.exit("\nProgram killed: No viable targets found.\n")
+					sys.exit("\nProgram killed: No targets passed filtering.\n")
 				else:
-					print("\n\t\t### Results: %s potential targets identified! ###"%passed)
-				step = 3
+					print("\n\t\t### Results: %s targets passed filtering! ###"%passed)
 				printTime(start,2)
-			step = 3
-			#print(m.getRegions(conn))
-		elif step == 3:
-			start = timer()
-			print("\n\tStep 3: Target Filtering and Selection")
-			#Target filtering and conflict resolution
-			passedLoci = m.getNumPassedLoci(conn)#returns pandas dataframe
-			passedTargets = m.getNumPassedTRs(conn)
-			if passedLoci <= 0:
-				sys.exit("\nProgram killed: No loci in database.\n")
-			elif passedTargets <= 0:
-				sys.exit("\nProgram killed: No targets in database.\n")
-			else:
-				#Clear baits
-				m.clearBaits(conn)
-				#select: resolve conflicts, apply filters
-				selectFilterTargets(conn, params)
-			passed = m.getNumPassedTRs(conn)
-			if params.print_tr:
-				print("\t\tPrinting targets to file...")
-				core.printTargets(conn, params)
-			if passed <= 0:
-				sys.exit("\nProgram killed: No targets passed filtering.\n")
-			else:
-				print("\n\t\t### Results: %s targets passed filtering! ###"%passed)
-			printTime(start,2)
-			step = 4
-		elif step == 4:
-			#Bait discovery
-			start = timer()
-			print("\n\tStep 4: Bait discovery")
-			passedLoci = m.getNumPassedLoci(conn)#returns pandas dataframe
-			passedTargets = m.getNumPassedTRs(conn)
-			if passedLoci <= 0:
-				sys.exit("\nProgram killed: No loci in database.\n")
-			elif passedTargets <= 0:
-				sys.exit("\nProgram killed: No targets in database.\n")
-			else:
-				#clear baits
-				m.clearBaits(conn)
-				baitDiscovery(conn, params)
-				passed = m.getNumPassedBaits(conn)
-				if passed <= 0:
-					sys.exit("\nProgram killed: No baits found.\n")
-				else:
-					print("\n\t\t### Results: %s potential baits identified! ###"%passed)
-			printTime(start,2)
-			step = 5
-		elif step == 5:
-			start = timer()
-			print("\n\tStep 5: Bait filtering")
-			passedLoci = m.getNumPassedLoci(conn)#returns pandas dataframe
-			passedTargets = m.getNumPassedTRs(conn)
-			if passedLoci <= 0:
-				sys.exit("\nProgram killed: No passed loci in database.\n")
-			elif passedTargets <= 0:
-				sys.exit("\nProgram killed: No passed targets in database.\n")
-			else:
-				#Bait filtering
-				filterBaits(conn,params)
-				passedBaits = m.getNumPassedBaits(conn)
-				if passedBaits <= 0:
-					sys.exit("\nProgram killed: No baits passed filtering.\n")
+				step = 4
+			elif step == 4:
+				#Bait discovery
+				start = timer()
+				print("\n\tStep 4: Bait discovery")
+				passedLoci = m.getNumPassedLoci(conn)#returns pandas dataframe
+				passedTargets = m.getNumPassedTRs(conn)
+				if passedLoci <= 0:
+					sys.exit("\nProgram killed: No loci in database.\n")
+				elif passedTargets <= 0:
+					sys.exit("\nProgram killed: No targets in database.\n")
 				else:
-					print("\t\t\t",passedBaits,"passed filtering.")
-					#Print baits
-					print("\t\tFormatting for printing...")
-					formatPrintBaits(conn, params)
+					#clear baits; baits is bulk loaded without indexes
+					m.clearBaits(conn)
+					m.drop_indexes(conn, ["baits"])
+					baitDiscovery(conn, params)
+					m.create_indexes(conn, ["baits"])
+					m.analyze_db(conn)
 					passed = m.getNumPassedBaits(conn)
 					if passed <= 0:
+						sys.exit("\nProgram killed: No baits found.\n")
+					else:
+						print("\n\t\t### Results: %s potential baits identified! ###"%passed)
+				printTime(start,2)
+				step = 5
+			elif step == 5:
+				start = timer()
+				print("\n\tStep 5: Bait filtering")
+				passedLoci = m.getNumPassedLoci(conn)#returns pandas dataframe
+				passedTargets = m.getNumPassedTRs(conn)
+				if passedLoci <= 0:
+					sys.exit("\nProgram killed: No passed loci in database.\n")
+				elif passedTargets <= 0:
+					sys.exit("\nProgram killed: No passed targets in database.\n")
+				else:
+					#Bait filtering
+					filterBaits(conn,params)
+					passedBaits = m.getNumPassedBaits(conn)
+					if passedBaits <= 0:
 						sys.exit("\nProgram killed: No baits passed filtering.\n")
 					else:
-						print("\n\t\t### Results: %s baits output to file! ###"%passed)
-			printTime(start,2)
-			step = 6
+						print("\t\t\t",passedBaits,"passed filtering.")
+						#Print baits
+						print("\t\tFormatting for printing...")
+						formatPrintBaits(conn, params)
+						passed = m.getNumPassedBaits(conn)
+						if passed <= 0:
+							sys.exit("\nProgram killed: No baits passed filtering.\n")
+						else:
+							print("\n\t\t### Results: %s baits output to file! ###"%passed)
+				printTime(start,2)
+				step = 6
+			#Save in-memory database to disk at the end of each step
+			if params.db_profile == "memory":
+				m.backup_db(conn, params.db)
+	except BaseException:
+		if params.db_profile == "memory":
+			conn.rollback()
+			print("\n\tSaving in-memory database to:", params.db)
+			m.backup_db(conn, params.db)
+		raise
 
 	print("\n\t=======================================================================")
 	out = params.workdir + "/" + params.out + ".fasta"
@@ -208,15 +238,13 @@ def loadAlignments(conn, params):
 		#Load alignments
 		if params.alignment:
 			print("\t\tLoading MAF file:",params.alignment)
-			if int(params.threads) > 1:
-				print("\t\t\tLoading alignments using",str(params.threads),"parallel processes.")
+			if loadParallel(params, params.alignment):
 				pcore.loadMAF_parallel(conn, params)
 			else:
 				core.loadMAF(conn, params)
 		elif params.xmfa:
 			print("\t\tLoading XMFA file:",params.xmfa)
-			if int(params.threads)>1:
-				print("\t\t\tLoading alignments using",str(params.threads),"parallel processes.")
+			if loadParallel(params, params.xmfa):
 				pcore.loadXMFA_parallel(conn, params)
 			else:
 				pass
@@ -224,8 +252,7 @@ def loadAlignments(conn, params):
 
 		elif params.loci:
 			print("\t\tLoading LOCI file:",params.loci)
-			if int(params.threads) > 1:
-				print("\t\t\tLoading alignments using",str(params.threads),"parallel processes.")
+			if loadParallel(params, params.loci):
 				pcore.loadLOCI_parallel(conn, params)
 			else:
 				core.loadLOCI(conn, params)
@@ -236,20 +263,23 @@ def loadAlignments(conn, params):
 		print("\t\t\tMaximum allowed masked bases (-K):",params.max_mask)
 		#Load assembly file
 		print("\t\tLoading FASTA file:",params.assembly)
-		core.loadFASTA(conn, params)
+		if params.genome:
+			print("\t\t\tKeeping assembly on disk (--genome)")
+			core.loadGenome(conn, params)
+		else:
+			core.loadFASTA(conn, params)
 
 		#If VCF file
 		if params.vcf:
 			print("\t\tLoading VCF file:",params.vcf)
-			# if int(params.threads) > 1:
-			# 	print("\t\t\tLoading VCF records using",str(params.threads),"parallel processes.")
-			# 	pcore.loadVCF_parallel(conn, params)
-			# else:
 			if (params.vcfALT):
 				print("\t\t\tAttempting to override N/gap alleles using ALT from VCF (--vcfALT=True)\n")
 			else:
 				print("\t\t\tRetaining N/gap alleles from FASTA reference (--vcfALT=False)\n")
-			core.loadVCF(conn, params)
+			if loadParallel(params, params.vcf, "VCF records"):
+				pcore.loadVCF_parallel(conn, params)
+			else:
+				core.loadVCF(conn, params)
 
 		#if GFF file
 		if params.gff:
@@ -261,6 +291,17 @@ def loadAlignments(conn, params):
 		sys.exit("No input files provided.")
 
 
+#Function to decide whether to load an input file with parallel processes
+#Files compressed with plain gzip (not bgzip) can only be read as one stream
+def loadParallel(params, infile, what="alignments"):
+	if int(params.threads) <= 1:
+		return(False)
+	if not aln_file_tools.splittable(infile):
+		print("\t\t\tFile is gzip-compressed (not bgzip), so it can't be split between processes; loading serially.")
+		return(False)
+	print("\t\t\tLoading",what,"using",str(params.threads),"parallel processes.")
+	return(True)
+
 #Function to call targetDiscoverySlidingWindow and print relevant params
 def targetDiscovery(conn, params):
 	print("\t\tStep 2 parameters:")
@@ -272,8 +313,18 @@ def targetDiscovery(conn, params):
 	print("\t\t\tFlanking distance to parse (-d,--flank_dist):",params.flank_dist)
 
 	#Fetch passed loci
-	passedLoci = m.getPassedLoci(conn)
 	numPassedLoci = m.getNumPassedLoci(conn)
+	if params.genome:
+		#Contig sequences are read from the assembly on disk
+		passedLoci = m.getPassedLociInfo(conn)
+		print("\t\tStarting sliding window target discovery of",numPassedLoci,"contigs...")
+		if int(params.threads) > 1:
+			print("\t\t\tFinding targets using",str(params.threads),"parallel processes...")
+			pcore.targetDiscoveryGenome_parallel(conn, params, passedLoci)
+		else:
+			core.targetDiscoveryGenome(conn, params, passedLoci)
+		return
+	passedLoci = m.getPassedLoci(conn)
 	#sliding window call
 	print("\t\tStarting sliding window target discovery of",numPassedLoci,"loci...")
 	if int(params.threads) > 1:
@@ -22,6 +22,7 @@ from mrbait import blast as b
 import subprocess
 import pandas as pd
 import numpy as np
+from functools import partial
 
 
 
@@ -29,7 +30,7 @@ import numpy as np
 
 #Function to load a XMFA file into database
 def loadXMFA(conn, params):
-	numLoci = aln_file_tools.countXMFA(params.xmfa)
+	numLoci = len(aln_file_tools.record_index(params.xmfa, "xmfa"))
 	if numLoci < 10000:
 		print("\t\t\tReading",numLoci,"alignments.")
 	else:
@@ -37,7 +38,7 @@ def loadXMFA(conn, params):
 	#Parse XMFA file and create database
 
 	num = 1
-	for aln in AlignIO.parse(params.xmfa, "mauve"):
+	for aln in AlignIO.parse(utils.open_input(params.xmfa, text=True), "mauve"):
 		#NOTE: Add error handling, return error code
 		#print(aln)
 		cov = len(aln)
@@ -52,17 +53,16 @@ def loadXMFA(conn, params):
 
 #Function to load a MAF file into database
 def loadMAF(conn, params):
-	numLoci = aln_file_tools.countMAF(params.alignment)
+	numLoci = len(aln_file_tools.record_index(params.alignment, "maf"))
 	if numLoci < 10000:
 		print("\t\t\tReading",numLoci,"alignments.")
 	else:
 		print("\t\t\tReading",numLoci,"alignments... This may take a while.")
 	#Parse MAF file and create database
 	num = 1
-	for aln in AlignIO.parse(params.alignment, "maf"):
+	for cov, aln in aln_file_tools.read_maf(params.alignment):
 		#NOTE: Add error handling, return error code
-		cov = len(aln)
-		alen = aln.get_alignment_length()
+		alen = aln.shape[1]
 
 		#Add each locus to database
 		locus = a.consensAlign(aln, threshold=params.thresh, mask=params.mask)
@@ -79,67 +79,145 @@ def loadMAF(conn, params):
 
 #Function to load .loci file into database.
 def loadLOCI(conn, params):
-	numLoci = aln_file_tools.countLoci(params.loci)
+	numLoci = len(aln_file_tools.record_index(params.loci, "loci"))
 	if numLoci < 10000:
 		print("\t\t\tReading",numLoci,"alignments.")
 	else:
 		print("\t\t\tReading",numLoci,"alignments... This may take a while.")
 	#Parse LOCI file and create database
-	for aln in aln_file_tools.read_loci(params.loci):
+	#Loci failing coverage or alignment length are skipped by the reader
+	for cov, aln in aln_file_tools.read_loci_matrix(params.loci, params.cov, params.minlen):
 		#NOTE: Add error handling, return error code
-		cov = len(aln)
-		alen = aln.get_alignment_length()
-
-		#Skip if coverage or alignment length too short
-		if cov < params.cov or alen < params.minlen:
-			#print("Locus skipped")
-			continue
-		else:
-			#Add each locus to database
-			locus = a.consensAlign(aln, threshold=params.thresh, mask=params.mask)
-			#consensus = str(a.make_consensus(aln, threshold=params.thresh)) #Old way
-			locid = m.add_locus_record(conn, cov, locus.conSequence, 1, "NULL")
-			#print("Loading Locus #:",locid)
+		#Add each locus to database
+		locus = a.consensAlign(aln, threshold=params.thresh, mask=params.mask)
+		#consensus = str(a.make_consensus(aln, threshold=params.thresh)) #Old way
+		locid = m.add_locus_record(conn, cov, locus.conSequence, 1, "NULL")
+		#print("Loading Locus #:",locid)
 
-			#Extract variable positions for database
-			#or var in locus.alnVars:
-				#m.add_variant_record(conn, locid, var.position, var.value)
+		#Extract variable positions for database
+		#or var in locus.alnVars:
+			#m.add_variant_record(conn, locid, var.position, var.value)
 
 #Function to load FASTA into database
 def loadFASTA(conn, params):
+	loci = m.rowBatcher(partial(m.add_locus_records, conn), params._batch)
 	for contig in aln_file_tools.read_fasta(params.assembly):
 		#print("Reading contig:",contig[0])
 		#print("Sequence is:",contig[1])
-		locid = m.add_locus_record(conn, 1, contig[1], 1, contig[0])
+		loci.add(m.locus_row(1, contig[1], 1, contig[0]))
 
 		#Parse consensus for vars, submit those vars to db
 		"""Deprecated"""
 		#for var in a.get_vars(contig[1]):
 			#m.add_variant_record(conn, locid, var.position, var.value)
+	loci.flush()
+
+#Function to load a FASTA assembly kept on disk (--genome)
+#Only names, lengths and base composition of contigs go into the loci table
+def loadGenome(conn, params):
+	loci = m.rowBatcher(partial(m.add_locus_records, conn), params._batch)
+	with aln_file_tools.genomeFasta(params.assembly) as genome:
+		for name in genome.duplicates:
+			print("Constraint failed: Skipping locus \"%s\" because it already exists, this is usually caused by duplicate headers when parsing a FASTA file."%name)
+		for name in genome.names:
+			if genome.length(name) == 0:
+				continue
+			counts = s.compositionCounts(genome.sequence(name))
+			loci.add(m.genome_locus_row(name, genome.length(name), counts))
+	loci.flush()
+
+#Function to list the input files given, as (type, absolute path) tuples
+def inputFiles(params):
+	inputs = [("maf", params.alignment), ("loci", params.loci), ("xmfa", params.xmfa),
+		("assembly", params.assembly), ("vcf", params.vcf), ("gff", params.gff)]
+	return([(t, os.path.abspath(f)) for t, f in inputs if f])
+
+#Function to record the size and mtime of each input file in the database (Step 1)
+def recordInputs(conn, params):
+	rows = list()
+	for t, f in inputFiles(params):
+		size, mtime = aln_file_tools.file_key(f)
+		rows.append((f, t, size, mtime))
+	m.clearInputs(conn)
+	m.add_input_records(conn, rows)
+
+#Function to check that the input files loaded in Step 1 are unchanged (--resume)
+#Files are only stat'ed, never read. An assembly kept on disk (--genome) is still
+#read in Step 2, so if it changed, the program exits
+def checkInputs(conn, params):
+	inputs = m.getInputs(conn)
+	if not inputs:
+		return
+	for path, t, size, mtime in inputs:
+		if not utils.fileCheck(path):
+			status = "no longer exists"
+		elif aln_file_tools.file_key(path) != (size, mtime):
+			status = "has changed"
+		else:
+			continue
+		if params.genome and t == "assembly":
+			sys.exit("\nProgram killed: Assembly %s %s since Step 1, and contigs are read from it (--genome). Please re-run Step 1.\n"%(path, status))
+		print("\t\tWarning: Input file %s %s since Step 1; the database may not match it."%(path, status))
+
+#Function to get the GFF types needed by target filters (-F gff=type), lowercased
+#Returns None if records of every type are needed (no gff filter, gff=all, or gff_a)
+def gffTypes(params):
+	types = set()
+	for option in params.filter_r_objects:
+		if option.o1 == "gff_a" or (option.o1 == "gff" and option.o2 == "all"):
+			return(None)
+		elif option.o1 == "gff":
+			types.add(option.o2.lower())
+	if not types:
+		return(None)
+	return(types)
 
 #Function to load GFF file into database
 def loadGFF(conn, params):
+	chrom_lookup = m.getLocusChroms(conn)
+	types = gffTypes(params)
+	records = m.rowBatcher(partial(m.add_gff_records, conn), params._batch)
+	valid = 0 #records of any type that will pass validateGFFRecords
 	#For each GFF record in params.gff
-	for record in gff.read_gff(params.gff):
+	for record in gff.read_gff_features(params.gff):
 		#Skip any records that are missing the sequence ID, or coordinates
 		if record.seqid == "NULL" or record.start == "NULL" or record.end == "NULL":
 			continue
+		#Only records whose seqid matches an existing locus are kept
+		if record.seqid not in chrom_lookup:
+			continue
+		locid, length = chrom_lookup[record.seqid]
 		if record.start > record.end:
 			temp = record.start
 			record.start = record.end
 			record.end = temp
+		if record.start <= length:
+			valid += 1
+		gff_type = record.type.lower()
+		if types is not None and gff_type not in types:
+			continue
 		#Get the alias, if it exists
-		alias = ""
-		if record.getAlias(): #returns false if no alias
-			alias = record.getAlias()
-		else:
+		alias = record.getAlias() #returns false if no alias
+		if not alias:
 			alias = "NULL"
-		#NOTE: This function ONLY inserts GFFRecords where record.seqid matches an existing locus in the loci table
-		m.add_gff_record(conn, record.seqid, record.type.lower(), record.start, record.end, alias)
+		records.add(m.gff_row(locid, gff_type, record.start, record.end, alias))
+	records.flush()
+	if types is not None and valid > 0:
+		print("\t\t\tKeeping only GFF records of types used by target filters:", ", ".join(sorted(types)))
+		m.add_gff_types(conn, sorted(types))
 
 	#Check if all GFF records fall within bounds of
 	m.validateGFFRecords(conn)
 
+#Function to check that GFF records needed by a -F gff/gff_a filter were loaded
+#(only the types of -F gff= filters are loaded, so this can fail after --resume)
+def checkGFFTypes(conn, option):
+	types = m.getGFFTypes(conn)
+	if not types:
+		return
+	if option.o1 == "gff_a" or option.o2 == "all" or option.o2.lower() not in types:
+		sys.exit("ERROR: Only GFF records of type %s were loaded in Step 1, so targets can't be filtered with -F %s=%s. Please re-run Step 1 with this filter."%(", ".join(types), option.o1, option.o2))
+
 
 #Function to load VCF variants file
 def loadVCF(conn, params):
@@ -155,7 +233,7 @@ def loadVCF(conn, params):
 	#loci.set_index('chrom', inplace=True) #index loci DF by chrom column
 
 	#print(loci)
-	passed=0 #To track number of VCF records for which no locus exists
+	passed=0 #To track number of VCF records (passing FILTER) for which no locus exists
 	failed=0
 
 	for reclist in vcf_tools.read_vcf(params.vcf):
@@ -165,7 +243,7 @@ def loadVCF(conn, params):
 			#print("chrom:",rec_chrom, " - id:",chrom_lookup[rec_chrom])
 			locid = chrom_lookup[rec_chrom]
 			#print("locid is",locid)
-			passed+=1
+			passed+=len(reclist)
 			#for rec in reclist:
 			#	print(rec.CHROM, rec.POS, rec.REF, rec.ALT, len(rec.samples), rec.call_rate, rec.aaf)
 			#Grab DF record for the matching CHROM
@@ -189,50 +267,47 @@ def loadVCF(conn, params):
 
 		else:
 			#print(rec_chrom, "not found.")
-			failed+=1
+			failed+=len(reclist)
 	if failed > 0:
 		print("\t\t\tWARNING:%s/%s records in <%s> don't match any reference sequences"%(failed, failed+passed, params.vcf))
 
 #Function to discover target regions using a sliding windows through passedLoci
 def targetDiscoverySlidingWindow(conn, params, loci):
+	regions = m.rowBatcher(partial(m.add_region_records, conn), params._batch)
 
 	#looping through passedLoci only
 	for seq in loci.itertuples():
 		#print(seq)
-		start = 0
-		stop = 0
 		#print("\nConsensus: ", seq[2], "ID is: ", seq[1], "\n")
-		generator = s.slidingWindowGenerator(seq[2], params.win_shift, params.win_width)
-		for window_seq in generator():
-
-			seq_norm = s.simplifySeq(window_seq[0])
-			counts = s.seqCounterSimple(seq_norm)
-
-			#If window passes filters, extend current bait region
-			#print("Start is ", start, " and stop is ",stop) #debug print
-			if counts['*'] <= params.var_max and counts['N'] <= params.numN and counts['-'] <= params.numG:
-				stop = window_seq[2]
-			else:
-				#If window fails, check if previous bait region passes to submit to DB
-				#print (stop-start)
-				if (stop - start) > params.blen:
-					target = (seq[2])[start:stop]
-					tr_counts = s.seqCounterSimple(s.simplifySeq(target))
-					n_mask = utils.n_lower_chars(target)
-					n_gc = s.gc_counts(target)
-					#Check that there aren't too many SNPs
-					#if tr_counts["*"] <= params.vmax_r:
-					#print("	Target region: ", target)
-					#Submit target region to database
-					flank_counts = s.getFlankCounts(seq[2], start, stop, params.flank_dist)
-					m.add_region_record(conn, int(seq[1]), start, stop, target, tr_counts, flank_counts, n_mask, n_gc)					#set start of next window to end of current TR
-					generator.setI(stop)
-
-				#If bait fails, set start to start point of next window
-				start = generator.getI()+params.win_shift
+		#Count SNPs, Ns and gaps once per locus; windows and targets are then O(1) lookups
+		counter = s.prefixCounter(seq[2])
+		for start, stop in s.slidingWindowTargets(counter, params.win_shift, params.win_width, params.var_max, params.numN, params.numG, params.blen):
+			target = (seq[2])[start:stop]
+			tr_counts = counter.counts(start, stop)
+			n_mask = utils.n_lower_chars(target)
+			n_gc = s.gc_counts(target)
+			#Check that there aren't too many SNPs
+			#if tr_counts["*"] <= params.vmax_r:
+			#print("	Target region: ", target)
+			#Add target region to the next batch for the database
+			flank_counts = counter.flankCounts(start, stop, params.flank_dist)
+			regions.add(m.region_row(int(seq[1]), start, stop, target, tr_counts, flank_counts, n_mask, n_gc))
+	regions.flush()
 	#Now update regions table to include information for flanking regions if available
 	#m.flankDistParser(conn, params.flank_dist)
 
+#Function to discover target regions in a FASTA assembly kept on disk (--genome)
+#loci is a DataFrame of id, chrom, length; contigs are read from the FASTA a block at a time
+def targetDiscoveryGenome(conn, params, loci):
+	regions = m.rowBatcher(partial(m.add_region_records, conn), params._batch)
+	with aln_file_tools.genomeFasta(params.assembly) as genome:
+		for locus in loci.itertuples():
+			seq = genome.sequence(locus.chrom)
+			for x, region in s.countedTargetEvents(seq, params.win_shift, params.win_width, params.var_max, params.numN, params.numG, params.blen, params.flank_dist):
+				if region is not None:
+					regions.add(m.region_row(int(locus.id), *region))
+	regions.flush()
+
 #Function to filter target regions by --filter_R arguments
 def filterTargetRegions(conn, params):
 
@@ -306,6 +381,7 @@ def filterTargetRegions(conn, params):
 				#sys.exit()
 			elif option.o1 in ("gff", "gff_a"):
 				if params.gff and params.assembly:
+					checkGFFTypes(conn, option)
 					if option.o1 == "gff":
 						m.regionFilterGFF(conn, option.o2, params.flank_dist)
 					elif option.o1 == "gff_a":
@@ -441,6 +517,7 @@ def filterTargetRegions_verbose(conn, params):
 				#sys.exit()
 			elif option.o1 in ("gff", "gff_a"):
 				if params.gff and params.assembly:
+					checkGFFTypes(conn, option)
 					if option.o1 == "gff":
 						print("\t\t\tFiltering criterion: Proximity to",option.o2,"GFF elements")
 						m.regionFilterGFF(conn, option.o2, params.flank_dist)
@@ -660,39 +737,41 @@ def dupEdgeResolution(conn, params, blacklist_edges):
 
 
 #function for sliding window bait generation
-def baitSlidingWindow(conn, source, sequence, overlap, length):
-	generator = s.slidingWindowGenerator(sequence, overlap, length)
-	for window_seq in generator():
+#baits is a manage_bait_db.rowBatcher that collects bait rows
+def baitSlidingWindow(baits, source, sequence, overlap, length):
+	for w_start, w_stop in s.windowIterator(len(sequence), overlap, length):
 	#Don't need to do a bunch of filtering, because all was checked when TRs built
-	#print(window_seq)
-		if (len(window_seq[0]) == length):
-			n_mask = utils.n_lower_chars(window_seq[0])
-			n_gc = s.gc_counts(window_seq[0])
-			m.add_bait_record(conn, source, window_seq[0], window_seq[1], window_seq[2], n_mask, n_gc)
+	#print(w_start, w_stop)
+		if (w_stop - w_start == length):
+			bait = sequence[w_start:w_stop]
+			n_mask = utils.n_lower_chars(bait)
+			n_gc = s.gc_counts(bait)
+			baits.add(m.bait_row(source, bait, w_start, w_stop, n_mask, n_gc))
 
 #function for sliding window bait generation, with custom coordinates
-def baitSlidingWindowCoord(conn, source, sequence, overlap, length, start):
-	generator = s.slidingWindowGenerator(sequence, overlap, length)
-	for window_seq in generator():
+def baitSlidingWindowCoord(baits, source, sequence, overlap, length, start):
+	for w_start, w_stop in s.windowIterator(len(sequence), overlap, length):
 		#Don't need to do a bunch of filtering, because all was checked when TRs built
-		#print(window_seq)
-		if (len(window_seq[0]) == length):
-			start_coord = start + window_seq[1]
+		#print(w_start, w_stop)
+		if (w_stop - w_start == length):
+			bait = sequence[w_start:w_stop]
+			start_coord = start + w_start
 			stop_coord = start_coord + length
-			n_mask = utils.n_lower_chars(window_seq[0])
-			n_gc = s.gc_counts(window_seq[0])
-			m.add_bait_record(conn, source, window_seq[0], start_coord, stop_coord, n_mask, n_gc)
+			n_mask = utils.n_lower_chars(bait)
+			n_gc = s.gc_counts(bait)
+			baits.add(m.bait_row(source, bait, start_coord, stop_coord, n_mask, n_gc))
 
 #Function to discover target regions
 def baitDiscovery(conn, params, targets):
 	#print("Params.overlap is ", params.overlap)
 	#print("Params.bait_shift is", params.bait_shift)
+	baits = m.rowBatcher(partial(m.add_bait_records, conn), params._batch)
 	#Design baits based on specified selection criterion (default is to tile at 2X)
 	if params.select_b == "tile":
 		#looping through passedLoci only
 		for seq in targets.itertuples():
 			#seq[1] is the regid; seq[2] is the target sequence
-			baitSlidingWindow(conn, seq[1], seq[2], params.bait_shift, params.blen)
+			baitSlidingWindow(baits, seq[1], seq[2], params.bait_shift, params.blen)
 	elif params.select_b == 'center':
 		#print("Designing centered baits...")
 		#First calculate union length needed, if this is longer than target, just
@@ -704,7 +783,7 @@ def baitDiscovery(conn, params, targets):
 			length = len(seq[2])
 			#If the target is too short, just do a full sliding window
 			if union >= length:
-				baitSlidingWindow(conn, seq[1], seq[2], params.bait_shift, params.blen)
+				baitSlidingWindow(baits, seq[1], seq[2], params.bait_shift, params.blen)
 			else:
 				center = len(seq[2]) // 2 #Divide by two and round down
 				start = center - (union // 2)
@@ -712,7 +791,7 @@ def baitDiscovery(conn, params, targets):
 				#print("Starting at:",start," and stopping at:",stop)
 				subseq = (seq[2])[start:stop]
 				#print(subseq)
-				baitSlidingWindowCoord(conn, seq[1], subseq, params.bait_shift, params.blen, start)
+				baitSlidingWindowCoord(baits, seq[1], subseq, params.bait_shift, params.blen, start)
 	elif params.select_b == "flank":
 		#First calculate union length needed, if this is longer than target, just
 		#tile all of it
@@ -722,7 +801,7 @@ def baitDiscovery(conn, params, targets):
 			length = len(seq[2])
 			#If the target is too short, just do a full sliding window
 			if union*2 >= length:
-				baitSlidingWindow(conn, seq[1], seq[2], params.bait_shift, params.blen)
+				baitSlidingWindow(baits, seq[1], seq[2], params.bait_shift, params.blen)
 			else:
 				#Need to: Substring both ends (start + union and stop - union)
 				subseq1 = (seq[2])[0:union] #right
@@ -730,9 +809,9 @@ def baitDiscovery(conn, params, targets):
 				#print(subseq1)
 				#print(subseq2)
 				#Right side
-				baitSlidingWindowCoord(conn, seq[1], subseq1, params.bait_shift, params.blen, 0)
+				baitSlidingWindowCoord(baits, seq[1], subseq1, params.bait_shift, params.blen, 0)
 				#Left side
-				baitSlidingWindowCoord(conn, seq[1], subseq2, params.bait_shift, params.blen, length-union)
+				baitSlidingWindowCoord(baits, seq[1], subseq2, params.bait_shift, params.blen, length-union)
 	# elif params.select_b == "rand":
 	# 	#Here, union is the MINIMUM length required to make the specified number of baits with maximum overlap
 	# 	union = (utils.calculateUnionLengthFixed(params.select_b_num, params.blen, params.overlap))
@@ -766,6 +845,7 @@ def baitDiscovery(conn, params, targets):
 			#	randomDrawSubstring
 	else:
 		assert False, "Unhandled option %r"%params.select_b
+	baits.flush()
 
 #Function to filter target regions by --filter_R arguments
 def filterBaits_verbose(conn, params):
@@ -1054,14 +1134,24 @@ def printLoci(conn, params):
 	out = params.workdir + "/" + params.out + "_catalog.fasta"
 	file_object = open(out, "w")
 
+	genome = aln_file_tools.genomeFasta(params.assembly) if params.genome else None
 	for i, r in df.iterrows():
 		#build FASTA header
 		p = "T"
 		if r["pass"]==0:
 			p="F"
 		header = ">Locus" + str(r.id) + "_Pass=" + str(p) + "\n"
-		seq = r.consensus + "\n"
 		file_object.write(header)
-		file_object.write(seq)
+		if genome:
+			#--genome: copy the contig from the assembly, a block at a time
+			contig = genome.sequence(r.chrom)
+			for start in range(0, len(contig), s.TARGET_BLOCK):
+				file_object.write(contig[start:start+s.TARGET_BLOCK].tobytes().decode())
+			file_object.write("\n")
+		else:
+			seq = r.consensus + "\n"
+			file_object.write(seq)
 
+	if genome:
+		genome.close()
 	file_object.close()
@@ -24,13 +24,23 @@ import subprocess
 import pandas as pd
 import numpy as np
 import multiprocessing
+from multiprocessing import shared_memory
 
 """
 
 Parallel versions of some of the MrBait corefuncs.
 
+Workers never touch the database: they compute rows and send them in batches
+over a shared queue (or return them, for target discovery), and the master
+process is the single writer, inserting each batch with executemany.
+
+Work is split into many more tasks than threads, of about equal total length
+(bytes of file, or bases of consensus), and handed out one at a time; loci too
+long for one task are cut into tiles (see tileTargets and tileStitcher).
+
 Much thanks to SO user 'dano' for 2014 post on how to share lock in multiprocessing pool:
 https://stackoverflow.com/questions/25557686/python-sharing-a-lock-between-processes
+(the same trick is used here to share the writer queue)
 
 """
 
@@ -38,52 +48,39 @@ https://stackoverflow.com/questions/25557686/python-sharing-a-lock-between-proce
 def loadXMFA_parallel(conn, params):
 
 	t = int(params.threads)
-	numLoci = aln_file_tools.countXMFA(params.xmfa)
+	#Record boundaries (byte offsets), from the cached index if the file is unchanged
+	index = aln_file_tools.record_index(params.xmfa, "xmfa")
+	numLoci = len(index)
 	if numLoci < 10000:
 		print("\t\t\tReading",numLoci,"alignments.")
 	else:
 		print("\t\t\tReading",numLoci,"alignments... This may take a while.")
 
-	#file chunker call
-	file_list = aln_file_tools.xmfa_chunker(params.xmfa, t, params.workdir)
+	#Split records into byte ranges; workers parse one range at a time
+	ranges = aln_file_tools.chunk_ranges(index, t*TASKS_PER_THREAD)
 
-	#print("Files are:",file_list)
-	#Initialize multiprocessing pool
-	#if 'lock' not in globals():
-	lock = multiprocessing.Lock()
-	try:
-		with multiprocessing.Pool(t,initializer=init, initargs=(lock,)) as pool:
-			func = partial(loadXMFA_worker, params.db, params.cov, params.minlen, params.thresh, params.mask)
-			results = pool.map(func, file_list)
-	except Exception as e:
-		pool.close()
-	pool.close()
-	pool.join()
-
-	#reset_lock()
-	#Remove chunkfiles
-	aln_file_tools.removeChunks(params.workdir)
+	#Workers send batches of loci rows back; this process writes them all
+	func = partial(loadXMFA_worker, params.xmfa, params.cov, params.minlen, params.thresh, params.mask)
+	writePooled(conn, t, func, ranges, m.add_locus_records)
 
-#worker function version of loadMAF
-def loadXMFA_worker(db, params_cov, params_minlen, params_thresh, params_mask, chunk):
+#worker function version of loadXMFA
+def loadXMFA_worker(infile, params_cov, params_minlen, params_thresh, params_mask, chunk):
+	batch = queueBatcher()
 	try:
-	   	connection = sqlite3.connect(db)
-	   	#Parse MAF file and create database
-	   	for aln in AlignIO.parse(chunk, "mauve"):
-	   		#NOTE: Add error handling, return error code
-	   		cov = len(aln)
-	   		alen = aln.get_alignment_length()
-
-	   		if cov < params_cov or alen < params_minlen:
-	   			continue
-	   		#Add each locus to database
-	   		locus = a.consensAlign(aln, threshold=params_thresh, mask=params_mask)
-	   		lock.acquire()
-	   		locid = m.add_locus_record(connection, cov, locus.conSequence, 1, "NULL")
-	   		lock.release()
-	   	connection.close()
-	except Exception as e:
-	   raise Exception(e.message)
+		#Parse XMFA byte range
+		offset, length = chunk
+		for aln in AlignIO.parse(aln_file_tools.open_range(infile, offset, length, text=True), "mauve"):
+			#NOTE: Add error handling, return error code
+			cov = len(aln)
+			alen = aln.get_alignment_length()
+
+			if cov < params_cov or alen < params_minlen:
+				continue
+			#Add each locus to the next batch
+			locus = a.consensAlign(aln, threshold=params_thresh, mask=params_mask)
+			batch.add(m.locus_row(cov, locus.conSequence, 1, "NULL"))
+	finally:
+		closeBatcher(batch)
 
 
 #Function to load LOCI file in parallel
@@ -92,313 +89,561 @@ def loadLOCI_parallel(conn, params):
 	Format:
 	multiprocessing pool.
 	Master:
-		splits file into n chunks
+		indexes file and splits records into n byte ranges
 		creates multiprocessing pool
+		single writer: INSERTs row batches from the queue with executemany
 	Workers:
-		read file chunk
+		read byte range of file
 		calculate consensus
-		grab lock
-		INSERT data to SQL database
-		release lock
+		put batches of rows on the writer queue
 	"""
 	t = int(params.threads)
 
-	numLoci = aln_file_tools.countLoci(params.loci)
+	#Record boundaries (byte offsets), from the cached index if the file is unchanged
+	index = aln_file_tools.record_index(params.loci, "loci")
+	numLoci = len(index)
 	if numLoci < 10000:
 		print("\t\t\tReading",numLoci,"alignments.")
 	else:
 		print("\t\t\tReading",numLoci,"alignments... This may take a while.")
 
-	#file chunker call
-	file_list = aln_file_tools.loci_chunker(params.loci, t, params.workdir)
+	#Split records into byte ranges; workers parse one range at a time
+	ranges = aln_file_tools.chunk_ranges(index, t*TASKS_PER_THREAD)
 
-	#print("Files are:",file_list)
-	#Initialize multiprocessing pool
-	#if 'lock' not in globals():
-	lock = multiprocessing.Lock()
-	try:
-		with multiprocessing.Pool(t,initializer=init, initargs=(lock,)) as pool:
-			func = partial(loadLOCI_worker, params.db, params.cov, params.minlen, params.thresh, params.mask)
-			results = pool.map(func, file_list)
-	except Exception as e:
-		pool.close()
-	pool.close()
-	pool.join()
-
-	#reset_lock()
-	#Remove chunkfiles
-	aln_file_tools.removeChunks(params.workdir)
+	#Workers send batches of loci rows back; this process writes them all
+	func = partial(loadLOCI_worker, params.loci, params.cov, params.minlen, params.thresh, params.mask)
+	writePooled(conn, t, func, ranges, m.add_locus_records)
 
 #Function to load MAF file in parallel
 def loadMAF_parallel(conn, params):
 
 	t = int(params.threads)
-	numLoci = aln_file_tools.countMAF(params.alignment)
+	#Record boundaries (byte offsets), from the cached index if the file is unchanged
+	index = aln_file_tools.record_index(params.alignment, "maf")
+	numLoci = len(index)
 	if numLoci < 10000:
 		print("\t\t\tReading",numLoci,"alignments.")
 	else:
 		print("\t\t\tReading",numLoci,"alignments... This may take a while.")
 
-	#file chunker call
-	file_list = aln_file_tools.maf_chunker(params.alignment, t, params.workdir)
+	#Split records into byte ranges; workers parse one range at a time
+	ranges = aln_file_tools.chunk_ranges(index, t*TASKS_PER_THREAD)
 
-	#print("Files are:",file_list)
-	#Initialize multiprocessing pool
-	#if 'lock' not in globals():
-	lock = multiprocessing.Lock()
+	#Workers send batches of loci rows back; this process writes them all
+	func = partial(loadMAF_worker, params.alignment, params.cov, params.minlen, params.thresh, params.mask)
+	writePooled(conn, t, func, ranges, m.add_locus_records)
+
+#Function to apply VCF variants to the consensus of loci in parallel
+def loadVCF_parallel(conn, params):
+	"""
+	Format:
+	multiprocessing pool, one task per CHROM.
+	Master:
+		indexes blocks of VCF records by CHROM (cached in <vcf>.mbi)
+		copies consensus of loci with variants to shared memory
+		single writer: UPDATEs the consensus returned by workers, in batches
+	Workers:
+		read the VCF header, and the records of one CHROM
+		make the new consensus
+		return it
+		(blocks with no matching locus are split among t tasks, which only
+		count the records passing FILTER, as loadVCF does)
+	"""
+	t = int(params.threads)
+	index = aln_file_tools.record_index(params.vcf, "vcf")
+	loci = m.getPassedLoci(conn) #get DF of passed loci
+	#As in loadVCF, if a name is used by more than one locus, the last is updated
+	chrom_lookup = dict()
+	for l, chrom in enumerate(loci["chrom"]):
+		chrom_lookup[chrom] = l
+
+	#Byte ranges of the records for each locus
+	ranges = dict()
+	unmatched = list()
+	for chrom, offset, length, records in index:
+		if chrom in chrom_lookup:
+			ranges.setdefault(chrom_lookup[chrom], list()).append((offset, length))
+		else:
+			unmatched.append((offset, length))
+	header = (0, index[0][1] if index else 0)
+
+	#Only loci with variants are shared; longest VCF blocks first
+	shared = loci.iloc[sorted(ranges)].reset_index(drop=True)
+	tasks = [(l, ranges[i]) for l, i in enumerate(sorted(ranges))]
+	tasks.sort(key=lambda task: sum([length for offset, length in task[1]]), reverse=True)
+	tasks += [(None, unmatched[i::t]) for i in range(min(t, len(unmatched)))]
+
+	passed = 0
+	failed = 0
+	written = 0
+	busy = dict()
+	batch = m.rowBatcher(partial(m.update_consensus_records, conn), params._batch)
+	shared_seqs, shared_index = shareLoci(shared)
 	try:
-		with multiprocessing.Pool(t,initializer=init, initargs=(lock,)) as pool:
-			func = partial(loadMAF_worker, params.db, params.cov, params.minlen, params.thresh, params.mask)
-			results = pool.map(func, file_list)
-	except Exception as e:
-		pool.close()
-	pool.close()
-	pool.join()
-
-	#reset_lock()
-	#Remove chunkfiles
-	aln_file_tools.removeChunks(params.workdir)
-
-# #first chunking, then arsing in parallel
-# def loadVCF_parallel(conn, params):
-# 	t = int(params.threads)
-# 	#file chunker call
-# 	file_list = vcf_tools.vcf_chunker(params.vcf, t, params.workdir)
-#
-# 	print("Files are:",file_list)
-# 	#Initialize multiprocessing pool
-# 	#if 'lock' not in globals():
-# 	lock = multiprocessing.Lock()
-# 	try:
-# 		with multiprocessing.Pool(t,initializer=init, initargs=(lock,)) as pool:
-# 			func = partial(loadVCF_worker, params.db, params.thresh)
-# 			results = pool.map(func, file_list)
-# 	except Exception as e:
-# 		pool.close()
-# 	pool.close()
-# 	pool.join()
-#
-# 	#reset_lock()
-# 	#Remove chunkfiles
-# 	#aln_file_tools.removeChunks(params.workdir)
-
-
-#INitialize a global lock. Doing it this way allows it to be inherited by the child processes properly
+		func = partial(loadVCF_worker, params.vcf, header, params.thresh, params.vcfALT)
+		with multiprocessing.Pool(t,initializer=initSharedLoci, initargs=(shared_seqs.name, shared_index.name, len(shared))) as pool:
+			for pid, seconds, (locid, new_cons, records, bad) in pool.imap_unordered(partial(timedTask, func), tasks):
+				busy[pid] = busy.get(pid, 0.0) + seconds
+				if locid is None:
+					failed += records
+					continue
+				passed += records
+				for chrom in bad:
+					print("\t\t\tWarning: New consensus sequence for locus %s (locid=<%s>) is the wrong length! Skipping."%(chrom, locid))
+				if new_cons is not None:
+					batch.add((new_cons, locid))
+					written += 1
+		batch.flush()
+	finally:
+		shared_seqs.close()
+		shared_seqs.unlink()
+		shared_index.close()
+		shared_index.unlink()
+	print("\t\t\tUpdated",written,"loci")
+	reportBusy(busy, t)
+	if failed > 0:
+		print("\t\t\tWARNING:%s/%s records in <%s> don't match any reference sequences"%(failed, failed+passed, params.vcf))
+
+#Rows per batch sent from a worker to the writer
+WRITER_BATCH = 1000
+#Tasks to split work into, per thread
+TASKS_PER_THREAD = 8
+#Minimum length of a tile of a long locus
+TILE_MIN = 100000
+#Events of overlap between neighbouring tiles (see tileTargets)
+TILE_EVENTS = 4
+#Bases per task for --genome
+GENOME_WINDOW = 1000000
+#Maximum batches waiting in the writer queue, per thread
+WRITER_QUEUE = 4
+
+#INitialize a global queue. Doing it this way allows it to be inherited by the child processes properly
 #Found on StackOverflow: https://stackoverflow.com/questions/25557686/python-sharing-a-lock-between-processes
 #Thanks go to SO user dano
-def init(l):
-    global lock
-    lock = l
-
-#Function to reset lock
-def reset_lock():
-	global lock
-	del lock
+#puts counts the row batches (not end-of-task Nones) put on the queue
+def init(q, puts):
+    global queue, queue_puts
+    queue = q
+    queue_puts = puts
+
+#Function to reset queue
+def reset_queue():
+	global queue, queue_puts
+	del queue
+	del queue_puts
+
+#Initializer for workers reading loci from shared memory (see shareLoci)
+#Attaches to the shared blocks and keeps numpy views of them as globals
+def initSharedLoci(seq_name, index_name, nloci):
+	global shared_seqs, shared_index, loci_seqs, loci_ids, loci_offsets, locus_source
+	locus_source = sharedLocus
+	shared_seqs = shared_memory.SharedMemory(name=seq_name)
+	shared_index = shared_memory.SharedMemory(name=index_name)
+	loci_seqs = np.ndarray((shared_seqs.size,), dtype=np.uint8, buffer=shared_seqs.buf)
+	index = np.ndarray((2, nloci+1), dtype=np.int64, buffer=shared_index.buf)
+	loci_ids = index[0]
+	loci_offsets = index[1]
+
+#Function used by workers started with initSharedLoci to get (locid, sequence) of locus l
+def sharedLocus(l):
+	return((int(loci_ids[l]), loci_seqs[loci_offsets[l]:loci_offsets[l+1]]))
+
+#Initializer for workers reading contigs from a genome FASTA on disk (--genome)
+#ids and chroms are the locus ids and contig names, in task order
+def initGenome(fas, ids, chroms):
+	global genome, genome_ids, genome_chroms, locus_source
+	locus_source = genomeLocus
+	genome = aln_file_tools.genomeFasta(fas)
+	genome_ids = ids
+	genome_chroms = chroms
+
+#Function used by workers started with initGenome to get (locid, sequence) of locus l
+def genomeLocus(l):
+	return((int(genome_ids[l]), genome.sequence(genome_chroms[l])))
+
+#Function to copy loci (DataFrame of id, consensus) into two shared memory blocks:
+#all consensus sequences as concatenated bytes, and an array of [ids; byte offsets]
+#Returns both SharedMemory objects; caller must close() and unlink() them
+def shareLoci(loci):
+	seqs = [c.encode() for c in loci["consensus"]]
+	index = np.zeros((2, len(seqs)+1), dtype=np.int64)
+	index[0, :len(seqs)] = loci["id"].values
+	index[1, 1:] = np.cumsum([len(c) for c in seqs])
+	shared_seqs = shared_memory.SharedMemory(create=True, size=max(int(index[1, -1]), 1))
+	shared_seqs.buf[:int(index[1, -1])] = b"".join(seqs)
+	shared_index = shared_memory.SharedMemory(create=True, size=index.nbytes)
+	np.ndarray(index.shape, dtype=np.int64, buffer=shared_index.buf)[:] = index
+	return(shared_seqs, shared_index)
+
+#Function to split loci into tasks of about equal total length
+#Short loci are grouped into ("loci", first, last) index ranges; if tile is given,
+#loci longer than a task are cut into ("tile", locus, k, start, end) pieces, with
+#start and end multiples of tile. More tasks than threads, longest first, so that
+#long contigs start early and the remaining workers pick up the short loci as they finish
+#If size is given, tasks are about that many bases, whatever the number of threads,
+#and long loci that can't be tiled are still scanned as one tile (in blocks)
+def lociTasks(offsets, t, tile=None, size=None, per_thread=TASKS_PER_THREAD):
+	nloci = len(offsets)-1
+	target = size if size else max(int(offsets[-1]) // (t*per_thread), 1)
+	tasks = list()
+	first = 0
+	for i in range(nloci):
+		length = int(offsets[i+1] - offsets[i])
+		if (tile or size) and length > max(target, TILE_MIN)*2:
+			#Close the current range, and tile this locus by itself
+			if first < i:
+				tasks.append(("loci", first, i))
+			if tile:
+				step = -(-max(target, TILE_MIN) // tile)*tile
+				starts = list(range(0, length-step, step))
+			else:
+				starts = [0]
+			for k, start in enumerate(starts):
+				end = starts[k+1] if k+1 < len(starts) else length
+				tasks.append(("tile", i, k, start, end))
+			first = i+1
+		elif offsets[i+1] - offsets[first] >= target or i == nloci-1:
+			tasks.append(("loci", first, i+1))
+			first = i+1
+	tasks.sort(key=lambda task: taskLength(task, offsets), reverse=True)
+	return(tasks)
+
+#Function to get the number of bases in a task from lociTasks
+def taskLength(task, offsets):
+	if task[0] == "tile":
+		return(task[4]-task[3])
+	return(int(offsets[task[2]]-offsets[task[1]]))
+
+#Function to check that tileStitcher can join tiles for these parameters (see
+#sequence_tools.targetEvents). If width is a multiple of shift, every window visited
+#is too, so tiles starting at multiples of shift line up with the full scan
+def canTile(shift, width, blen):
+	return(width % shift == 0 and width-(2*shift) <= blen)
+
+#Function run in a worker in place of func(task), to time it
+#Returns (process id, CPU seconds spent, result)
+def timedTask(func, task):
+	start = time.process_time()
+	result = func(task)
+	return((os.getpid(), time.process_time()-start, result))
+
+#Function to print the total CPU time each worker spent on tasks
+def reportBusy(busy, t):
+	times = sorted(busy.values(), reverse=True)
+	times += [0.0]*(t-len(times))
+	mean = sum(times)/len(times)
+	balance = times[0]/mean if mean > 0 else 1.0
+	print("\t\t\tWorker busy time (s):"," ".join(["%.2f"%x for x in times]),"(max/mean: %.2f)"%balance)
+
+#Function used by workers to get a batcher that sends rows to the writer queue
+def queueBatcher():
+	return(m.rowBatcher(putBatch, WRITER_BATCH))
+
+#Function used by workers to put a batch of rows on the writer queue, and count it
+def putBatch(rows):
+	queue.put(rows)
+	with queue_puts.get_lock():
+		queue_puts.value += 1
+
+#Function used by workers to flush the last batch and tell the writer this task is finished
+def closeBatcher(batch):
+	batch.flush()
+	queue.put(None)
+
+#Function to map func over tasks in a pool, with this process as the only db writer
+#Each task puts row batches on the queue, then None when done; insert(conn, rows) writes a batch
+#Tasks are handed out one at a time, so idle workers always take the next one
+def writePooled(conn, t, func, tasks, insert):
+	if len(tasks) == 0:
+		return
+	q = multiprocessing.Queue(WRITER_QUEUE*t)
+	puts = multiprocessing.Value("l", 0)
+	done = 0
+	taken = 0
+	written = 0
+	peak = 0
+	with multiprocessing.Pool(t,initializer=init, initargs=(q, puts)) as pool:
+		results = pool.map_async(partial(timedTask, func), tasks, chunksize=1)
+		while done < len(tasks):
+			batch = q.get()
+			if batch is None:
+				done += 1
+				continue
+			#Batches still waiting, plus this one; a batch is counted just after
+			#it is put, so this may be low, but never counts the Nones
+			taken += 1
+			peak = max(peak, puts.value-taken+1)
+			insert(conn, batch)
+			written += len(batch)
+		#Re-raise any worker errors
+		busy = dict()
+		for pid, seconds, result in results.get():
+			busy[pid] = busy.get(pid, 0.0) + seconds
+	print("\t\t\tWrote",written,"records (peak writer queue depth:",peak,"/",WRITER_QUEUE*t,"batches)")
+	reportBusy(busy, t)
 
 #NOTE: 'params' object can't be pickled, so I have to do it this way.
 #worker function version of loadMAF
-def loadMAF_worker(db, params_cov, params_minlen, params_thresh, params_mask, chunk):
+def loadMAF_worker(infile, params_cov, params_minlen, params_thresh, params_mask, chunk):
+	batch = queueBatcher()
 	try:
-	   	connection = sqlite3.connect(db)
-	   	#Parse MAF file and create database
-	   	for aln in AlignIO.parse(chunk, "maf"):
-	   		#NOTE: Add error handling, return error code
-	   		cov = len(aln)
-	   		alen = aln.get_alignment_length()
-
-	   		if cov < params_cov or alen < params_minlen:
-	   			continue
-	   		#Add each locus to database
-	   		locus = a.consensAlign(aln, threshold=params_thresh, mask=params_mask)
-	   		lock.acquire()
-	   		locid = m.add_locus_record(connection, cov, locus.conSequence, 1, "NULL")
-	   		lock.release()
-	   		#Extract variable positions for database
-	   		#for var in locus.alnVars:
-	   			#m.add_variant_record(connection, locid, var.position, var.value)
-	   	connection.close()
-	except Exception as e:
-	   raise Exception(e.message)
-
-# #Function to load VCF variants file
-# def loadVCF_worker(db, threshold, chunk):
-# 	try:
-# 		#Each worker opens unique connection to db
-# 		connection = sqlite3.connect(db)
-# 		#Lock DB and read loci, then release lock
-# 		lock.acquire()
-# 		loci = m.getPassedLoci(connection) #get DF of passed loci
-# 		lock.release()
-#
-# 		chrom_lookup = loci.set_index('chrom')['id'].to_dict()
-# 		loci.set_index('id', inplace=True)
-#
-# 		passed=0 #To track number of VCF records for which no locus exists
-# 		failed=0
-# 		for reclist in vcf_tools.read_vcf(chunk):
-# 			rec_chrom = reclist[0].CHROM
-# 			if rec_chrom in chrom_lookup:
-# 				locid = chrom_lookup[rec_chrom]
-# 				passed+=1
-# 				#Grab DF record for the matching CHROM
-# 				seq = loci.loc[locid,'consensus']
-# 				#Get new consensus sequence given VCF records
-# 				new_cons = vcf_tools.make_consensus_from_vcf(seq,rec_chrom,reclist, threshold)
-# 				print(new_cons)
-# 				#Update new consensus seq in db
-# 				if len(new_cons) != len(seq): #Check length first
-# 					print("\t\t\tWarning: New consensus sequence for locus %s (locid=<%s>) is the wrong length! Skipping."%(rec_chrom, locid))
-# 				else:
-# 					#Lock database for update, then relase lock
-# 					lock.acquire()
-# 					m.updateConsensus(connection, locid, new_cons)
-# 					lock.release()
-# 			else:
-# 				failed+=1
-# 		if failed > 0:
-# 			print("\t\t\tWARNING:%s/%s records in <%s> don't match any reference sequences"%(failed, failed+passed, chunk))
-# 		#close connection
-# 		connection.close()
-# 	except Exception as e:
-# 		raise Exception(e.message)
+		#Parse MAF byte range
+		offset, length = chunk
+		for cov, aln in aln_file_tools.read_maf(infile, offset, length):
+			#NOTE: Add error handling, return error code
+			alen = aln.shape[1]
+
+			if cov < params_cov or alen < params_minlen:
+				continue
+			#Add each locus to the next batch
+			locus = a.consensAlign(aln, threshold=params_thresh, mask=params_mask)
+			batch.add(m.locus_row(cov, locus.conSequence, 1, "NULL"))
+	finally:
+		closeBatcher(batch)
+
+#Worker function for loadVCF_parallel
+#task is (l, ranges): a locus, read through locus_source, and the byte ranges of
+#its VCF records; header is the byte range of the VCF header
+#As in loadVCF, each group of records is applied to the original consensus
+#Returns (locid, new consensus or None, number of records passing FILTER, CHROM
+#of groups that gave a consensus of the wrong length)
+#If l is None, the ranges match no locus, and only the records are counted
+def loadVCF_worker(infile, header, thresh, altRef, task):
+	l, ranges = task
+	records = 0
+	if l is None:
+		for reclist in vcf_tools.read_vcf(infile, [header]+ranges):
+			records += len(reclist)
+		return((None, None, records, list()))
+	locid, seq = locus_source(l)
+	ref = seq.tobytes().decode()
+	new_cons = None
+	bad = list()
+	for reclist in vcf_tools.read_vcf(infile, [header]+ranges):
+		records += len(reclist)
+		cons = vcf_tools.make_consensus_from_vcf(ref, reclist[0].CHROM, reclist, thresh, altRef)
+		if len(cons) != len(ref): #Check length first
+			bad.append(reclist[0].CHROM)
+		else:
+			new_cons = cons
+	return((locid, new_cons, records, bad))
 
 #Worker function for loadLOCI_parallel
-def loadLOCI_worker(db, params_cov, params_minlen, params_thresh, params_mask, chunk):
-	connection = sqlite3.connect(db)
-	#Parse LOCI file and create database
-	for aln in aln_file_tools.read_loci(chunk):
-		#NOTE: Add error handling, return error code
-		cov = len(aln)
-		alen = aln.get_alignment_length()
-
-		#Skip if coverage or alignment length too short
-		if cov < params_cov or alen < params_minlen:
-			#print("Locus skipped")
-			continue
-		else:
-			#Add each locus to database
+def loadLOCI_worker(infile, params_cov, params_minlen, params_thresh, params_mask, chunk):
+	batch = queueBatcher()
+	try:
+		#Parse LOCI byte range
+		#Loci failing coverage or alignment length are skipped by the reader
+		offset, length = chunk
+		for cov, aln in aln_file_tools.read_loci_matrix(infile, params_cov, params_minlen, offset, length):
+			#NOTE: Add error handling, return error code
+			#Add each locus to the next batch
 			locus = a.consensAlign(aln, threshold=params_thresh, mask=params_mask)
-
-			#Acquire lock, submit to Database
-			lock.acquire()
-			locid = m.add_locus_record(connection, cov, locus.conSequence, 1, "NULL")
-			#print("Loading Locus #:",locid)
-
-			#Extract variable positions for database
-			#for var in locus.alnVars:
-				#m.add_variant_record(connection, locid, var.position, var.value)
-			lock.release()
-	connection.close()
+			batch.add(m.locus_row(cov, locus.conSequence, 1, "NULL"))
+	finally:
+		closeBatcher(batch)
 
 
 #Function to discover target regions using a sliding windows through passedLoci
 def targetDiscoverySlidingWindow_parallel(conn, params, loci):
 	"""
 	Format:
-	1. Write pandas DF to n chunk files
-	2. List of chunk file names
-	3. Pass 1 chunk file to each worker in a multiprocessing pool.
+	1. Copy consensus sequences to shared memory (bytes + offsets)
+	2. Split loci into many tasks of about equal total length, cutting long
+	   loci into tiles
+	3. Hand out tasks one at a time to workers in a multiprocessing pool.
 	Master:
-		creates n chunk files
+		creates shared memory blocks
 		creates multiprocessing pool
+		joins the tiles of each long locus back together
+		single writer: INSERTs rows returned by workers with executemany
 	Workers:
-		read file chunk
-		calculate consensus
-		grab lock
-		INSERT data to SQL database
-		release lock
+		read loci (or a tile of a locus) from shared memory
+		find target regions
+		return rows
 	"""
 	t = int(params.threads)
-	chunk = 1
 	loci_num = int(loci.shape[0])
 	#print("number of loci:",loci_num)
 	#print("number of threads:",t)
-	chunks = 0
-	if loci_num < t:
-		chunks = loci_num
-	else:
-		chunks = t
-	chunk_size = loci_num // chunks
-	remainder = loci_num % chunks
-	#print("Chunk size is:",chunk_size)
-	#print("remainder is:",remainder)
-
-	start = 0
-	stop = 0
-
-	files = list()
-	#Split loci DataFrame into chunks, and keep list of chunk files
-	for df_chunk in np.array_split(loci, chunks):
-		size = df_chunk.shape[0]
-		#print("size of chunk",chunk,"is:",size)
-		chunk_file = params.workdir + "/." + str(chunk) + ".chunk.hdf"
-		df_chunk.to_hdf(chunk_file, "NULL", mode="w", format="f")
-		files.append(chunk_file)
-		chunk += 1
-
-	#Initialize multiprocessing pool
-	#if 'lock' not in globals():
-	lock = multiprocessing.Lock()
-	with multiprocessing.Pool(t,initializer=init, initargs=(lock,)) as pool:
-		func = partial(targetDiscoverySlidingWindow_worker, params.db, params.win_shift, params.win_width, params.var_max, params.numN, params.numG, params.blen, params.flank_dist)
-		results = pool.map(func, files)
-	pool.close()
-	pool.join()
-
-	#reset_lock()
-	#Remove chunkfiles
-	d = os.listdir(params.workdir)
-	for item in d:
-	    if item.endswith(".chunk.hdf"):
-	        os.remove(os.path.join(params.workdir, item))
+
+	shared_seqs, shared_index = shareLoci(loci)
+	try:
+		offsets = np.ndarray((2, loci_num+1), dtype=np.int64, buffer=shared_index.buf)[1].copy()
+		tile = params.win_shift if canTile(params.win_shift, params.win_width, params.blen) else None
+		tasks = lociTasks(offsets, t, tile)
+		stitchers = tileStitchers(params, tasks, partial(frameLocus, loci))
+		writeTargets(conn, params, tasks, stitchers, initSharedLoci, (shared_seqs.name, shared_index.name, loci_num))
+	finally:
+		shared_seqs.close()
+		shared_seqs.unlink()
+		shared_index.close()
+		shared_index.unlink()
+
+#Function to discover target regions in a genome FASTA kept on disk (--genome)
+#loci is a DataFrame of id, chrom, length (see getPassedLociInfo)
+#Each worker memory-maps the FASTA, and tasks are GENOME_WINDOW bases long
+#whatever the genome size, so memory use does not grow with the genome
+def targetDiscoveryGenome_parallel(conn, params, loci):
+	offsets = np.zeros(loci.shape[0]+1, dtype=np.int64)
+	offsets[1:] = np.cumsum(loci["length"].values)
+	tile = params.win_shift if canTile(params.win_shift, params.win_width, params.blen) else None
+	tasks = lociTasks(offsets, int(params.threads), tile, GENOME_WINDOW)
+	with aln_file_tools.genomeFasta(params.assembly) as genome:
+		stitchers = tileStitchers(params, tasks, partial(fastaLocus, genome, loci))
+		writeTargets(conn, params, tasks, stitchers, initGenome,
+			(params.assembly, loci["id"].tolist(), loci["chrom"].tolist()))
+
+#Function to get (locid, sequence) of locus l in a DataFrame of id, consensus
+def frameLocus(loci, l):
+	return((int(loci["id"].iloc[l]), np.frombuffer(loci["consensus"].iloc[l].encode(), dtype=np.uint8)))
+
+#Function to get (locid, sequence) of locus l in a DataFrame of id, chrom, from a genomeFasta
+def fastaLocus(genome, loci, l):
+	return((int(loci["id"].iloc[l]), genome.sequence(loci["chrom"].iloc[l])))
+
+#Function to make a tileStitcher for each locus cut into tiles by lociTasks
+#getLocus(l) returns (locid, sequence) of locus l, to re-scan tiles in this process
+def tileStitchers(params, tasks, getLocus):
+	ends = dict()
+	for task in tasks:
+		if task[0] == "tile":
+			ends.setdefault(task[1], list()).append(task[4])
+	stitchers = dict()
+	for l in ends:
+		redo = partial(rescanTile, getLocus, l, params.win_shift, params.win_width,
+			params.var_max, params.numN, params.numG, params.blen, params.flank_dist)
+		stitchers[l] = tileStitcher(sorted(ends[l]), redo)
+	if len(ends) > 0:
+		print("\t\t\tSplit",len(ends),"long loci into",sum([len(x) for x in ends.values()]),"tiles.")
+	return(stitchers)
+
+#Function to map the target discovery worker over tasks in a pool, joining tiles
+#with stitchers, with this process as the only db writer
+def writeTargets(conn, params, tasks, stitchers, initializer, initargs):
+	t = int(params.threads)
+	func = partial(targetDiscoverySlidingWindow_worker, params.win_shift, params.win_width, params.var_max, params.numN, params.numG, params.blen, params.flank_dist)
+	batch = m.rowBatcher(partial(m.add_region_records, conn), params._batch)
+	written = 0
+	busy = dict()
+	with multiprocessing.Pool(t,initializer=initializer, initargs=initargs) as pool:
+		for pid, seconds, (task, result) in pool.imap_unordered(partial(timedTask, func), tasks):
+			busy[pid] = busy.get(pid, 0.0) + seconds
+			if task[0] == "tile":
+				rows = stitchers[task[1]].add(task[2], result)
+			else:
+				rows = result
+			for row in rows:
+				batch.add(row)
+			written += len(rows)
+	batch.flush()
+	print("\t\t\tWrote",written,"records")
+	reportBusy(busy, t)
 
 
 #Function to discover target regions using a sliding windows through passedLoci
-def targetDiscoverySlidingWindow_worker(db, shift, width, var, n, g, blen, flank_dist, chunk):
-	connection = sqlite3.connect(db)
-	#print("process: reading hdf from",chunk)
-	loci = pd.read_hdf(chunk)
+#task is a ("loci", first, last) range of loci, or a ("tile", locus, k, start, end)
+#tile of one locus (see lociTasks), read through the locus_source set by the initializer
+#Returns (task, rows), or (task, tileTargets result) for a tile
+def targetDiscoverySlidingWindow_worker(shift, width, var, n, g, blen, flank_dist, task):
+	if task[0] == "tile":
+		locid, seq = locus_source(task[1])
+		return((task, tileTargets(locid, seq, shift, width, var, n, g, blen, flank_dist, task[3], task[4])))
+	rows = list()
 	#looping through passedLoci only
 	#print("process: starting iteration")
-	for seq in loci.itertuples():
-		#print(seq)
-		start = 0
-		stop = 0
-		#print("\nConsensus: ", seq[2], "ID is: ", seq[1], "\n")
-		generator = s.slidingWindowGenerator(seq[2], shift, width)
-		for window_seq in generator():
-
-			seq_norm = s.simplifySeq(window_seq[0])
-			counts = s.seqCounterSimple(seq_norm)
-
-			#If window passes filters, extend current bait region
-			#print("Start is ", start, " and stop is ",stop) #debug print
-			if counts['*'] <= var and counts['N'] <= n and counts['-'] <= g:
-				stop = window_seq[2]
-			else:
-				#If window fails, check if previous bait region passes to submit to DB
-				#print (stop-start)
-				if (stop - start) > blen:
-					target = (seq[2])[start:stop]
-					tr_counts = s.seqCounterSimple(s.simplifySeq(target))
-					n_mask = utils.n_lower_chars(target)
-					n_gc = s.gc_counts(target)
-					#Check that there aren't too many SNPs
-					#if tr_counts["*"] <= params.vmax_r:
-					#print("	Target region: ", target)
-					#Submit target region to database
-					#print("process: grabbing lock")'
-					flank_counts = s.getFlankCounts(seq[2], start, stop, flank_dist)
-					lock.acquire()
-					m.add_region_record(connection, int(seq[1]), start, stop, target, tr_counts, flank_counts, n_mask, n_gc)
-					#print("process: releasing lock")
-					lock.release()
-					#set start of next window to end of current TR
-					generator.setI(stop)
-
-				#If bait fails, set start to start point of next window
-				start = generator.getI()+shift
-	connection.close()
+	for l in range(task[1], task[2]):
+		locid, seq = locus_source(l)
+		consensus = seq[0:len(seq)].tobytes().decode()
+		#print("\nConsensus: ", consensus, "ID is: ", locid, "\n")
+		#Count SNPs, Ns and gaps once per locus; windows and targets are then O(1) lookups
+		counter = s.prefixCounter(consensus)
+		for start, stop in s.slidingWindowTargets(counter, shift, width, var, n, g, blen):
+			target = consensus[start:stop]
+			tr_counts = counter.counts(start, stop)
+			n_mask = utils.n_lower_chars(target)
+			n_gc = s.gc_counts(target)
+			#Check that there aren't too many SNPs
+			#if tr_counts["*"] <= params.vmax_r:
+			#print("	Target region: ", target)
+			#Add target region to the returned rows
+			flank_counts = counter.flankCounts(start, stop, flank_dist)
+			rows.append(m.region_row(locid, start, stop, target, tr_counts, flank_counts, n_mask, n_gc))
+	return((task, rows))
+
+#Function to re-scan tile [start, end) of locus l in this process (see tileStitcher)
+def rescanTile(getLocus, l, shift, width, var, n, g, blen, flank_dist, start, end):
+	locid, seq = getLocus(l)
+	return(tileTargets(locid, seq, shift, width, var, n, g, blen, flank_dist, start, end))
+
+
+#Function to find target regions in the tile [start, end) of a long locus
+#seq is the whole consensus, as a uint8 array (or an aln_file_tools.faiSequence)
+#The scan begins at start as if a new target began there, and carries on past end
+#until TILE_EVENTS events of sequence_tools.targetEvents lie beyond it: this is the
+#overlap with the next tile, where tileStitcher looks for the point the scans meet
+#Only windows, targets and flanks actually reached are counted, so memory does
+#not depend on locus length
+#Returns dict of rows ((x, row) for each target), head (x of the first TILE_EVENTS
+#events), tail (x of events at or past end) and complete (scan reached the end of the locus)
+def tileTargets(locid, seq, shift, width, var, n, g, blen, flank_dist, start, end):
+	seqlen = len(seq)
+	result = {"rows":list(), "head":list(), "tail":list(), "complete":True}
+	for x, region in s.countedTargetEvents(seq, shift, width, var, n, g, blen, flank_dist, x=start, block=min(max(end-start, TILE_MIN), s.TARGET_BLOCK)):
+		if len(result["head"]) < TILE_EVENTS:
+			result["head"].append(x)
+		if region is not None:
+			result["rows"].append((x, m.region_row(locid, *region)))
+		if x >= end and end < seqlen:
+			result["tail"].append(x)
+			if len(result["tail"]) >= TILE_EVENTS:
+				result["complete"] = False
+				break
+	return(result)
+
+#Object joining the tiles of one locus, as they arrive in any order
+#ends are the tile end positions; redo(start, end) re-scans a tile (tileTargets)
+#Scans of neighbouring tiles are joined at the first x found both in the tail of
+#one and the head of the next: from there on both scans are the same, so rows
+#up to x come from the first and rows after it from the second. If the scans
+#never meet, the tile is scanned again here, from the last x of the previous one
+class tileStitcher():
+	def __init__(self, ends, redo):
+		self.ends = ends
+		self.redo = redo
+		self.tiles = dict()
+		self.next = 0
+		self.prev = None
+		self.joined = -1 #rows of prev up to this x were already returned
+
+	#Function to add the result of tile k; returns rows that are now final
+	def add(self, k, result):
+		rows = list()
+		if self.next >= len(self.ends):
+			return(rows)
+		self.tiles[k] = result
+		while self.next in self.tiles:
+			cur = self.tiles.pop(self.next)
+			if self.prev is not None:
+				head = set(cur["head"])
+				joins = [x for x in self.prev["tail"] if x in head]
+				if len(joins) > 0:
+					#A long tail can reach past rows already returned from prev
+					x = max(joins[0], self.joined)
+				else:
+					x = self.prev["tail"][-1]
+					cur = self.redo(x, self.ends[self.next])
+				rows += [row for y, row in self.prev["rows"] if self.joined < y <= x]
+				self.joined = x
+			self.prev = cur
+			self.next += 1
+			if cur["complete"]:
+				#Scan reached the end: later tiles are not needed
+				rows += [row for y, row in cur["rows"] if y > self.joined]
+				self.next = len(self.ends)
+				self.tiles.clear()
+				break
+		return(rows)
 
 
 #Function to get DataFrame of targets + flank regions, and calculate some stuff
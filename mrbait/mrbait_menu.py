@@ -67,7 +67,15 @@ General options:
 			-r 2 : Continues after Step 2 (Target discovery)
 			-r 3 : Continues after Step 3 (Target filtering/ selection)
 			-r 4 : Continues after step 4 (Bait discovery)
+		--Warns if input files have changed since Step 1
 	--db		: .sqlite file containing pre-existing database. For use with --resume
+	--db_profile	: SQLite settings to use for the database [safe]
+		--Options
+			safe   : SQLite defaults; every commit is synced to disk
+			fast   : WAL journal, no syncing, larger cache; faster but a crash
+				 can corrupt the database
+			memory : Run in memory, saving to --db after each step
+				 (and if the run stops early)
 	-T,--threads	: Number of threads to use for processes that can run in parallel [1]
 	-h,--help	: Displays this help menu
 	""")
@@ -77,14 +85,22 @@ Input options:
 	-M,--maf	: Input multiple alignment MAF file
 	-L,--loci	: For RAD-data, as the \".loci\" output of pyRAD
 	-A,--assembly	: Input whole genome assembly as FASTA
-	-X,--xmfa	: Input whole genome alignments as XMFA""")
+	-X,--xmfa	: Input whole genome alignments as XMFA
+		--Inputs are indexed in a <file>.mbi sidecar, reused until
+		  the file's size or modification time changes
+		--All inputs (including -V and -G) may be gzip-compressed; use
+		  bgzip to allow parallel loading and --genome""")
 	print("""
 Assembly input options (for use only with -A <genome.fasta>):
 
 	-V,--vcf	: VCF file containing variant information
 	-G,--gff	: GFF file containing annotation information
 	--vcfALT	: If using VCF and reference allele is gap/N, attempt
-		 	   to call new consensus using VCF ALT alleles [default=OFF]""")
+		 	   to call new consensus using VCF ALT alleles [default=OFF]
+	--genome	: Keep the assembly on disk (indexed in <assembly>.mbi) rather
+		 	   than loading contigs into the database [default=OFF]
+		--For chromosome-scale assemblies; cannot be used with -V
+		--Contigs are named by the first word of each header""")
 	print("""
 Alignment filtering/ consensus options (use with -M or -L inputs):
 
@@ -147,6 +163,7 @@ Target Region options:
 			               https://github.com/The-Sequence-Ontology/Specifications/blob/master/gff3.md
 			gff_a=[alias]: Only retain targets within \"d\" distance of GFF records with attributes of \"Alias\"
 			               Note that \"gff\" and \"gffa\" options are case-insensitive
+			               If only gff=[type] filters are given, only GFF records of those types are loaded
 		Ex1: -F snp=1,10 -d 100 to sample when 1-10 SNPs w/in 100 bases
 		Ex2: -F gc=0.2,0.8 -F rand=100 to randomly sample 100 targets with GC between 20-80%
 		Ex3: -F mask=0.0,0.1 to remove targets with >10% \masked bases
@@ -233,7 +250,7 @@ class parseArgs():
 			"vthreads=","hacker=", "evalue=", "e_value=", "gapopen=", "gapextend=",
 			"word_size=", "megablast", "blastn=", "makedb=", "gap_extend=",
 			"word=", "mega", "gap_open=", "blast_db=", "fasta_db=", "wordsize=", "nodust", "strand=",
-			"resume=","db=", "print_tr", "xmfa=", "print_loc", "vcfALT"])
+			"resume=","db=", "db_profile=", "print_tr", "xmfa=", "print_loc", "vcfALT", "genome"])
 		except getopt.GetoptError as err:
 			print(err)
 			display_help("\nExiting because getopt returned non-zero exit status.")
@@ -249,6 +266,7 @@ class parseArgs():
 		self.assembly=None
 		self.xmfa=None
 		self.vcfALT=False
+		self.genome=False
 
 		#Locus filtering params
 		self.cov=1
@@ -319,6 +337,7 @@ class parseArgs():
 
 		self.ploidy=2
 		self.db=""
+		self.db_profile="safe"
 		self.resume=None
 
 		#HACKER ONLY OPTIONS
@@ -327,6 +346,7 @@ class parseArgs():
 		self._weightMax = 50000 #maximum size to attempt weighted edge resolution
 		self._weightByMin = 0
 		self._os = None
+		self._batch = 10000 #rows to accumulate before each INSERT batch
 
 
 
@@ -358,6 +378,8 @@ class parseArgs():
 				self.assembly = arg
 			elif opt in ("vcfALT"):
 				self.vcfALT = True
+			elif opt == "genome":
+				self.genome = True
 
 			#Locus filtering params
 			elif opt in ('c', 'cov'):
@@ -530,6 +552,9 @@ class parseArgs():
 				self.print_loc = True
 			elif opt == "db":
 				self.db = str(arg)
+			elif opt == "db_profile":
+				self.db_profile = arg.lower()
+				assert self.db_profile in ("safe", "fast", "memory"), "Unrecognized option %s for <--db_profile>"%arg
 			elif opt in ('T', 'threads'):
 				self.threads = arg
 
@@ -551,6 +576,10 @@ class parseArgs():
 				elif main == "weightMax":
 					assert len(subopts) == 2, "Warning: HACKER option <graphMax> must have two arguments separated by \"=\""
 					self._weightMax = int(subopts[1])
+				elif main == "batch":
+					assert len(subopts) == 2, "Warning: HACKER option <batch> must have two arguments separated by \"=\""
+					self._batch = int(subopts[1])
+					assert self._batch > 0, "Warning: HACKER option <batch> must be greater than zero"
 				elif main == "os":
 					assert len(subopts) == 2, "Warning: HACKER option <os> must have two arguments separated by \"=\""
 					os_in = subopts[1]
@@ -685,6 +714,13 @@ class parseArgs():
 			#if self.mask or self.thresh:
 				#print("WARNING: <-q,--thresh> and <-k,--mask> inputs have no affect when using a FASTA input file. Ignoring them.")
 			self.cov = 0
+		if self.genome:
+			if not self.assembly:
+				sys.exit("ERROR: <--genome> requires a FASTA assembly file (-A).")
+			if self.vcf:
+				sys.exit("ERROR: VCF inputs cannot be used with <--genome>, since contig sequences are not stored in the database.")
+			if utils.fileCheck(self.assembly) and utils.compression(self.assembly) == "gzip":
+				sys.exit("ERROR: <--genome> needs an uncompressed or bgzip-compressed assembly, since contigs are read a piece at a time. Please recompress it with bgzip.")
 		if self.gff or self.vcf:
 			if not self.assembly:
 				sys.exit("ERROR: VCF and GFF inputs require a FASTA assembly file.")
@@ -2,6 +2,7 @@
 
 import re
 import sys
+import numpy as np
 from itertools import product
 
 #Function to split character to IUPAC codes, assuing diploidy
@@ -138,6 +139,186 @@ def seqCounterSimple(seq):
 			d[c] += 1
 	return d
 
+#Lookup table classifying bytes as ambiguity ('*'), N, or gap, ignoring case
+#Same classes as simplifySeq + seqCounterSimple; everything else counts as 0
+COUNT_CLASSES = ("*", "N", "-")
+COUNT_TABLE = np.zeros((3, 256), dtype=np.int32)
+for c in "RYSWKMBDHV*":
+	COUNT_TABLE[0][ord(c)] = COUNT_TABLE[0][ord(c.lower())] = 1
+for c in "Nn":
+	COUNT_TABLE[1][ord(c)] = 1
+COUNT_TABLE[2][ord("-")] = 1
+
+#Object holding prefix sums of '*', N, and gap counts for a sequence
+#Counts for any substring [i:j] are then three subtractions, rather than a
+#simplifySeq + seqCounterSimple pass over the substring
+#seq may be a str, bytes, or uint8 array; it may also be a segment of a longer
+#sequence starting at offset (of total length seqlen), in which case all
+#coordinates are positions in the longer sequence
+class prefixCounter():
+	def __init__(self, seq, offset=0, seqlen=None):
+		if isinstance(seq, str):
+			seq = seq.encode("ascii", "replace")
+		codes = np.frombuffer(seq, dtype=np.uint8)
+		self.offset = offset
+		self.end = offset + len(codes)
+		self.seqlen = self.end if seqlen is None else seqlen
+		self.prefix = np.zeros((3, len(codes)+1), dtype=np.int32)
+		np.cumsum(COUNT_TABLE[:, codes], axis=1, out=self.prefix[:, 1:])
+
+	#Returns same dict as seqCounterSimple(simplifySeq(seq[i:j]))
+	def counts(self, i, j):
+		c = self.prefix[:, j-self.offset] - self.prefix[:, i-self.offset]
+		return({"N":int(c[1]), "-":int(c[2]), "*":int(c[0])})
+
+	#Returns same dict as getFlankCounts(seq, x, y, dist)
+	def flankCounts(self, x, y, dist):
+		x2 = max(x-dist, 0) - self.offset
+		y2 = min(y+dist, self.seqlen) - self.offset
+		x = x - self.offset
+		y = y - self.offset
+		c = (self.prefix[:, x] - self.prefix[:, x2]) + (self.prefix[:, y2] - self.prefix[:, y])
+		return({"N":int(c[1]), "-":int(c[2]), "*":int(c[0])})
+
+	#Returns boolean array: does the window starting at each position in
+	#[first, last) fail the filters (default: every position in the counter)
+	def failedWindows(self, width, var, n, g, first=None, last=None):
+		first = self.offset if first is None else first
+		last = self.end if last is None else last
+		fail = np.zeros(last-first, dtype=bool)
+		#Windows starting before seqlen-width are full width, the rest end at seqlen
+		full = min(max(self.seqlen-width+1, first), last) - first
+		i = first - self.offset
+		for row, limit in zip(self.prefix, (var, n, g)):
+			fail[:full] |= (row[i+width:i+width+full] - row[i:i+full]) > limit
+			if full < len(fail):
+				fail[full:] |= (row[self.seqlen-self.offset] - row[i+full:last-self.offset]) > limit
+		return(fail)
+
+#Number of window starts classified at a time by targetEvents, when it is not
+#given a prefixCounter for the whole sequence
+TARGET_BLOCK = 1000000
+
+#Generator yielding (start, stop) of target regions found by sliding a window
+#along the sequence in a prefixCounter. Identical to stepping a windowIterator
+#one window at a time, extending a target while windows pass the var/n/g filters,
+#and when one fails submitting the target (if longer than blen) and jumping past
+#it; but only failing windows are visited: runs of passing windows are skipped
+def slidingWindowTargets(counter, shift, width, var, n, g, blen):
+	for x, region in targetEvents(counter, shift, width, var, n, g, blen):
+		if region is not None:
+			yield(region)
+
+#Generator doing the work for slidingWindowTargets, yielding (x, region) for
+#each failing window visited: region is the submitted (start, stop) or None,
+#and x is where the next target starts. seq is a prefixCounter for the whole
+#sequence, or the sequence itself (str or uint8 array), which is then counted
+#in blocks of TARGET_BLOCK windows, so that memory does not grow with its length
+#Scanning can begin at any x: as long as width-(2*shift) <= blen, a target can
+#never be submitted at the first window visited after a failing one, so
+#everything after an event depends only on its x. Two scans passing through
+#the same x are identical from there on (used to stitch tiles of long loci)
+def targetEvents(seq, shift, width, var, n, g, blen, x=0, block=TARGET_BLOCK):
+	seqlen = seq.seqlen if isinstance(seq, prefixCounter) else len(seq)
+	start = x
+	stop = x
+	i = x
+	while i < seqlen:
+		#Classify windows starting in [first, last)
+		if isinstance(seq, prefixCounter):
+			first, last = 0, seqlen
+			fail = seq.failedWindows(width, var, n, g)
+		else:
+			first, last = i, min(i+block, seqlen)
+			counter = prefixCounter(seq[first:min(last+width, seqlen)], first, seqlen)
+			fail = counter.failedWindows(width, var, n, g, first, last)
+		#next_fail[p]: first failing window start at p, p+shift, p+2*shift, ... (or last)
+		span = last-first
+		next_fail = np.full(span, last, dtype=np.int64)
+		for r in range(min(shift, span)):
+			idx = np.arange(r, span, shift)
+			vals = np.where(fail[idx], idx+first, last)
+			next_fail[idx] = np.minimum.accumulate(vals[::-1])[::-1]
+		while i < last:
+			#Last window from i: first one reaching the end, or last start before it
+			if i+width >= seqlen:
+				end = i
+			else:
+				end = i + -(-(seqlen-width-i) // shift)*shift
+				if end >= seqlen:
+					end -= shift
+			f = int(next_fail[i-first])
+			if f > end:
+				#All remaining windows pass
+				stop = min(end+width, seqlen)
+				return
+			if f == last:
+				#All windows to the end of this block pass
+				p = i + ((last-1-i) // shift)*shift
+				stop = min(p+width, seqlen)
+				i = p+shift
+				break
+			if f > i:
+				#Windows i ... f-shift pass, extending the current target
+				stop = min(f-shift+width, seqlen)
+			#Window at f fails: submit current target if long enough
+			if (stop - start) > blen:
+				region = (start, stop)
+				i = stop
+			else:
+				region = None
+				i = f
+			start = i+shift
+			yield((start, region))
+			if f+width >= seqlen:
+				return
+			i += shift
+
+#Generator over targetEvents that also counts each target, yielding (x, region)
+#where region is None or (start, stop, target, counts, flank_counts, mask, gc)
+#Each target is counted from its own slice of seq (plus flanks), so seq (a uint8
+#array, or anything sliced into one) is never held in memory as a whole
+def countedTargetEvents(seq, shift, width, var, n, g, blen, flank_dist, x=0, block=TARGET_BLOCK):
+	seqlen = len(seq)
+	for x, region in targetEvents(seq, shift, width, var, n, g, blen, x, block):
+		if region is not None:
+			start, stop = region
+			x2 = max(start-flank_dist, 0)
+			window = seq[x2:min(stop+flank_dist, seqlen)]
+			counter = prefixCounter(window, x2, seqlen)
+			codes = window[start-x2:stop-x2]
+			region = (start, stop, codes.tobytes().decode(), counter.counts(start, stop),
+				counter.flankCounts(start, stop, flank_dist), mask_counts_array(codes), gc_counts_array(codes))
+		yield((x, region))
+
+#Function to get counts of N, gap, masked, and GC bases of a sequence (uint8
+#array, or anything sliced into one), counted a block at a time
+#Returns dict with keys "N", "-", "mask", and "gc"
+def compositionCounts(seq, block=TARGET_BLOCK):
+	counts = {"N":0, "-":0, "mask":0, "gc":0}
+	for i in range(0, len(seq), block):
+		codes = seq[i:i+block]
+		counts["N"] += int(np.count_nonzero(COUNT_TABLE[1][codes]))
+		counts["-"] += int(np.count_nonzero(COUNT_TABLE[2][codes]))
+		counts["mask"] += mask_counts_array(codes)
+		counts["gc"] += gc_counts_array(codes)
+	return(counts)
+
+#Lookup tables for gc_counts and mask_counts of uint8 arrays
+GC_TABLE = np.zeros(256, dtype=bool)
+for c in "GCgc":
+	GC_TABLE[ord(c)] = True
+LOWER_TABLE = np.zeros(256, dtype=bool)
+LOWER_TABLE[ord("a"):ord("z")+1] = True
+
+#Function to get gc_counts of a uint8 array
+def gc_counts_array(codes):
+	return(int(np.count_nonzero(GC_TABLE[codes])))
+
+#Function to get mask_counts of a uint8 array
+def mask_counts_array(codes):
+	return(int(np.count_nonzero(LOWER_TABLE[codes])))
+
 #Function to get GC content of a provided sequence
 def gc_counts(string):
 	new = re.sub('[GCgc]','#',string)
@@ -191,37 +372,35 @@ def countSlidingWindow(seq, shift, width):
 		window_seq = "".join(i)
 		seqCounterSimple(window_seq)
 
-#Object for creating an iterable slidinw window sampling
-class slidingWindowGenerator():
-	#Need to come back and comment better...
-	def __init__(self, seq, shift, width):
-		self.__seq = seq
-		self.__seqlen = len(self.__seq)
-		self.__shift = shift
-		self.__width = width
-		self.__i = 0
-
-	def __call__(self):
-		self.__seqlen
-		while self.__i < self.__seqlen:
-			#print("i is ", self.__i, " : Base is ", self.__seq[self.__i]) #debug print
-			if self.__i+self.__width > self.__seqlen:
-				j = self.__seqlen
-			else:
-				j = self.__i + self.__width
-			yield [self.__seq[self.__i:j], self.__i, j]
-			if j==self.__seqlen: break
-			self.__i += self.__shift
-
-	@classmethod
-	def setI(self, value):
-		self.__i = value
-
-	@classmethod
-	def getI(self):
-		return self.__i
-
-	def __getattr__(self, name):
-		return getattr(self.__class__, name)
-	def __setattr__(self, name, val):
-		return setattr(self.__class__, name, val)
+#Object for iterating over sliding window (start, stop) indices
+#State is kept per instance, and no substrings are sliced: use seq[start:stop]
+#Windows are "width" wide, every "shift" bases; the last window is truncated at
+#seqlen, and iteration stops after it. jump(i) makes the next window start at i
+class windowIterator():
+	__slots__ = ("seqlen", "shift", "width", "i")
+
+	def __init__(self, seqlen, shift, width):
+		self.seqlen = seqlen
+		self.shift = shift
+		self.width = width
+		self.i = 0
+
+	def __iter__(self):
+		seqlen = self.seqlen
+		width = self.width
+		while self.i < seqlen:
+			start = self.i
+			stop = start + width
+			if stop > seqlen:
+				stop = seqlen
+			self.i = start + self.shift
+			yield (start, stop)
+			if stop == seqlen: break
+
+	#Move the start of the next window
+	def jump(self, i):
+		self.i = i
+
+	#Start of the next window
+	def next_start(self):
+		return self.i
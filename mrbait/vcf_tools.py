@@ -1,44 +1,152 @@
 #!/usr/bin/python
-import os
+import re
 import sys
 import vcf
+from collections import Counter
 from mrbait import misc_utils as utils
 from mrbait import alignment_tools as aln
+from mrbait import aln_file_tools
+
+#Column separators, as PyVCF reads them (tabs, or runs of spaces)
+VCF_SEPARATOR = re.compile("\t| +")
 
 #Read VCF variant calls
+#If ranges is given, only those (offset, length) byte ranges are read, which
+#must include the header (see aln_file_tools.index_vcf)
+#Records are parsed with the minimal vcfRecord reader, unless pyvcf=True, which
+#uses PyVCF to parse and validate the header and every field (much slower)
 #Generator function, yields each locus
-def read_vcf(v):
+def read_vcf(v, ranges=None, pyvcf=False):
 
 	if not utils.fileCheck(v):
 		raise FileNotFoundError("Fatal exception, file %s not found."%v)
 
 	try:
-		vfh = vcf.Reader(filename=v)
+		#Compression is found from content, not the file extension
+		if ranges is None:
+			fh = utils.open_input(v, text=True)
+		else:
+			fh = aln_file_tools.range_lines(v, ranges)
+		if pyvcf:
+			vfh = vcf.Reader(fsock=fh)
+		else:
+			vfh = vcf_records(fh)
 	except IOError as err:
 		print("I/O error({0}): {1}".format(err.errno, err.strerror))
 	except:
 		print("Unexpected error:", sys.exec_info()[0])
 
+	return(group_vcf(vfh))
+
+#Function to parse VCF lines into vcfRecord objects, skipping header lines
+#Generator function, yields each record
+def vcf_records(lines):
+	for line in lines:
+		line = line.strip()
+		if not line or line[0] == "#":
+			continue
+		yield(vcfRecord(line))
+
+#Object holding the VCF fields used to build consensus sequences, with the
+#same attributes and values as a PyVCF record (CHROM, POS, ALT, FILTER, aaf)
+#Sample columns are kept as text, and only read if aaf is needed
+class vcfRecord():
+	__slots__ = ["CHROM", "POS", "ALT", "FILTER", "INFO", "FORMAT", "samples"]
+	def __init__(self, line):
+		if " " in line:
+			#Columns separated by spaces; samples are stored tab-separated
+			row = VCF_SEPARATOR.split(line, 9)
+			if len(row) > 9:
+				row[9] = "\t".join(VCF_SEPARATOR.split(row[9]))
+		else:
+			row = line.split("\t", 9)
+		self.CHROM = row[0]
+		self.POS = int(row[1])
+		self.ALT = [None if a in (".", "", "NA") else a for a in row[4].split(",")]
+		if row[6] == ".":
+			self.FILTER = None
+		elif row[6] == "PASS":
+			self.FILTER = []
+		else:
+			self.FILTER = row[6].split(";")
+		self.INFO = row[7]
+		self.FORMAT = None
+		self.samples = ""
+		if len(row) > 8 and row[8] != ".":
+			self.FORMAT = row[8]
+			if len(row) > 9:
+				self.samples = row[9]
+
+	#Alternate allele frequencies, from INFO/AC and AN if given, otherwise
+	#from sample genotypes (over called genotypes, as PyVCF does)
+	@property
+	def aaf(self):
+		freqs = info_aaf(self.INFO, len(self.ALT))
+		if freqs is None:
+			freqs = gt_aaf(self.FORMAT, self.samples, len(self.ALT))
+		return(freqs)
+
+#Function to get alternate allele frequencies from INFO/AC and AN
+#Returns None if either is missing or unusable
+def info_aaf(info, nalt):
+	if "AN=" not in info:
+		return(None)
+	ac = None
+	an = None
+	for field in info.split(";"):
+		if field.startswith("AC="):
+			ac = field[3:].split(",")
+		elif field.startswith("AN="):
+			an = field[3:]
+	try:
+		an = float(an)
+		ac = [float(x) for x in ac]
+	except (TypeError, ValueError):
+		return(None)
+	if an <= 0 or len(ac) != nalt:
+		return(None)
+	return([x/an for x in ac])
+
+#Function to get alternate allele frequencies from the GT field of each sample
+#Like PyVCF, every allele of a called genotype (including "." in "./1") counts
+#towards the total, and there must be at least one called genotype
+def gt_aaf(fmt, samples, nalt):
+	called = list()
+	if fmt:
+		fields = fmt.split(":")
+		if "GT" in fields:
+			i = fields.index("GT")
+			for sample in samples.split("\t"):
+				values = sample.split(":", i+1)
+				if i >= len(values) or values[i] in ("", "."):
+					continue
+				alleles = values[i].replace("|", "/").split("/")
+				if alleles.count(".") < len(alleles):
+					called += alleles
+	counts = Counter(called)
+	total = float(len(called))
+	return([counts[str(j)]/total for j in range(1, nalt+1)])
+
+#Function to group VCF records into lists of consecutive records from one CHROM
+#Records with a FILTER set are skipped
+#Generator function, yields each locus
+def group_vcf(reader):
 	chrom = ""
 	recs = []
-	added = 0
-	for rec in vfh:
+	for rec in reader:
 		if not rec.FILTER:
 			if chrom:
 				if chrom == rec.CHROM:
 					recs.append(rec)
-					added = 1
 				else:
 					#print("YIELDING")
 					yield recs
 					chrom = rec.CHROM
 					recs = [rec]
-					added = 0
 			else:
 				chrom = rec.CHROM
 				recs.append(rec)
-				added = 1
-	if added == 0 and recs:
+	if recs:
 		yield recs
 #NOTES:
 #If reference base from FASTA is N or gap, we try to call new consensus from VCF
@@ -46,156 +154,82 @@ def read_vcf(v):
 #If called as gap, we overwrite FASTA reference at that position.
 #MASKING information is retained from FASTA reference and NOT considered in VCF
 #Function to return new consensus sequence given REF and VCF records
+#The consensus is edited in place as bytes, and converted back to text once
+#Returns "" if no base was changed
 def make_consensus_from_vcf(ref, chrom, records, thresh, altRef):
-	consensus = ""
+	consensus = bytearray(ref.encode())
+	changed = False
 	for rec in records:
-		current_ref = ""
-		if consensus:
-			current_ref = consensus
-		else:
-			current_ref = ref
-		nucs = aln.get_iupac(current_ref[rec.POS-1].upper())
-		rec_alt = []
-		for x in rec.ALT:
-			rec_alt += str(x).upper()
-
-		cons = ""
-		chosen = 0
-
-		# print("current position:",rec.POS)
-		# print("VCF REF allele:",rec.REF)
-		# print("FASTA REF allele:",current_ref[rec.POS-1])
-		# print("ALT alleles:",rec_alt)
-
-		#If reference allele is N or gap:
-		if current_ref[rec.POS-1] in ["N", "n", "-"]:
-			#if altREF used, call new consensus from ALT alleles
-			if altRef:
-				#If ALT contains gap or N over threshold:
-				if "-" in rec_alt:
-					i = (rec_alt).index("-")
-					prop = rec.aaf[i]
-					if float(prop) >= float(thresh):
-						cons = "-"
-						chosen = 1
-				if "N" in rec_alt:
-					i = (rec_alt).index("N")
-					prop = rec.aaf[i]
-					if float(prop) >= float(thresh):
-						cons = "N"
-						chosen = 1
-
-				#If no gap is kept, need to make new consensus
-				#Add ALT alleles to list of observed nucs at this position
-				if chosen == 0:
-					nucs = rec_alt
-					#print(nucs)
-					temp = utils.listToSortUniqueString(nucs)
-					cons = aln.reverse_iupac(temp)
-					chosen = 1
-			else:
-				#if NOT altRef, retain N/gap
-				continue
-		#otherwise, make new consensus from all
-		else:
-			nucs += rec_alt
-			#print(nucs)
-			temp = utils.listToSortUniqueString(nucs)
-			cons = aln.reverse_iupac(temp)
-			chosen = 1
-			#print("\t\t\tWARNING: CHROM %s position %s (%s) doesn't match REF in VCF record (%s). "%(chrom, rec.POS, current_ref[rec.POS-1],rec.REF))
+		pos = rec.POS-1
+		base = chr(consensus[pos])
+		cons = vcf_consensus_base(base, rec, thresh, altRef)
 
 		#Incorporate new consensus base
-		if chosen == 1 and cons:
+		if cons:
 			#Retain masking info from FASTA reference
-			if current_ref[rec.POS-1].islower():
-				consensus = utils.stringSubstitute(current_ref, (rec.POS-1), cons.lower())
+			if base.islower():
+				cons = cons.lower()
+			else:
+				cons = cons.upper()
+			if pos < 0:
+				#Same result as a string substitution at a negative position (POS=0)
+				consensus = bytearray(utils.stringSubstitute(consensus.decode(), pos, cons).encode())
 			else:
-				consensus = utils.stringSubstitute(current_ref, (rec.POS-1), cons.upper())
+				consensus[pos] = ord(cons)
+			changed = True
 	#print("Reference:",ref)
 	#print("Consensus:",consensus)
-	return(consensus)
-
-#function to count number of loci in FASTA file (by headers)
-def countVCF(loci):
-	fh  = open(str(loci), 'r')
-	count=0
-	for l in fh:
-		line = l.strip()
-		if not line:
-			continue
-		if not line.startswith("#"):
-			count+=1
-	return(count)
-
-#Function to remove existing CHUNK files
-def removeChunks(dir_name):
-	test = os.listdir(dir_name)
-
-	for item in test:
-	    if item.endswith(".chunk"):
-	        os.remove(os.path.join(dir_name, item))
-
-#Function to chunk a VCF file
-def vcf_chunker(infile, chunks, wd):
-	chunks = int(chunks)
-	loci_count = countVCF(infile)
-	if loci_count < chunks:
-		chunks = loci_count
-	chunk_size = loci_count // chunks
-	removeChunks(wd) #clear any existing chunkfiles
-
-	files = list()
-	#write .loci file into chunk files
-	with open(infile) as file_object:
-		max_chunks = chunks
-		chunks = 1
-		record = 0
-
-		chunk_file = wd + "/." + str(chunks) + ".chunk"
-		out_object = open(chunk_file, "w")
-		files.append(chunk_file)
-
-		header = ""
-		hset = 0
-		for l in file_object:
-			line = l.strip()
-			if not line:
-				continue
-			#First, get header information
-			if hset == 0:
-				if line[0] == "#":
-					header +=str(line+"\n")
-				else:
-					record = 1
-					hset=1
-					out_object.write(header)
-					out = line + "\n"
-					out_object.write(out)
-			else:
-				#Write chunk_size alignments to each chunk
-				if chunks < max_chunks:
-					record += 1 #increment locus number
-				 	#If current chunk not full, add record to chunk
-					if record <= chunk_size:
-						out = line + "\n"
-						out_object.write(out)
-					#Otherwise, start new chunk
-					else:
-						record= 1
-						chunks = chunks + 1
-						out_object.close()
-						chunk_file = wd + "/." + str(chunks) + ".chunk"
-						out_object = open(chunk_file, "w")
-						out_object.write(header)
-						files.append(chunk_file)
-						out = line + "\n"
-						out_object.write(out)
-
-				#If last chunk, keep writing to final chunk file
-				else:
-					out = line + "\n"
-					out_object.write(out)
-		out_object.close()
-		file_object.close()
-	return(files)
+	if not changed:
+		return("")
+	return(consensus.decode())
+
+#Function to get the new consensus base for one VCF record, given the current base
+#Returns "" if the base is to be left as it is
+def vcf_consensus_base(base, rec, thresh, altRef):
+	nucs = aln.get_iupac(base.upper())
+	rec_alt = []
+	for x in rec.ALT:
+		rec_alt += str(x).upper()
+
+	cons = ""
+
+	# print("current position:",rec.POS)
+	# print("VCF REF allele:",rec.REF)
+	# print("FASTA REF allele:",base)
+	# print("ALT alleles:",rec_alt)
+
+	#If reference allele is N or gap:
+	if base in ["N", "n", "-"]:
+		#if altREF used, call new consensus from ALT alleles
+		if altRef:
+			chosen = 0
+			#If ALT contains gap or N over threshold:
+			if "-" in rec_alt:
+				i = (rec_alt).index("-")
+				prop = rec.aaf[i]
+				if float(prop) >= float(thresh):
+					cons = "-"
+					chosen = 1
+			if "N" in rec_alt:
+				i = (rec_alt).index("N")
+				prop = rec.aaf[i]
+				if float(prop) >= float(thresh):
+					cons = "N"
+					chosen = 1
+
+			#If no gap is kept, need to make new consensus
+			#Add ALT alleles to list of observed nucs at this position
+			if chosen == 0:
+				nucs = rec_alt
+				#print(nucs)
+				temp = utils.listToSortUniqueString(nucs)
+				cons = aln.reverse_iupac(temp)
+		#if NOT altRef, retain N/gap
+	#otherwise, make new consensus from all
+	else:
+		nucs += rec_alt
+		#print(nucs)
+		temp = utils.listToSortUniqueString(nucs)
+		cons = aln.reverse_iupac(temp)
+		#print("\t\t\tWARNING: CHROM %s position %s (%s) doesn't match REF in VCF record (%s). "%(chrom, rec.POS, base,rec.REF))
+	return(cons)
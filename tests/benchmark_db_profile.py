@@ -0,0 +1,94 @@
+#!/usr/bin/python
+
+import os
+import re
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+
+"""
+Benchmarking Steps 1-5 under each --db_profile (safe, fast, memory), using
+examples/example.loci concatenated to a larger file, and examples/example.fasta
+with examples/example.gff.
+
+Results (example.loci x 200, 2200 alignments; 1 thread):
+
+LOCI, profile safe:
+Step 1: 3.53 s  Step 2: 0.54 s  Step 3: 0.02 s  Step 4: 0.06 s  Step 5: 0.36 s
+5813 ms
+LOCI, profile fast:
+Step 1: 0.95 s  Step 2: 0.45 s  Step 3: 0.01 s  Step 4: 0.04 s  Step 5: 0.27 s
+2840 ms
+LOCI, profile memory:
+Step 1: 0.96 s  Step 2: 0.53 s  Step 3: 0.02 s  Step 4: 0.05 s  Step 5: 0.29 s
+2903 ms
+ASSEMBLY+GFF, profile safe:
+Step 1: 0.01 s  Step 2: 0.02 s  Step 3: 0.02 s  Step 4: 0.01 s  Step 5: 0.00 s
+1102 ms
+ASSEMBLY+GFF, profile fast:
+Step 1: 0.00 s  Step 2: 0.02 s  Step 3: 0.01 s  Step 4: 0.00 s  Step 5: 0.00 s
+1092 ms
+ASSEMBLY+GFF, profile memory:
+Step 1: 0.00 s  Step 2: 0.02 s  Step 3: 0.01 s  Step 4: 0.00 s  Step 5: 0.00 s
+1159 ms
+
+Conclusions:
+-With the safe (default) profile, Step 1 is dominated by fsync, because the
+	serial loaders still commit once per locus; fast/memory make it ~3.5X faster
+-Steps 2-5 already insert in batches, so the profile matters much less there
+-memory performs the same as fast here; its advantage is that the on-disk
+	database is only ever a complete copy taken at the end of a step
+-For the small assembly, total time is mostly Python/pandas start-up
+"""
+
+def time_me(method):
+    def wrapper(*args, **kw):
+        startTime = int(round(time.time() * 1000))
+        result = method(*args, **kw)
+        endTime = int(round(time.time() * 1000))
+
+        print(endTime - startTime,'ms')
+        return result
+
+    return wrapper
+
+#Function to build a larger .loci by repeating the loci of a small one
+def scaleLoci(loci, reps, out):
+	with open(loci) as fh:
+		records = fh.read()
+	with open(out, "w") as fh:
+		for i in range(reps):
+			fh.write(records)
+
+#Function to run the full pipeline once, and print the runtime of each step
+@time_me
+def runPipeline(label, profile, args):
+	print("%s, profile %s:"%(label, profile))
+	workdir = tempfile.mkdtemp()
+	cmd = [sys.executable, "-c", "import sys; sys.argv=['mrbait']+sys.argv[1:]; from mrbait import mrbait; mrbait.main()"]
+	cmd += args + ["-o", "bench", "--db_profile="+profile]
+	proc = subprocess.run(cmd, cwd=workdir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+	shutil.rmtree(workdir)
+	#Runtime lines are printed after each step, plus once for the database init
+	times = re.findall(r"\t\t### Runtime: .*\(([0-9.]+) seconds\)", proc.stdout)
+	print("  ".join(["Step %s: %.2f s"%(i, float(t)) for i, t in enumerate(times) if i > 0]))
+	if proc.returncode != 0:
+		print(proc.stdout)
+
+examples = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "examples")
+reps = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+tmp = tempfile.NamedTemporaryFile(suffix=".loci", delete=False)
+tmp.close()
+scaleLoci(os.path.join(examples, "example.loci"), reps, tmp.name)
+
+loci_args = ["-L", tmp.name, "-c", "5", "-b", "30", "-l", "60", "-v", "5", "-n", "4", "-g", "4", "-w", "3", "-s", "center=2,10"]
+asm_args = ["-A", os.path.join(examples, "example.fasta"), "-G", os.path.join(examples, "example.gff"),
+	"-l", "20", "-b", "20", "-F", "gff=exon", "-s", "flank=1,5"]
+
+for profile in ["safe", "fast", "memory"]:
+	runPipeline("LOCI", profile, loci_args)
+for profile in ["safe", "fast", "memory"]:
+	runPipeline("ASSEMBLY+GFF", profile, asm_args)
+os.remove(tmp.name)
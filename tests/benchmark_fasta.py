@@ -0,0 +1,132 @@
+#!/usr/bin/python
+
+import os
+import sys
+import mmap
+import time
+import random
+import tempfile
+from mrbait import aln_file_tools
+
+"""
+Benchmarking FASTA reading with the old line-by-line reader (seq += line),
+read_fasta(use_mmap=False) (lines joined once), read_fasta (memory mapped), and
+fasta_offsets alone (no sequences copied), on a synthetic assembly: 10 long
+contigs making up most of the size, plus 5000 short scaffolds, in 60 base lines.
+
+Results (300 Mb assembly):
+
+Old reader (seq += line):
+2513 ms
+read_fasta, use_mmap=False:
+2864 ms
+read_fasta, mmap:
+751 ms
+fasta_offsets only:
+77 ms
+
+Conclusions:
+-CPython can usually grow seq in place, so the old reader is not quadratic here,
+	but that is an implementation detail; joining the lines once does not depend
+	on it, at a small cost. Either way, most of the time is the per-line loop
+-With mmap, headers are found with find() and each sequence is a single copy
+	with newlines removed, so ~3X faster than before; loadFASTA uses this path
+-Offsets alone let callers skip the copy entirely (e.g. --genome)
+-In loadFASTA, the per-character composition counts of locus_row (~1 s per 3 Mb)
+	now take much longer than reading the assembly
+"""
+
+def time_me(method):
+    def wrapper(*args, **kw):
+        startTime = int(round(time.time() * 1000))
+        result = method(*args, **kw)
+        endTime = int(round(time.time() * 1000))
+
+        print(endTime - startTime,'ms')
+        return result
+
+    return wrapper
+
+#Function to write a synthetic assembly of about <mb> megabases
+def makeAssembly(out, mb, width=60):
+	random.seed(1)
+	block = "".join(random.choice("ACGTacgtN") for i in range(1000000))
+	contigs = [("chr%s"%(i+1), mb*90000) for i in range(10)]
+	contigs += [("scaffold%s"%(i+1), random.randint(100, max(100, mb*20))) for i in range(5000)]
+	with open(out, "w") as fh:
+		for name, length in contigs:
+			fh.write(">%s some description\n"%name)
+			for i in range(0, length, width):
+				start = i % (len(block)-width)
+				fh.write(block[start:start+min(width, length-i)]+"\n")
+
+#The reader used before, kept here for comparison
+def read_fasta_old(fas):
+	with open(fas) as file_object:
+		contig = ""
+		seq = ""
+		for line in file_object:
+			line = line.strip()
+			if not line:
+				continue
+			line = line.replace(" ","")
+			if line[0] == ">":
+				if contig:
+					yield([contig,seq])
+					contig = ""
+					seq = ""
+				contig = (line.replace(">",""))
+			else:
+				seq += line
+	if contig and seq:
+		yield([contig,seq])
+
+#Function to read all contigs, returning the total length
+def consume(contigs):
+	return(sum([len(seq) for name, seq in contigs]))
+
+@time_me
+def readOld(fas):
+	print("Old reader (seq += line):")
+	return(consume(read_fasta_old(fas)))
+
+@time_me
+def readLines(fas):
+	print("read_fasta, use_mmap=False:")
+	return(consume(aln_file_tools.read_fasta(fas, use_mmap=False)))
+
+@time_me
+def readMmap(fas):
+	print("read_fasta, mmap:")
+	return(consume(aln_file_tools.read_fasta(fas)))
+
+@time_me
+def readOffsets(fas):
+	print("fasta_offsets only:")
+	with open(fas, "rb") as fh, mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+		return(sum([end-start for header, start, end in aln_file_tools.fasta_offsets(mm)]))
+
+
+mb = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+if mb < 1:
+	sys.exit("Usage: benchmark_fasta.py [assembly size in Mb, at least 1; default 300]")
+tmp = tempfile.NamedTemporaryFile(suffix=".fasta", delete=False)
+tmp.close()
+makeAssembly(tmp.name, mb)
+
+total = readOld(tmp.name)
+assert readLines(tmp.name) == total
+assert readMmap(tmp.name) == total
+assert readOffsets(tmp.name) >= total
+
+#Check that all readers agree
+for old, lines, mapped in zip(read_fasta_old(tmp.name), aln_file_tools.read_fasta(tmp.name, use_mmap=False), aln_file_tools.read_fasta(tmp.name)):
+	assert old == lines == mapped
+
+#Also on headers indented with whitespace, and with other whitespace in lines
+with open(tmp.name, "w", newline="") as fh:
+	fh.write(">a\nACGT\n >b\nGGGG\n\t>c desc\r\nAC\tGT \r\n \x0c>d\rTT\n  \nAA\n")
+old = list(read_fasta_old(tmp.name))
+assert [name for name, seq in old] == ["a", "b", "cdesc", "d"]
+assert old == list(aln_file_tools.read_fasta(tmp.name, use_mmap=False)) == list(aln_file_tools.read_fasta(tmp.name))
+os.remove(tmp.name)
@@ -6,8 +6,12 @@ import time
 import unicodedata
 import os
 import sys
+import random
+import tempfile
+import tracemalloc
 import pandas as pd
 from collections import namedtuple
+from mrbait import gff3_parser
 
 """
 Benchmarking two different structures for yielding GFF Records
@@ -88,8 +92,25 @@ Conclusion:
 	the most memory efficient. Since we are writing a generator function
 	in this case, and only keeping one record in mem at a time, I think
 	I'll just go with the simplest method and use a native Python dict/
-	
 
+gff3_parser.read_gff (GFFRecord) vs. read_gff_features (GFFFeature, with
+__slots__), on a synthetic GFF of 500000 records, getting the fields used by
+loadGFF (seqid, type, start, end, Alias):
+
+read_gff (GFFRecord):
+4006 ms
+read_gff_features (GFFFeature):
+2265 ms
+Memory, all records kept (MB):
+  GFFRecord: 466.5
+  GFFFeature: 170.8
+
+Conclusions:
+-GFFRecord unquotes all 8 columns and splits every attribute into a dict;
+	GFFFeature only decodes 4 columns, only unquotes when there is a "%",
+	and only looks for Alias when asked, so ~1.8X faster
+-What is left is mostly reading and splitting lines, and creating objects
+-With __slots__ and attributes kept as text, records take ~1/3 the memory
 """
 
 def time_me(method):
@@ -349,3 +370,60 @@ print("Testing with slots container: 100000 iterations")
 read_gff_SLOTS(gff, 100000)
 print("Testing with slots container: 1000000 iterations")
 read_gff_SLOTS(gff, 1000000)
+
+print()
+
+#Function to write a synthetic GFF of n records, with a few escaped characters
+def makeGFF(out, n):
+	random.seed(1)
+	with open(out, "w") as fh:
+		fh.write("##gff-version 3\n")
+		for i in range(n):
+			attributes = "ID=feat%s;Parent=gene%s;Name=Gene%s"%(i, i//10, i//10)
+			if random.random() < 0.3:
+				attributes += ";Alias=alias%s"%(i%1000)
+			if random.random() < 0.05:
+				attributes += ";Note=some%20note"
+			start = random.randint(1, 1000000)
+			fh.write("\t".join(["chr"+str(i%50), "maker", random.choice(["gene", "mRNA", "exon", "CDS"]),
+				str(start), str(start+random.randint(1, 5000)), ".", random.choice("+-"), ".", attributes])+"\n")
+
+#Function to read all records, getting the fields used by loadGFF
+def consume(records):
+	count = 0
+	for rec in records:
+		fields = (rec.seqid, rec.type, rec.start, rec.end, rec.getAlias())
+		count += 1
+	return(count)
+
+@time_me
+def readRecords(g):
+	print("read_gff (GFFRecord):")
+	return(consume(gff3_parser.read_gff(g)))
+
+@time_me
+def readFeatures(g):
+	print("read_gff_features (GFFFeature):")
+	return(consume(gff3_parser.read_gff_features(g)))
+
+#Function to return memory (MB) used to keep all records of reader in a list
+def keepAll(reader, g):
+	tracemalloc.start()
+	records = list(reader(g))
+	size = tracemalloc.get_traced_memory()[0]
+	tracemalloc.stop()
+	return(size/1000000)
+
+n = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+tmp = tempfile.NamedTemporaryFile(suffix=".gff", delete=False)
+tmp.close()
+makeGFF(tmp.name, n)
+assert readRecords(tmp.name) == readFeatures(tmp.name)
+print("Memory, all records kept (MB):")
+print("  GFFRecord: %.1f"%keepAll(gff3_parser.read_gff, tmp.name))
+print("  GFFFeature: %.1f"%keepAll(gff3_parser.read_gff_features, tmp.name))
+
+#Check that both readers agree on every record
+for rec, feat in zip(gff3_parser.read_gff(tmp.name), gff3_parser.read_gff_features(tmp.name)):
+	assert (rec.seqid, rec.type, rec.start, rec.end, rec.getAlias()) == (feat.seqid, feat.type, feat.start, feat.end, feat.getAlias())
+os.remove(tmp.name)
@@ -0,0 +1,147 @@
+#!/usr/bin/python
+
+import sys
+import time
+import random
+import sqlite3
+from mrbait import manage_bait_db as m
+
+"""
+Query-plan regression test and benchmark for the secondary indexes in
+manage_bait_db.INDEXES, on a synthetic database (20000 loci, ~40000 targets
+with ~10% passing, ~100000 baits with ~20% passing, and 40000 GFF records).
+
+Each query is timed without and with indexes (after ANALYZE). With indexes,
+the query plan must use the listed index, otherwise an AssertionError is raised.
+
+Results:
+
+Query: add_gff_record locus lookup by chrom (x1000)
+  No indexes: 2341 ms
+  Indexes: 5 ms
+Query: getNumPassedTRs
+  No indexes: 7 ms
+  Indexes: 0 ms
+Query: getPassedTRs
+  No indexes: 10 ms
+  Indexes: 8 ms
+Query: regionFilterGFF by type
+  No indexes: 20 ms
+  Indexes: 16 ms
+Query: regionFilterGFF all
+  No indexes: 46 ms
+  Indexes: 56 ms
+Query: validateGFFRecords subquery
+  No indexes: 54 ms
+  Indexes: 25 ms
+Query: getPrintBaits
+  No indexes: 65 ms
+  Indexes: 84 ms
+
+Conclusions:
+-add_gff_record looks up the locus of each GFF record by chrom; without
+	loci_chrom each lookup scans all of loci (loadGFF maps chroms to loci in
+	Python, so it doesn't need the index)
+-regionFilterGFF reads passing GFF records (of a type) straight from the
+	covering gff_pass_type index; this helps a little when the table holds
+	several types, and is about even when reading all of them
+-Pass counts become index-only; the pass indexes help reads most after
+	Steps 3 and 5, when most rows have failed. At 20% passing, getPrintBaits
+	is about even (within noise), since each bait row still has to be fetched
+"""
+
+def time_me(method):
+    def wrapper(*args, **kw):
+        startTime = int(round(time.time() * 1000))
+        result = method(*args, **kw)
+        endTime = int(round(time.time() * 1000))
+
+        print(endTime - startTime,'ms')
+        return result
+
+    return wrapper
+
+#Function to build a synthetic database shaped like one after Step 5
+def buildDB(conn, nloci):
+	random.seed(1)
+	m.init_new_db(conn)
+	loci = list()
+	for i in range(nloci):
+		seq = "".join(random.choice("ACGT") for j in range(200))
+		loci.append(m.locus_row(5, seq, 1, "chr"+str(i)))
+	m.add_locus_records(conn, loci)
+	regions = list()
+	for i in range(nloci*2):
+		start = random.randint(0, 100)
+		regions.append(m.region_row(random.randint(1, nloci), start, start+80, "A"*80,
+			{"*":0, "N":0, "-":0}, {"*":0, "N":0, "-":0}, 0, 40))
+	m.add_region_records(conn, regions)
+	baits = list()
+	for i in range(nloci*5):
+		baits.append(m.bait_row(random.randint(1, nloci*2), "A"*80, 0, 80, 0, 40))
+	m.add_bait_records(conn, baits)
+	gffs = list()
+	for i in range(nloci*2):
+		start = random.randint(0, 300)
+		gffs.append(m.gff_row(random.randint(1, nloci), random.choice(["exon", "gene", "cds"]), start, start+50, "NULL"))
+	m.add_gff_records(conn, gffs)
+	cur = conn.cursor()
+	cur.execute("UPDATE regions SET pass=0 WHERE random() % 10 != 0")
+	cur.execute("UPDATE baits SET pass=0 WHERE random() % 5 != 0")
+	conn.commit()
+
+#Queries (from manage_bait_db) and the index each must use
+queries = [
+	("add_gff_record locus lookup by chrom (x1000)", "SELECT id FROM loci WHERE chrom = ?", "loci_chrom"),
+	("getNumPassedTRs", "SELECT count(*) FROM regions WHERE pass=1", "regions_pass"),
+	("getPassedTRs", "SELECT regid, sequence FROM regions WHERE pass=1", "regions_pass"),
+	("regionFilterGFF by type", "SELECT locid, start, stop FROM gff WHERE pass = 1 AND type = ?", "gff_pass_type"),
+	("regionFilterGFF all", "SELECT locid, start, stop FROM gff WHERE pass = 1", "gff_pass_type"),
+	("validateGFFRecords subquery", """SELECT gffid FROM gff INNER JOIN loci ON gff.locid = loci.id
+		WHERE (gff.start > loci.length) AND (gff.stop > loci.length)""", None),
+	("getPrintBaits", """SELECT locid, baits.regid, baitid, baits.sequence
+		FROM baits INNER JOIN regions ON baits.regid = regions.regid
+		WHERE baits.pass=1""", "baits_pass")
+]
+
+#Function to get parameters for a query
+def queryParams(sql, i):
+	if "chrom = ?" in sql:
+		return(("chr"+str(i),))
+	elif "type = ?" in sql:
+		return(("exon",))
+	return(tuple())
+
+@time_me
+def runQuery(conn, label, sql):
+	print("  %s: "%label, end="")
+	reps = 1000 if "chrom = ?" in sql else 1
+	for i in range(reps):
+		conn.execute(sql, queryParams(sql, i)).fetchall()
+
+#Function to return query plan as a single string
+def queryPlan(conn, sql):
+	plan = conn.execute("EXPLAIN QUERY PLAN "+sql, queryParams(sql, 0)).fetchall()
+	return(" | ".join([row[-1] for row in plan]))
+
+
+nloci = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+conn = sqlite3.connect(":memory:")
+buildDB(conn, nloci)
+
+for label, sql, index in queries:
+	print("Query:",label)
+	m.drop_indexes(conn)
+	runQuery(conn, "No indexes", sql)
+	m.create_indexes(conn)
+	m.analyze_db(conn)
+	runQuery(conn, "Indexes", sql)
+	plan = queryPlan(conn, sql)
+	if index is not None:
+		assert index in plan, "Query <%s> does not use index %s: %s"%(label, index, plan)
+
+#Dropping must remove every index, and creating must be idempotent
+m.create_indexes(conn)
+m.drop_indexes(conn)
+assert conn.execute("SELECT count(*) FROM sqlite_master WHERE type='index' AND sql IS NOT NULL").fetchone()[0] == 0
+conn.close()
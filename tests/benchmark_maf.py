@@ -0,0 +1,101 @@
+#!/usr/bin/python
+
+import os
+import sys
+import time
+import tempfile
+from Bio import AlignIO
+from mrbait import aln_file_tools
+from mrbait import alignment_tools as a
+
+"""
+Benchmarking MAF parsing with Bio.AlignIO vs. the native aln_file_tools.read_maf
+reader, using examples/example.maf concatenated to a larger file.
+
+Results (example.maf x 5000, 30000 alignment blocks):
+
+Reading only, AlignIO.parse:
+1433 ms
+Reading only, read_maf:
+426 ms
+Reading + consensus, AlignIO.parse + make_consensus (old path):
+64206 ms
+Reading + consensus, read_maf + make_consensus_numpy (new path):
+6249 ms
+
+Conclusions:
+-Most of the AlignIO cost is building SeqRecord/MultipleSeqAlignment objects
+	and annotations that mrbait never uses
+-read_maf gives the byte matrix directly to the vectorized consensus caller,
+	so nothing has to be re-encoded per column
+-Overall, Step 1 on MAF inputs is ~10X faster with the new path
+"""
+
+def time_me(method):
+    def wrapper(*args, **kw):
+        startTime = int(round(time.time() * 1000))
+        result = method(*args, **kw)
+        endTime = int(round(time.time() * 1000))
+
+        print(endTime - startTime,'ms')
+        return result
+
+    return wrapper
+
+#Function to build a larger MAF by repeating the blocks of a small one
+def scaleMAF(maf, reps, out):
+	header = ""
+	blocks = ""
+	with open(maf) as fh:
+		for line in fh:
+			if line.startswith("#"):
+				header += line
+			else:
+				blocks += line
+	with open(out, "w") as fh:
+		fh.write(header)
+		for i in range(reps):
+			fh.write(blocks)
+			fh.write("\n")
+
+@time_me
+def readAlignIO(maf):
+	print("Reading only, AlignIO.parse:")
+	for aln in AlignIO.parse(maf, "maf"):
+		cov = len(aln)
+		alen = aln.get_alignment_length()
+
+@time_me
+def readNative(maf):
+	print("Reading only, read_maf:")
+	for cov, aln in aln_file_tools.read_maf(maf):
+		alen = aln.shape[1]
+
+@time_me
+def consensusAlignIO(maf):
+	print("Reading + consensus, AlignIO.parse + make_consensus (old path):")
+	for aln in AlignIO.parse(maf, "maf"):
+		a.make_consensus(aln, 0.1, 0.1)
+
+@time_me
+def consensusNative(maf):
+	print("Reading + consensus, read_maf + make_consensus_numpy (new path):")
+	for cov, aln in aln_file_tools.read_maf(maf):
+		a.make_consensus_numpy(aln, 0.1, 0.1)
+
+
+maf = os.path.join(os.path.dirname(os.path.realpath(__file__)), "..", "examples", "example.maf")
+reps = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+tmp = tempfile.NamedTemporaryFile(suffix=".maf", delete=False)
+tmp.close()
+scaleMAF(maf, reps, tmp.name)
+
+readAlignIO(tmp.name)
+readNative(tmp.name)
+consensusAlignIO(tmp.name)
+consensusNative(tmp.name)
+
+#Check that both paths agree
+for aln, (cov, mat) in zip(AlignIO.parse(tmp.name, "maf"), aln_file_tools.read_maf(tmp.name)):
+	assert a.make_consensus(aln, 0.1, 0.1) == a.make_consensus_numpy(mat, 0.1, 0.1)
+os.remove(tmp.name)
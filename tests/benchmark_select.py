@@ -0,0 +1,151 @@
+#!/usr/bin/python
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+from mrbait import manage_bait_db as m
+
+"""
+Benchmarking conflict block resolution by counts (regionSelect_SNP, _MINBAD,
+_MINSNP), comparing the old parseCountsMin/parseCountsMax, which loop over each
+block with iterrows() and then set choose with a full-column scan per block,
+against the current versions (chooseBestCounts), which use groupby().transform.
+Synthetic conflicts tables: blocks of 1-6 TRs in random order, counts 0-5 so
+that ties and all-zero blocks are common.
+
+Results:
+
+99998 conflict rows, min:
+  New: 40 ms
+  Old: 25603 ms
+99998 conflict rows, max:
+  New: 35 ms
+  Old: 22433 ms
+999999 conflict rows, min:
+  New: 539 ms
+999999 conflict rows, max:
+  New: 518 ms
+
+Conclusions:
+-The old versions are O(blocks x rows): ~30000 blocks already take ~25 s, so
+	10^6 rows (~300000 blocks) was not run with them (est. >40 min)
+-The new versions are a handful of grouped passes over the table, so linear
+	and ~600X faster at 10^5 rows
+-Both give the same choose for every row, including tied and all-zero blocks
+"""
+
+def time_me(method):
+    def wrapper(*args, **kw):
+        startTime = int(round(time.time() * 1000))
+        result = method(*args, **kw)
+        endTime = int(round(time.time() * 1000))
+
+        print(endTime - startTime,'ms')
+        return result
+
+    return wrapper
+
+#The versions used before, kept here for comparison
+def parseCountsMin_old(df):
+	groups = df.groupby("conflict_block")
+	for group, group_df in groups:
+		if group_df.shape[0] == 1:
+			for name, row in group_df.iterrows():
+				df.loc[name, "choose"] = 1
+		else:
+			chosen_ones = []
+			best = 0
+			track = 0
+			for name, row in group_df.iterrows():
+				if track == 0:
+					best = row["counts"]
+					chosen_ones = [name]
+					track = 1
+				else:
+					if row["counts"] > best:
+						continue
+					elif row["counts"] < best:
+						best = row["counts"]
+						chosen_ones = [name]
+					elif row["counts"] == best:
+						chosen_ones.append(name)
+			if len(chosen_ones) == 1:
+				df.loc[df["conflict_block"] == group, "choose"] = 0
+				df.loc[chosen_ones[0], "choose"] = 1
+			elif len(chosen_ones) > 1:
+				df.loc[df["conflict_block"] == group, "choose"] = 0
+				for i in chosen_ones:
+					df.loc[i, "choose"] = "NULL"
+	return(df)
+
+def parseCountsMax_old(df):
+	groups = df.groupby("conflict_block")
+	for group, group_df in groups:
+		if group_df.shape[0] == 1:
+			for name, row in group_df.iterrows():
+				df.loc[name, "choose"] = 1
+		else:
+			chosen_ones = []
+			best = 0
+			for name, row in group_df.iterrows():
+				if row["counts"] < best:
+					continue
+				elif row["counts"] > best:
+					best = row["counts"]
+					chosen_ones = [name]
+				elif row["counts"] == best and best != 0:
+					chosen_ones.append(name)
+			if len(chosen_ones) == 1:
+				df.loc[df["conflict_block"] == group, "choose"] = 0
+				df.loc[chosen_ones[0], "choose"] = 1
+			elif len(chosen_ones) > 1:
+				df.loc[df["conflict_block"] == group, "choose"] = 0
+				for i in chosen_ones:
+					df.loc[i, "choose"] = "NULL"
+	return(df)
+
+#Function to make a conflicts dataframe of about n rows, as read by regionSelect_*
+def makeConflicts(n):
+	rng = np.random.default_rng(1)
+	sizes = rng.integers(1, 7, size=n//3)
+	sizes = sizes[:np.searchsorted(np.cumsum(sizes), n)]
+	blocks = np.repeat(np.arange(len(sizes))*2 + 100, sizes)
+	rng.shuffle(blocks)
+	return(pd.DataFrame({"regid" : np.arange(1, len(blocks)+1),
+		"conflict_block" : blocks,
+		"choose" : "NULL",
+		"counts" : rng.integers(0, 6, size=len(blocks))}))
+
+@time_me
+def runOld(df, best):
+	print("  Old: ", end="")
+	if best == "min":
+		return(parseCountsMin_old(df))
+	return(parseCountsMax_old(df))
+
+@time_me
+def runNew(df, best):
+	print("  New: ", end="")
+	if best == "min":
+		return(m.parseCountsMin(df))
+	return(m.parseCountsMax(df))
+
+
+#Old versions are only timed up to <max_old> rows
+max_old = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+for n in [100000, 1000000]:
+	df = makeConflicts(n)
+	for best in ["min", "max"]:
+		print("%s conflict rows, %s:"%(len(df), best))
+		new = runNew(df.copy(), best)
+		if n <= max_old:
+			old = runOld(df.copy(), best)
+			assert old["choose"].tolist() == new["choose"].tolist()
+
+#Check small tables against the old versions
+for seed in range(20):
+	df = makeConflicts(2000)
+	df["counts"] = np.random.default_rng(seed).integers(0, 3, size=len(df))
+	assert parseCountsMin_old(df.copy())["choose"].tolist() == m.parseCountsMin(df.copy())["choose"].tolist()
+	assert parseCountsMax_old(df.copy())["choose"].tolist() == m.parseCountsMax(df.copy())["choose"].tolist()
@@ -0,0 +1,165 @@
+#!/usr/bin/python
+
+import os
+import sys
+import time
+import random
+import tempfile
+from mrbait import vcf_tools
+from mrbait import misc_utils as utils
+from mrbait import alignment_tools as aln
+
+"""
+Benchmarking vcf_tools.make_consensus_from_vcf, which used to rebuild the
+whole contig string for every variant (utils.stringSubstitute), against the
+current version, which edits a bytearray in place. Synthetic 2 Mb contig with
+soft-masked and N runs; variants at random positions (10% at N bases, with N or
+gap ALT alleles), parsed with PyVCF.
+
+Results (2 Mb contig):
+
+1000 variants, vcfALT=False:
+  Old: 484 ms
+  New: 10 ms
+1000 variants, vcfALT=True:
+  Old: 563 ms
+  New: 10 ms
+10000 variants, vcfALT=False:
+  Old: 5387 ms
+  New: 83 ms
+10000 variants, vcfALT=True:
+  Old: 5810 ms
+  New: 100 ms
+50000 variants, vcfALT=False:
+  Old: 26089 ms
+  New: 356 ms
+50000 variants, vcfALT=True:
+  Old: 29195 ms
+  New: 355 ms
+
+Conclusions:
+-The old version is O(variants x contig length): ~0.5 ms per variant here,
+	growing with the contig, so a chromosome with a million SNPs never finishes
+-The new version is linear; what is left is the per-record allele logic
+-Both give identical consensus sequences in both --vcfALT modes
+"""
+
+def time_me(method):
+    def wrapper(*args, **kw):
+        startTime = int(round(time.time() * 1000))
+        result = method(*args, **kw)
+        endTime = int(round(time.time() * 1000))
+
+        print(endTime - startTime,'ms')
+        return result
+
+    return wrapper
+
+#The version used before, kept here for comparison
+def make_consensus_from_vcf_old(ref, chrom, records, thresh, altRef):
+	consensus = ""
+	for rec in records:
+		current_ref = ""
+		if consensus:
+			current_ref = consensus
+		else:
+			current_ref = ref
+		nucs = aln.get_iupac(current_ref[rec.POS-1].upper())
+		rec_alt = []
+		for x in rec.ALT:
+			rec_alt += str(x).upper()
+		cons = ""
+		chosen = 0
+		if current_ref[rec.POS-1] in ["N", "n", "-"]:
+			if altRef:
+				if "-" in rec_alt:
+					i = (rec_alt).index("-")
+					prop = rec.aaf[i]
+					if float(prop) >= float(thresh):
+						cons = "-"
+						chosen = 1
+				if "N" in rec_alt:
+					i = (rec_alt).index("N")
+					prop = rec.aaf[i]
+					if float(prop) >= float(thresh):
+						cons = "N"
+						chosen = 1
+				if chosen == 0:
+					nucs = rec_alt
+					temp = utils.listToSortUniqueString(nucs)
+					cons = aln.reverse_iupac(temp)
+					chosen = 1
+			else:
+				continue
+		else:
+			nucs += rec_alt
+			temp = utils.listToSortUniqueString(nucs)
+			cons = aln.reverse_iupac(temp)
+			chosen = 1
+		if chosen == 1 and cons:
+			if current_ref[rec.POS-1].islower():
+				consensus = utils.stringSubstitute(current_ref, (rec.POS-1), cons.lower())
+			else:
+				consensus = utils.stringSubstitute(current_ref, (rec.POS-1), cons.upper())
+	return(consensus)
+
+#Function to make a contig with soft-masked and N runs
+def makeContig(length):
+	random.seed(1)
+	seq = list()
+	while len(seq) < length:
+		r = random.random()
+		if r < 0.005:
+			seq.extend("N"*random.randint(1, 50))
+		elif r < 0.01:
+			seq.extend([random.choice("acgt") for i in range(random.randint(1, 200))])
+		else:
+			seq.append(random.choice("ACGT"))
+	return("".join(seq[:length]))
+
+#Function to write a VCF of k variants on a contig, and return its records
+def makeRecords(contig, k, out):
+	random.seed(k)
+	with open(out, "w") as fh:
+		fh.write("##fileformat=VCFv4.2\n")
+		fh.write("##FORMAT=<ID=GT,Number=1,Type=String,Description=\"Genotype\">\n")
+		fh.write("#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1\tS2\tS3\n")
+		ns = [i for i, c in enumerate(contig) if c in "Nn"]
+		bases = [i for i, c in enumerate(contig) if c not in "Nn"]
+		#At most as many variants as the contig has bases (of each kind)
+		positions = random.sample(bases, min(k - k//10, len(bases))) + random.sample(ns, min(k//10, len(ns)))
+		for pos in sorted(positions):
+			base = contig[pos].upper()
+			if base == "N":
+				alt = random.choice(["A", "C,G", "N", "-"])
+			else:
+				alt = ",".join(random.sample([b for b in "ACGT" if b != base], random.choice([1, 1, 2])))
+			gts = "\t".join([random.choice(["0/0", "0/1", "1/1", "0/2", "1/2"]) for i in range(3)])
+			fh.write("chr1\t%s\t.\t%s\t%s\t.\tPASS\t.\tGT\t%s\n"%(pos+1, base, alt, gts))
+	return([rec for group in vcf_tools.read_vcf(out) for rec in group])
+
+@time_me
+def runOld(contig, records, altRef):
+	print("  Old: ", end="")
+	return(make_consensus_from_vcf_old(contig, "chr1", records, 0.5, altRef))
+
+@time_me
+def runNew(contig, records, altRef):
+	print("  New: ", end="")
+	return(vcf_tools.make_consensus_from_vcf(contig, "chr1", records, 0.5, altRef))
+
+
+length = int(sys.argv[1]) if len(sys.argv) > 1 else 2000000
+if length < 1:
+	sys.exit("Usage: benchmark_vcf.py [contig length, at least 1; default 2000000]")
+contig = makeContig(length)
+tmp = tempfile.NamedTemporaryFile(suffix=".vcf", delete=False)
+tmp.close()
+for k in [1000, 10000, 50000]:
+	records = makeRecords(contig, k, tmp.name)
+	for altRef in [False, True]:
+		print("%s variants, vcfALT=%s:"%(len(records), altRef))
+		old = runOld(contig, records, altRef)
+		new = runNew(contig, records, altRef)
+		assert old == new
+os.remove(tmp.name)